@@ -12,7 +12,7 @@ class CustomUserAdmin(UserAdmin):
         (None, {'fields': ('username', 'password')}),
         (_('Personal info'), {'fields': ('first_name', 'last_name', 'email', 'phone_number', 'address')}),
         (_('Role'), {'fields': ('role',)}),
-        (_('Customer info'), {'fields': ('customer_id', 'gas_meter_id', 'service_address')}),
+        (_('Customer info'), {'fields': ('customer_id', 'gas_meter_id', 'service_address', 'service_region', 'request_shard')}),
         (_('Staff info'), {'fields': ('department', 'employee_id')}),
         (_('Permissions'), {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
         (_('Important dates'), {'fields': ('last_login', 'date_joined')}),
@@ -20,6 +20,7 @@ class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'is_active')
     list_filter = ('role', 'is_active')
     search_fields = ('username', 'email', 'first_name', 'last_name', 'customer_id', 'gas_meter_id')
+    readonly_fields = ('request_shard',)
     
     def get_fieldsets(self, request, obj=None):
         fieldsets = super().get_fieldsets(request, obj)
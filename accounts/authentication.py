@@ -0,0 +1,22 @@
+# accounts/authentication.py
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication
+
+from . import throttling
+
+
+class ThrottledBasicAuthentication(BasicAuthentication):
+    """
+    HTTP Basic authentication under the login throttles: wrong credentials
+    count as failed logins, and throttled clients are refused before their
+    password is hashed
+    """
+    def authenticate_credentials(self, userid, password, request=None):
+        wait = throttling.login_wait(request, userid)
+        if wait:
+            raise exceptions.Throttled(wait)
+        try:
+            return super().authenticate_credentials(userid, password, request)
+        except exceptions.AuthenticationFailed:
+            throttling.login_failed(request, userid)
+            raise
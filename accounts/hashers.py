@@ -0,0 +1,88 @@
+# accounts/hashers.py
+"""
+Password hashing cost control.
+
+PBKDF2PasswordHasher is Django's with its iteration count read from
+PASSWORD_HASH_ITERATIONS, so the cost can be raised (or lowered) per
+deployment. A stored hash made at another cost is rehashed at the
+configured one after the user's next successful login; ``upgrade_later()``
+does that on a background thread so the login response does not pay for a
+second hash.
+
+A new hash would end every session signed with the old one. So the upgrade
+keeps the old session signature (an HMAC of the old hash under SECRET_KEY,
+``UserProfile.pre_upgrade_session_hash``); for SESSION_COOKIE_AGE it still
+verifies a session, which Django then re-signs with the new hash. The old
+hash itself is not kept, so a leaked table cannot be cracked at the old
+cost.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('accounts.hashers')
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 at PASSWORD_HASH_ITERATIONS; same algorithm name, so
+    existing hashes verify unchanged
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or hashers.PBKDF2PasswordHasher.iterations
+
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def upgrade_later(user, raw_password):
+    """
+    Rehash ``user``'s just verified password at the current cost; at most
+    one upgrade per user is queued
+    """
+    workers = getattr(settings, 'PASSWORD_UPGRADE_WORKERS', 1)
+    if not workers:
+        _upgrade(user.pk, user.password, raw_password)
+        return
+    global _executor
+    with _lock:
+        if user.pk in _pending:
+            return
+        _pending.add(user.pk)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-upgrade')
+    _executor.submit(_run, user.pk, user.password, raw_password)
+
+
+def _run(pk, encoded, raw_password):
+    try:
+        _upgrade(pk, encoded, raw_password)
+    except Exception:
+        logger.exception('Password hash upgrade failed for user %s', pk)
+    finally:
+        with _lock:
+            _pending.discard(pk)
+        connections.close_all()
+
+
+def _upgrade(pk, encoded, raw_password):
+    from .models import UserProfile
+
+    upgraded = hashers.make_password(raw_password)
+    with transaction.atomic():
+        # Skipped when the password was changed meanwhile
+        user = UserProfile.objects.select_for_update().filter(pk=pk, password=encoded).first()
+        if user is None:
+            return
+        user.pre_upgrade_session_hash = user.get_session_auth_hash()
+        user.password = upgraded
+        user.password_upgraded_at = timezone.now()
+        user.save(update_fields=['password', 'pre_upgrade_session_hash', 'password_upgraded_at'])
@@ -0,0 +1,168 @@
+# accounts/management/commands/benchmark_login.py
+import logging
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts.models import UserProfile
+from dashboard import benchmarks
+
+LOGIN_URL = benchmarks.API + '/accounts/users/login/'
+LOGOUT_URL = benchmarks.API + '/accounts/users/logout/'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure legitimate login latency through the Django test client, idle and '
+        'while attacker threads send failed logins at a given rate (against the '
+        'configured database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=60, help='Seconds measured per phase')
+        parser.add_argument(
+            '--ramp', type=float, default=0,
+            help='Seconds the attack runs before measuring (the throttles engage once failures add up)'
+        )
+        parser.add_argument('--attack-rate', type=int, default=10_000, help='Attempts per minute')
+        parser.add_argument('--attackers', type=int, default=8, help='Attacker threads')
+        parser.add_argument('--attacker-ips', type=int, default=10, help='Client addresses the attack comes from')
+        parser.add_argument('--login-interval', type=float, default=0.5, help='Seconds between legitimate logins')
+        parser.add_argument('--slice', type=float, default=10, help='Seconds per row of the latency timeline')
+        parser.add_argument(
+            '--unthrottled', action='store_true',
+            help='Also run the attack with the login throttles off, for comparison'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['attackers'] < 1 or options['attack_rate'] < 1:
+            raise CommandError('--attackers and --attack-rate must be positive')
+        user, created = UserProfile.objects.get_or_create(
+            username='bench_customer',
+            defaults={'role': UserProfile.CUSTOMER, 'first_name': 'Bench', 'last_name': 'Customer'}
+        )
+        if created or not user.check_password(benchmarks.BENCH_PASSWORD):
+            user.set_password(benchmarks.BENCH_PASSWORD)
+            user.save()
+        # Stuffed credentials: real usernames, wrong passwords
+        usernames = list(
+            UserProfile.objects.exclude(pk=user.pk).order_by('-id').values_list('username', flat=True)[:1000]
+        ) or [f'stuffed{n}' for n in range(1000)]
+
+        phases = [('idle', None, {}), ('attack', 0, {})]
+        if options['unthrottled']:
+            phases.append(('attack-unthrottled', 1, {
+                'LOGIN_IP_FAILURE_RATE': None, 'LOGIN_USERNAME_FAILURE_RATE': None,
+            }))
+
+        # Each refused or failed attempt would log a warning
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        setup_test_environment()
+        try:
+            for name, ip_block, overrides in phases:
+                with override_settings(**overrides):
+                    self._report(name, options, self._phase(options, usernames, ip_block))
+        finally:
+            teardown_test_environment()
+            request_logger.setLevel(level)
+
+    def _phase(self, options, usernames, ip_block):
+        stop = threading.Event()
+        attack = {'sent': 0, 'refused': 0, 'checked': 0, 'other': 0}
+        lock = threading.Lock()
+        threads = []
+        if ip_block is not None:
+            # One address block per attack phase so earlier phases leave no
+            # throttle state behind
+            ips = [f'203.0.{113 + ip_block}.{n % 254 + 1}' for n in range(options['attacker_ips'])]
+            interval = options['attackers'] * 60 / options['attack_rate']
+            for n in range(options['attackers']):
+                thread = threading.Thread(
+                    target=self._attacker,
+                    args=(random.Random(options['seed'] + n), usernames, ips, interval, stop, attack, lock),
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+            if options['ramp']:
+                time.sleep(options['ramp'])
+                with lock:
+                    ramp = dict(attack)
+
+        client = Client(raise_request_exception=False)
+        timeline = []
+        failures = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < options['duration']:
+            began = time.perf_counter()
+            response = client.post(LOGIN_URL, {'username': 'bench_customer', 'password': benchmarks.BENCH_PASSWORD})
+            elapsed = time.perf_counter() - began
+            if response.status_code == 200:
+                client.post(LOGOUT_URL)
+            else:
+                failures += 1
+            timeline.append((began - start, elapsed * 1000))
+            time.sleep(max(options['login_interval'] - elapsed, 0))
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if threads and options['ramp']:
+            # Only attempts made while measuring
+            attack = {key: count - ramp[key] for key, count in attack.items()}
+        return {'timeline': timeline, 'failures': failures, 'attack': attack, 'seconds': elapsed}
+
+    def _attacker(self, rng, usernames, ips, interval, stop, attack, lock):
+        client = Client(raise_request_exception=False)
+        next_at = time.perf_counter() + rng.random() * interval
+        try:
+            while not stop.is_set():
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    stop.wait(delay)
+                    continue
+                next_at = max(next_at + interval, time.perf_counter() - interval)
+                response = client.post(
+                    LOGIN_URL,
+                    {'username': rng.choice(usernames), 'password': f'guess-{rng.getrandbits(32):08x}'},
+                    REMOTE_ADDR=rng.choice(ips)
+                )
+                result = {429: 'refused', 401: 'checked'}.get(response.status_code, 'other')
+                with lock:
+                    attack['sent'] += 1
+                    attack[result] += 1
+        finally:
+            connections.close_all()
+
+    def _report(self, name, options, result):
+        latencies = [ms for _, ms in result['timeline']]
+        attack = result['attack']
+        self.stdout.write(f"== {name}")
+        self.stdout.write(
+            f"Legitimate logins: {len(latencies)} ({result['failures']} failed)  "
+            f"p50 {benchmarks.percentile(latencies, 50):.1f}ms  "
+            f"p95 {benchmarks.percentile(latencies, 95):.1f}ms  max {max(latencies):.1f}ms"
+        )
+        if attack['sent']:
+            self.stdout.write(
+                f"Attack: {attack['sent']} attempts ({attack['sent'] * 60 / result['seconds']:,.0f}/min), "
+                f"{attack['refused']} refused by the throttles, {attack['checked']} passwords checked, "
+                f"{attack['other']} other responses"
+            )
+        self.stdout.write(f"{'from s':>8} {'logins':>7} {'p50 ms':>9} {'p95 ms':>9}")
+        slices = {}
+        for at, ms in result['timeline']:
+            slices.setdefault(int(at // options['slice']), []).append(ms)
+        for index, values in sorted(slices.items()):
+            self.stdout.write(
+                f"{index * options['slice']:>8.0f} {len(values):>7} "
+                f"{benchmarks.percentile(values, 50):>9.1f} {benchmarks.percentile(values, 95):>9.1f}"
+            )
@@ -1,7 +1,7 @@
 # accounts/management/commands/create_sample_data.py
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from service_requests.models import ServiceCategory, ServiceRequest
+from service_requests.models import ServiceCategory, ServiceRequest, SLAPolicy
 from accounts.models import UserProfile
 
 User = get_user_model()
@@ -88,7 +88,8 @@ class Command(BaseCommand):
             {
                 'name': 'Gas Leak',
                 'description': 'Report gas leaks or suspected gas leaks',
-                'slug': 'gas-leak'
+                'slug': 'gas-leak',
+                'is_emergency': True
             },
             {
                 'name': 'Service Connection',
@@ -98,7 +99,8 @@ class Command(BaseCommand):
             {
                 'name': 'Billing Inquiry',
                 'description': 'Questions about gas bills and payments',
-                'slug': 'billing-inquiry'
+                'slug': 'billing-inquiry',
+                'requires_field_visit': False
             },
             {
                 'name': 'Meter Reading',
@@ -108,7 +110,8 @@ class Command(BaseCommand):
             {
                 'name': 'Emergency Service',
                 'description': 'Emergency gas-related issues',
-                'slug': 'emergency-service'
+                'slug': 'emergency-service',
+                'is_emergency': True
             },
             {
                 'name': 'Maintenance',
@@ -125,6 +128,14 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(f'Created category: {category.name}')
 
+        # Safety-critical categories get tight resolution targets
+        for slug in ['gas-leak', 'emergency-service']:
+            SLAPolicy.objects.get_or_create(
+                category=ServiceCategory.objects.get(slug=slug),
+                priority='',
+                defaults={'resolution_minutes': 2 * 60}
+            )
+
         # Create sample service requests
         customers = User.objects.filter(role=UserProfile.CUSTOMER)
         categories = ServiceCategory.objects.all()
@@ -154,9 +165,9 @@ class Command(BaseCommand):
         ]
 
         for req_data in sample_requests:
-            ServiceRequest.objects.get_or_create(
+            # Through the customer so it lands in their shard
+            req_data['customer'].service_requests.get_or_create(
                 title=req_data['title'],
-                customer=req_data['customer'],
                 defaults=req_data
             )
 
@@ -0,0 +1,403 @@
+# accounts/management/commands/generate_load_data.py
+"""
+Generate a large, deterministic synthetic dataset for load testing.
+
+Rows are built in fixed-size chunks with explicit primary keys, so every
+chunk is independent: it is seeded from ``--seed`` and its index, can be
+generated by any worker process, and references customers, agents and
+requests by computed id without querying the database. Inserts go through
+``bulk_create`` one batch at a time, so on SQLite a worker holds the single
+writer lock only while its INSERT runs, not while the next batch is built.
+"""
+import multiprocessing
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from accounts.normalize import normalize_address, normalize_meter_id, normalize_phone
+from service_requests import geo
+from service_requests.models import (
+    ServiceCategory,
+    ServiceRequest,
+    RequestComment,
+    RequestStatusHistory
+)
+
+# Relative weights, roughly matching production mix
+CATEGORY_WEIGHTS = {
+    'gas-leak': 4,
+    'service-connection': 15,
+    'billing-inquiry': 40,
+    'meter-reading': 20,
+    'emergency-service': 3,
+    'maintenance': 18,
+}
+STATUS_WEIGHTS = {
+    ServiceRequest.NEW: 4,
+    ServiceRequest.ASSIGNED: 3,
+    ServiceRequest.IN_PROGRESS: 4,
+    ServiceRequest.ON_HOLD: 2,
+    ServiceRequest.COMPLETED: 12,
+    ServiceRequest.CLOSED: 70,
+    ServiceRequest.CANCELLED: 5,
+}
+PRIORITY_WEIGHTS = {
+    ServiceRequest.LOW: 30,
+    ServiceRequest.MEDIUM: 45,
+    ServiceRequest.HIGH: 20,
+    ServiceRequest.URGENT: 5,
+}
+
+# Status path each final status is reached through, for history rows
+STATUS_PATHS = {
+    ServiceRequest.NEW: [],
+    ServiceRequest.ASSIGNED: [ServiceRequest.ASSIGNED],
+    ServiceRequest.IN_PROGRESS: [ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS],
+    ServiceRequest.ON_HOLD: [ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS, ServiceRequest.ON_HOLD],
+    ServiceRequest.COMPLETED: [ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS, ServiceRequest.COMPLETED],
+    ServiceRequest.CLOSED: [
+        ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS, ServiceRequest.COMPLETED, ServiceRequest.CLOSED
+    ],
+    ServiceRequest.CANCELLED: [ServiceRequest.CANCELLED],
+}
+
+STREETS = ['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr', 'Cedar Ln', 'Elm St', 'Lake Blvd', 'Hill Ct']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Patel', 'Kowalski', 'Okafor', 'Nguyen', 'Silva', 'Cohen', 'Berg']
+TITLES = {
+    'gas-leak': ['Smell of gas near meter', 'Suspected gas leak in basement', 'Hissing sound at gas line'],
+    'service-connection': ['New service connection', 'Disconnect service on move-out', 'Transfer service'],
+    'billing-inquiry': ['High gas bill', 'Question about last invoice', 'Payment not applied'],
+    'meter-reading': ['Estimated meter reading', 'Meter access issue', 'Meter reading looks wrong'],
+    'emergency-service': ['No gas supply', 'Carbon monoxide alarm', 'Damaged gas line'],
+    'maintenance': ['Schedule appliance check', 'Regulator maintenance', 'Pipe inspection request'],
+}
+# Service area the synthetic addresses are spread over: centre and half-width in degrees
+SERVICE_AREA = (39.74, -104.99, 0.25)
+REQUEST_ID_NAMESPACE = uuid.UUID('6f1c2b8e-5d0a-4b7e-9a51-3c2f0e8d4a17')
+COMMENT_TEXTS = [
+    'Technician scheduled for tomorrow morning.',
+    'Customer confirmed availability.',
+    'Waiting on parts from the depot.',
+    'Called the customer, no answer.',
+    'Issue resolved on site.',
+    'Please provide a photo of the meter.',
+]
+
+
+def _insert(model, rows, batch_size):
+    for i in range(0, len(rows), batch_size):
+        model.objects.bulk_create(rows[i:i + batch_size])
+
+
+@contextmanager
+def _historical_timestamps():
+    """
+    Let bulk_create keep the generated created_at/updated_at values
+    """
+    fields = [
+        (ServiceRequest._meta.get_field('created_at'), 'auto_now_add'),
+        (ServiceRequest._meta.get_field('updated_at'), 'auto_now'),
+        (RequestComment._meta.get_field('created_at'), 'auto_now_add'),
+        (RequestStatusHistory._meta.get_field('changed_at'), 'auto_now_add'),
+    ]
+    saved = [(field, attr, getattr(field, attr)) for field, attr in fields]
+    for field, attr in fields:
+        setattr(field, attr, False)
+    try:
+        yield
+    finally:
+        for field, attr, value in saved:
+            setattr(field, attr, value)
+
+
+def _position(customer_pk):
+    """
+    Fixed pseudo-random point in SERVICE_AREA for a customer's address
+    """
+    latitude, longitude, half_width = SERVICE_AREA
+    latitude += ((customer_pk * 7919) % 10007 / 10007 - 0.5) * 2 * half_width
+    longitude += ((customer_pk * 104729) % 10009 / 10009 - 0.5) * 2 * half_width
+    return round(latitude, 6), round(longitude, 6)
+
+
+def _customer_rows(plan, start, count, rng):
+    rows = []
+    for user_id in range(start, start + count):
+        street_no = rng.randint(1, 9999)
+        address = f'{street_no} {rng.choice(STREETS)}, City, State {rng.randint(10000, 99999)}'
+        meter = f'GM{user_id:010d}'
+        phone = f'555{user_id % 10_000_000:07d}'
+        rows.append(UserProfile(
+            id=user_id,
+            username=f'lt_customer_{user_id}',
+            email=f'lt_customer_{user_id}@example.com',
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            password=plan['password'],
+            role=UserProfile.CUSTOMER,
+            customer_id=f'LT{user_id:010d}',
+            gas_meter_id=meter,
+            service_address=address,
+            address=address,
+            phone_number=phone,
+            meter_key=normalize_meter_id(meter),
+            address_key=normalize_address(address),
+            phone_key=normalize_phone(phone),
+        ))
+    _insert(UserProfile, rows, plan['batch_size'])
+    return len(rows)
+
+
+def _agent_rows(plan, start, count, rng):
+    rows = []
+    for user_id in range(start, start + count):
+        rows.append(UserProfile(
+            id=user_id,
+            username=f'lt_agent_{user_id}',
+            email=f'lt_agent_{user_id}@gasutility.com',
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            password=plan['password'],
+            role=UserProfile.SUPPORT_AGENT,
+            employee_id=f'LTE{user_id:08d}',
+            department='Customer Support',
+            is_staff=True,
+        ))
+    _insert(UserProfile, rows, plan['batch_size'])
+    return len(rows)
+
+
+def _request_rows(plan, start, count, rng):
+    categories = plan['categories']
+    category_ids = list(categories)
+    category_weights = [categories[c]['weight'] for c in category_ids]
+    statuses, status_weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+    priorities, priority_weights = list(PRIORITY_WEIGHTS), list(PRIORITY_WEIGHTS.values())
+    history_slots = len(ServiceRequest.STATUS_CHOICES)
+    now = plan['now']
+    span = plan['days'] * 86400
+    customer_start, customer_count = plan['customers']
+    agent_start, agent_count = plan['agents']
+
+    requests, comments, history = [], [], []
+
+    for request_pk in range(start, start + count):
+        # Child ids are derived from the request id so chunks never collide
+        offset = request_pk - plan['request_base']
+        comment_id = plan['comment_base'] + offset * plan['max_comments']
+        history_id = plan['history_base'] + offset * history_slots
+
+        category_id = rng.choices(category_ids, category_weights)[0]
+        category = categories[category_id]
+        final_status = rng.choices(statuses, status_weights)[0]
+        priority = rng.choices(priorities, priority_weights)[0]
+        customer_pk = customer_start + rng.randrange(customer_count)
+        created_at = now - timedelta(seconds=rng.randrange(span))
+        path = STATUS_PATHS[final_status]
+        agent_pk = agent_start + rng.randrange(agent_count) if path and agent_count else None
+        meter = f'GM{customer_pk:010d}'
+        address = f'{customer_pk % 9999 + 1} {STREETS[customer_pk % len(STREETS)]}, City, State'
+        latitude, longitude = _position(customer_pk)
+
+        # Walk the status path at increasing timestamps
+        changed_at = created_at
+        previous = ServiceRequest.NEW
+        first_assigned_at = completed_at = None
+        for new_status in path:
+            changed_at += timedelta(minutes=rng.randint(5, 3 * 24 * 60))
+            if new_status == ServiceRequest.ASSIGNED:
+                first_assigned_at = changed_at
+            if new_status == ServiceRequest.COMPLETED:
+                completed_at = changed_at
+            if plan['history'] and agent_pk:
+                history.append(RequestStatusHistory(
+                    id=history_id,
+                    service_request_id=request_pk,
+                    previous_status=previous,
+                    new_status=new_status,
+                    changed_by_id=agent_pk,
+                    changed_at=changed_at,
+                ))
+                history_id += 1
+            previous = new_status
+
+        minutes = category['sla'].get(priority)
+        requests.append(ServiceRequest(
+            id=request_pk,
+            request_id=uuid.uuid5(REQUEST_ID_NAMESPACE, f"{plan['seed']}:{request_pk}"),
+            customer_id=customer_pk,
+            category_id=category_id,
+            title=rng.choice(TITLES.get(category['slug'], ['Service request'])),
+            description='Synthetic load-test request.',
+            status=final_status,
+            priority=priority,
+            created_at=created_at,
+            updated_at=changed_at,
+            assigned_to_id=agent_pk if final_status != ServiceRequest.CANCELLED else None,
+            first_assigned_at=first_assigned_at,
+            completed_at=completed_at,
+            service_address=address,
+            gas_meter_id=meter,
+            meter_key=normalize_meter_id(meter),
+            address_key=normalize_address(address),
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geo.encode(latitude, longitude),
+            due_at=created_at + timedelta(minutes=minutes) if minutes else None,
+            sla_breached=False,
+            is_emergency=priority == ServiceRequest.URGENT or category['is_emergency'],
+        ))
+
+        n_comments = rng.randint(0, plan['max_comments'])
+        for i in range(n_comments):
+            author_id = agent_pk if agent_pk and i % 2 else customer_pk
+            comments.append(RequestComment(
+                id=comment_id + i,
+                service_request_id=request_pk,
+                author_id=author_id,
+                text=rng.choice(COMMENT_TEXTS),
+                created_at=created_at + timedelta(minutes=30 * (i + 1)),
+                is_internal=bool(author_id == agent_pk and rng.random() < 0.3),
+            ))
+
+    _insert(ServiceRequest, requests, plan['batch_size'])
+    _insert(RequestComment, comments, plan['batch_size'])
+    _insert(RequestStatusHistory, history, plan['batch_size'])
+    return len(requests)
+
+
+BUILDERS = {
+    'customers': _customer_rows,
+    'agents': _agent_rows,
+    'requests': _request_rows,
+}
+
+
+def _run_chunk(job):
+    plan, kind, index, start, count = job
+    rng = random.Random(f"{plan['seed']}:{kind}:{index}")
+    with _historical_timestamps():
+        return kind, BUILDERS[kind](plan, start, count, rng)
+
+
+def _init_worker():
+    django.setup()
+    # Never share the parent's connection across processes
+    connections.close_all()
+    if connection.vendor == 'sqlite':
+        # Workers queue for SQLite's single writer lock instead of failing
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout = 120000')
+
+
+class Command(BaseCommand):
+    help = 'Generate a large deterministic synthetic dataset for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10_000)
+        parser.add_argument('--agents', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=100_000)
+        parser.add_argument(
+            '--comments-per-request', type=float, default=2,
+            help='Average comments per request (uniform between 0 and twice this)'
+        )
+        parser.add_argument('--no-history', action='store_true', help='Skip status history rows')
+        parser.add_argument('--days', type=int, default=365, help='Spread creation times over this many days')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--workers', type=int, default=max(multiprocessing.cpu_count() - 1, 1))
+        parser.add_argument('--chunk-size', type=int, default=20_000, help='Rows per worker job')
+        parser.add_argument('--batch-size', type=int, default=2_000, help='Rows per INSERT statement')
+        parser.add_argument('--password', default='loadtest123')
+
+    def handle(self, *args, **options):
+        from service_requests.sla import resolution_minutes
+
+        categories = {
+            category.id: {
+                'slug': category.slug,
+                'weight': CATEGORY_WEIGHTS.get(category.slug, 5),
+                'is_emergency': category.is_emergency,
+                'sla': {p: resolution_minutes(category.id, p) for p in PRIORITY_WEIGHTS},
+            }
+            for category in ServiceCategory.objects.filter(is_active=True)
+        }
+        if not categories:
+            raise CommandError('No service categories found; run create_sample_data first')
+
+        def next_id(model):
+            return (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+
+        customer_base = next_id(UserProfile)
+        agent_base = customer_base + options['customers']
+        plan = {
+            'seed': options['seed'],
+            # One hash shared by every generated account
+            'password': make_password(options['password']),
+            'batch_size': options['batch_size'],
+            'categories': categories,
+            'now': timezone.now(),
+            'days': options['days'],
+            'history': not options['no_history'],
+            'max_comments': max(int(round(options['comments_per_request'] * 2)), 0),
+            'customers': (customer_base, options['customers']),
+            'agents': (agent_base, options['agents']),
+            'request_base': next_id(ServiceRequest),
+            'comment_base': next_id(RequestComment),
+            'history_base': next_id(RequestStatusHistory),
+        }
+        if options['requests'] and not options['customers']:
+            raise CommandError('--requests needs at least one generated customer')
+
+        chunk = options['chunk_size']
+        phases = [
+            ('customers', customer_base, options['customers']),
+            ('agents', agent_base, options['agents']),
+            ('requests', plan['request_base'], options['requests']),
+        ]
+
+        started = time.monotonic()
+        connections.close_all()
+        pool = None
+        if options['workers'] > 1:
+            pool = multiprocessing.Pool(options['workers'], initializer=_init_worker)
+        try:
+            # Phases run in order so foreign keys always point at existing rows
+            for kind, base, total in phases:
+                jobs = [
+                    (plan, kind, index, base + offset, min(chunk, total - offset))
+                    for index, offset in enumerate(range(0, total, chunk))
+                ]
+                results = pool.imap_unordered(_run_chunk, jobs) if pool else map(_run_chunk, jobs)
+                done = 0
+                for _, count in results:
+                    done += count
+                    self.stdout.write(f'  {kind}: {done}/{total}', ending='\r')
+                self.stdout.write(f'  {kind}: {done}/{total} ({time.monotonic() - started:.1f}s)')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        # Explicit ids bypass sequences on backends that have them
+        sequence_sql = connection.ops.sequence_reset_sql(
+            no_style(), [UserProfile, ServiceRequest, RequestComment, RequestStatusHistory]
+        )
+        with connection.cursor() as cursor:
+            for sql in sequence_sql:
+                cursor.execute(sql)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated dataset in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='request_shard',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='service_region',
+            field=models.CharField(blank=True, help_text='Service region; derived from the service address when blank', max_length=50),
+        ),
+    ]
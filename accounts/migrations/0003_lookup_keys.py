@@ -0,0 +1,60 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:18
+
+from django.db import migrations, models
+
+from accounts.normalize import normalize_address, normalize_meter_id, normalize_phone
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    # Shards hold copies of every user
+    users = UserProfile.objects.using(schema_editor.connection.alias)
+    batch = []
+    for user in users.only('id', 'gas_meter_id', 'service_address', 'phone_number').iterator():
+        user.meter_key = normalize_meter_id(user.gas_meter_id)
+        user.address_key = normalize_address(user.service_address)
+        user.phone_key = normalize_phone(user.phone_number)
+        batch.append(user)
+        if len(batch) >= 1000:
+            users.bulk_update(batch, ['meter_key', 'address_key', 'phone_key'])
+            batch = []
+    users.bulk_update(batch, ['meter_key', 'address_key', 'phone_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_service_region'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='address_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='meter_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['meter_key'], name='user_meter_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['address_key'], name='user_address_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['phone_key'], name='user_phone_key_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='password_upgraded_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='pre_upgrade_session_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
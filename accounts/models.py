@@ -1,8 +1,14 @@
 # accounts/models.py
+from django.conf import settings
 from django.db import models
+from django.contrib.auth.hashers import acheck_password, check_password
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .hashers import upgrade_later
+from .normalize import normalize_address, normalize_meter_id, normalize_phone
+
 class UserProfile(AbstractUser):
     """
     Extended User model for both customers and staff
@@ -32,18 +38,96 @@ class UserProfile(AbstractUser):
     # Customer-specific fields
     gas_meter_id = models.CharField(max_length=30, blank=True, null=True)
     service_address = models.TextField(blank=True, null=True)
+    service_region = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="Service region; derived from the service address when blank"
+    )
+    # Database holding the customer's service requests ('' = default);
+    # maintained by service_requests.sharding
+    request_shard = models.CharField(max_length=100, blank=True, editable=False)
     
     # Staff-specific fields
     department = models.CharField(max_length=100, blank=True, null=True)
     employee_id = models.CharField(max_length=20, blank=True, null=True)
     
+    # Normalized copies of gas_meter_id/service_address/phone_number for
+    # caller lookup
+    meter_key = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    address_key = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    phone_key = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    
+    # Session signature under the hash replaced by the latest cost upgrade
+    # (accounts.hashers), accepted for SESSION_COOKIE_AGE after it
+    pre_upgrade_session_hash = models.CharField(max_length=64, blank=True, editable=False)
+    password_upgraded_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    # Sources of each lookup key
+    LOOKUP_KEYS = {
+        'meter_key': ('gas_meter_id', normalize_meter_id),
+        'address_key': ('service_address', normalize_address),
+        'phone_key': ('phone_number', normalize_phone),
+    }
+    
     class Meta:
         verbose_name = _('User Profile')
         verbose_name_plural = _('User Profiles')
+        indexes = [
+            models.Index(fields=['meter_key'], name='user_meter_key_idx'),
+            models.Index(fields=['address_key'], name='user_address_key_idx'),
+            models.Index(fields=['phone_key'], name='user_phone_key_idx'),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
     
+    def save(self, *args, **kwargs):
+        """
+        Keep the lookup keys in step with their sources
+        """
+        update_fields = kwargs.get('update_fields')
+        derived = set()
+        for key, (source, normalize) in self.LOOKUP_KEYS.items():
+            if update_fields is None or source in update_fields:
+                setattr(self, key, normalize(getattr(self, source)))
+                derived.add(key)
+        if update_fields is not None and derived:
+            kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+    
+    def set_password(self, raw_password):
+        super().set_password(raw_password)
+        self.pre_upgrade_session_hash = ''
+        self.password_upgraded_at = None
+    
+    def set_unusable_password(self):
+        super().set_unusable_password()
+        self.pre_upgrade_session_hash = ''
+        self.password_upgraded_at = None
+    
+    def check_password(self, raw_password):
+        """
+        A hash made at another cost is upgraded in the background, not
+        during the login
+        """
+        return check_password(raw_password, self.password, lambda raw: upgrade_later(self, raw))
+    
+    async def acheck_password(self, raw_password):
+        async def setter(raw):
+            upgrade_later(self, raw)
+        
+        return await acheck_password(raw_password, self.password, setter)
+    
+    def get_session_auth_fallback_hash(self):
+        """
+        Also accept sessions signed before a recent cost upgrade
+        """
+        yield from super().get_session_auth_fallback_hash()
+        if self.pre_upgrade_session_hash and self.password_upgraded_at and (
+            timezone.now() - self.password_upgraded_at
+        ).total_seconds() < settings.SESSION_COOKIE_AGE:
+            yield self.pre_upgrade_session_hash
+    
     @property
     def is_customer(self):
         return self.role == self.CUSTOMER
@@ -0,0 +1,81 @@
+# accounts/normalize.py
+"""
+Normalization of customer identifiers into indexable lookup keys.
+
+Meter IDs, service addresses and phone numbers are typed by hand by
+customers and agents, so "gm-0012", "GM 0012" and "GM0012" must all compare
+equal, as must "12 Main Street." and "12 main st", and "+1 (555) 010-1234"
+and "555.010.1234".
+"""
+import re
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_NON_DIGIT = re.compile(r'[^0-9]+')
+_NON_WORD = re.compile(r'[^0-9a-z# ]+')
+_SPACES = re.compile(r'\s+')
+_ZIP_CODE = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st',
+    'avenue': 'ave',
+    'road': 'rd',
+    'drive': 'dr',
+    'lane': 'ln',
+    'boulevard': 'blvd',
+    'court': 'ct',
+    'place': 'pl',
+    'terrace': 'ter',
+    'highway': 'hwy',
+    'apartment': 'apt',
+    'suite': 'ste',
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+}
+
+KEY_MAX_LENGTH = 255
+
+# National number length; longer numbers carry a country or trunk prefix
+PHONE_KEY_DIGITS = 10
+
+
+def normalize_meter_id(value):
+    """
+    Uppercase alphanumerics only, or None when empty
+    """
+    if not value:
+        return None
+    key = _NON_ALNUM.sub('', value.lower()).upper()
+    return key[:KEY_MAX_LENGTH] or None
+
+
+def normalize_address(value):
+    """
+    Lowercase words with punctuation dropped and common suffixes abbreviated,
+    or None when empty
+    """
+    if not value:
+        return None
+    words = _SPACES.sub(' ', _NON_WORD.sub(' ', value.lower())).split()
+    key = ' '.join(ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+    return key[:KEY_MAX_LENGTH] or None
+
+
+def normalize_phone(value):
+    """
+    The last PHONE_KEY_DIGITS digits, dropping any country or trunk prefix,
+    or None when there are no digits
+    """
+    if not value:
+        return None
+    return _NON_DIGIT.sub('', value)[-PHONE_KEY_DIGITS:] or None
+
+
+def postal_code(address):
+    """
+    The last five-digit ZIP code in ``address`` (ZIP+4 extensions dropped),
+    or None
+    """
+    codes = _ZIP_CODE.findall(address or '')
+    return codes[-1] if codes else None
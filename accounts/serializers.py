@@ -2,8 +2,9 @@
 from rest_framework import serializers
 from .models import UserProfile
 from django.contrib.auth.password_validation import validate_password
+from gas_utility_portal.sparse_fields import SparseFieldsMixin
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for user profile data
     """
@@ -71,4 +72,43 @@ class StaffProfileSerializer(UserProfileSerializer):
         # Ensure role is one of the staff roles
         if validated_data.get('role') not in [UserProfile.SUPPORT_AGENT, UserProfile.MANAGER, UserProfile.ADMIN]:
             validated_data['role'] = UserProfile.SUPPORT_AGENT
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class LookupRequestSerializer(serializers.Serializer):
+    """
+    Compact open request in a caller lookup
+    """
+    id = serializers.IntegerField()
+    request_id = serializers.UUIDField()
+    title = serializers.CharField()
+    status = serializers.CharField()
+    priority = serializers.CharField()
+    is_emergency = serializers.BooleanField()
+    category_name = serializers.CharField(source='category__name')
+    assigned_to_name = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField()
+    due_at = serializers.DateTimeField(allow_null=True)
+    
+    def get_assigned_to_name(self, row):
+        if not row['assigned_to_id']:
+            return None
+        return f"{row['assigned_to__first_name']} {row['assigned_to__last_name']}"
+
+class LookupHistorySerializer(serializers.Serializer):
+    """
+    Request counts of a looked-up customer, archived requests included
+    """
+    total = serializers.IntegerField()
+    open = serializers.IntegerField()
+    archived = serializers.IntegerField()
+    by_status = serializers.DictField(child=serializers.IntegerField())
+    last_request_at = serializers.DateTimeField(allow_null=True)
+
+class CustomerLookupSerializer(serializers.Serializer):
+    """
+    A customer matching a caller lookup, with their open requests and history
+    """
+    customer = CustomerProfileSerializer()
+    matched_on = serializers.ListField(child=serializers.CharField())
+    open_requests = LookupRequestSerializer(many=True)
+    history = LookupHistorySerializer()
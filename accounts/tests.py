@@ -1,3 +1,187 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from service_requests.models import ServiceCategory, ServiceRequest
+from . import hashers
+from .models import UserProfile
+from .normalize import normalize_address, normalize_meter_id, normalize_phone, postal_code
+
+LOGIN_URL = '/api/accounts/users/login/'
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, LOGIN_USERNAME_FAILURE_RATE=(10, 15 * 60))
+class LoginThrottleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        UserProfile.objects.create_user('victim', password='right-pass-123')
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def login(self, password, ip):
+        return self.client.post(LOGIN_URL, {'username': 'victim', 'password': password}, REMOTE_ADDR=ip)
+
+    def test_failures_from_other_addresses_do_not_lock_the_user_out(self):
+        for n in range(10):
+            self.assertEqual(self.login('wrong', f'10.0.0.{n}').status_code, 401)
+        self.assertEqual(self.login('right-pass-123', '192.168.1.5').status_code, 200)
+
+    def test_failures_from_one_address_are_refused_before_checking(self):
+        for _ in range(10):
+            self.assertEqual(self.login('wrong', '10.0.0.1').status_code, 401)
+        response = self.login('right-pass-123', '10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.login('right-pass-123', '10.0.0.2').status_code, 200)
+
+    @override_settings(LOGIN_IP_FAILURE_RATE=(3, 60))
+    def test_address_limit_covers_every_username(self):
+        for name in ('a', 'b', 'c'):
+            self.client.post(LOGIN_URL, {'username': name, 'password': 'x'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.login('right-pass-123', '10.0.0.1').status_code, 429)
+
+    def test_successful_logins_are_not_counted(self):
+        for _ in range(12):
+            self.assertEqual(self.login('right-pass-123', '10.0.0.1').status_code, 200)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PASSWORD_UPGRADE_WORKERS=0)
+class PasswordUpgradeTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        self.user = UserProfile.objects.create_user('member', password='member-pass-123')
+        # Signed in before the cost changes
+        self.assertEqual(self.login(self.client).status_code, 200)
+
+    def login(self, client):
+        return client.post(LOGIN_URL, {'username': 'member', 'password': 'member-pass-123'})
+
+    def current_user(self, client):
+        return client.get('/api/accounts/users/current_user/').status_code
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=2000)
+    def test_upgrade_keeps_sessions_without_the_old_hash(self):
+        other = self.client_class()
+        self.assertEqual(self.login(other).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertNotIn('$', self.user.pre_upgrade_session_hash)
+        self.assertEqual(self.current_user(self.client), 200)
+        self.assertEqual(self.current_user(other), 200)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=2000)
+    def test_old_sessions_expire_with_the_session_age(self):
+        self.user.check_password('member-pass-123')
+        UserProfile.objects.filter(pk=self.user.pk).update(
+            password_upgraded_at=timezone.now() - timedelta(seconds=settings.SESSION_COOKIE_AGE + 1)
+        )
+        self.assertEqual(self.current_user(self.client), 401)
+
+    def test_password_change_ends_sessions(self):
+        self.user.set_password('another-pass-456')
+        self.user.save()
+        self.assertEqual(self.current_user(self.client), 401)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class BackgroundPasswordUpgradeTests(TransactionTestCase):
+    def test_upgrade_runs_on_the_worker(self):
+        user = UserProfile.objects.create_user('member', password='member-pass-123')
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertTrue(user.check_password('member-pass-123'))
+            # Queued after the upgrade on the single worker
+            hashers._executor.submit(lambda: None).result()
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertIsNotNone(user.password_upgraded_at)
+
+
+class NormalizeTests(SimpleTestCase):
+    def test_meter_ids(self):
+        for value in ('gm-0012', 'GM 0012', ' GM0012 ', 'g.m/00-12'):
+            self.assertEqual(normalize_meter_id(value), 'GM0012')
+        for value in (None, '', '--- '):
+            self.assertIsNone(normalize_meter_id(value))
+        self.assertEqual(len(normalize_meter_id('A' * 300)), 255)
+
+    def test_addresses(self):
+        for value in ('12 Main Street.', '12  main st', '12, MAIN\tStreet'):
+            self.assertEqual(normalize_address(value), '12 main st')
+        self.assertEqual(normalize_address('4 North Road, Apartment #2'), '4 n rd apt #2')
+        # Only whole words are abbreviated
+        self.assertEqual(normalize_address('1 Streetly Avenue'), '1 streetly ave')
+        for value in (None, '', ' ,. '):
+            self.assertIsNone(normalize_address(value))
+
+    def test_phone_numbers(self):
+        for value in ('+1 (555) 010-1234', '555.010.1234', '1-555-010-1234', '0015550101234'):
+            self.assertEqual(normalize_phone(value), '5550101234')
+        self.assertEqual(normalize_phone('010-1234'), '0101234')
+        for value in (None, '', 'n/a'):
+            self.assertIsNone(normalize_phone(value))
+
+    def test_postal_codes(self):
+        self.assertEqual(postal_code('12 Main St, Springfield, IL 62704-1234'), '62704')
+        self.assertEqual(postal_code('Unit 10001, 5 Elm St, 10002'), '10002')
+        self.assertIsNone(postal_code('12 Main St, 627041'))
+        self.assertIsNone(postal_code(None))
+
+
+class CallerLookupTests(TestCase):
+    URL = '/api/accounts/users/lookup/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = UserProfile.objects.create_user('agent', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.customer = UserProfile.objects.create_user(
+            'customer', password='pass', customer_id='C-1001', gas_meter_id='GM-0012',
+            service_address='12 Main Street', phone_number='+1 (555) 010-1234'
+        )
+        cls.other = UserProfile.objects.create_user('other', password='pass', customer_id='C-1002')
+        category = ServiceCategory.objects.create(name='Meter', slug='meter')
+        cls.service_request = ServiceRequest.objects.create(
+            customer=cls.other, category=category, title='Meter reading', description='Too high',
+            gas_meter_id='XK 77', service_address='9 Oak Avenue'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.agent)
+
+    def lookup(self, q, by=None):
+        response = self.client.get(self.URL, {'q': q, **({'by': by} if by else {})})
+        self.assertEqual(response.status_code, 200)
+        return [(match['customer']['username'], match['matched_on']) for match in response.data['matches']]
+
+    def test_each_lookup(self):
+        for q, by, matched_on in (
+            ('C-1001', 'customer_id', 'customer_id'),
+            ('gm 0012', 'meter', 'meter'),
+            ('555.010.1234', 'phone', 'phone'),
+            ('12 main st.', 'address', 'address'),
+        ):
+            with self.subTest(by=by):
+                self.assertEqual(self.lookup(q, by), [('customer', [matched_on])])
+                self.assertEqual(self.lookup(q), [('customer', [matched_on])])
+
+    def test_lookup_is_restricted_to_the_given_key(self):
+        self.assertEqual(self.lookup('GM-0012', 'phone'), [])
+        # Customer IDs compare as given
+        self.assertEqual(self.lookup('c-1001', 'customer_id'), [])
+
+    def test_request_keys_find_their_customer(self):
+        self.assertEqual(self.lookup('xk-77', 'meter'), [('other', ['request_meter'])])
+        response = self.client.get(self.URL, {'q': '9 oak ave'})
+        match, = response.data['matches']
+        self.assertEqual(match['matched_on'], ['request_address'])
+        self.assertEqual([row['id'] for row in match['open_requests']], [self.service_request.id])
+        self.assertEqual(match['history']['open'], 1)
+
+    def test_refused(self):
+        self.assertEqual(self.client.get(self.URL, {'q': 'x', 'by': 'email'}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {'q': ' '}).status_code, 400)
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(self.URL, {'q': 'C-1001'}).status_code, 403)
@@ -0,0 +1,122 @@
+# accounts/throttling.py
+"""
+Login throttling, checked before any password is hashed.
+
+Each limit is a sliding window approximated from two fixed windows: the
+count of the current window plus the count of the previous one weighted by
+how much of it the sliding window still covers. That is two small integer
+cache entries per client address or username, expiring on their own, in
+the LOGIN_THROTTLE_CACHE cache: per process with the local-memory cache,
+shared by every worker with Redis or Memcached.
+
+Failed logins are counted per client address, and per username from
+that address: a guessing burst is refused once either limit is reached,
+but failures from other addresses never lock a user out, so someone typing
+the right password from their own address is not refused. Registrations
+are counted per address. A limit set to None is off.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[getattr(settings, 'LOGIN_THROTTLE_CACHE', 'default')]
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+class SlidingWindow:
+    """
+    Events per ``ident`` over the last ``seconds``, limited to ``limit``;
+    ``(limit, seconds)`` is read from the ``setting`` named
+    """
+    def __init__(self, scope, setting, default):
+        self.scope = scope
+        self.setting = setting
+        self.default = default
+
+    def rate(self):
+        return getattr(settings, self.setting, self.default)
+
+    def _keys(self, ident, slot):
+        digest = hashlib.sha1(str(ident).casefold().encode()).hexdigest()[:20]
+        prefix = f'throttle:{self.scope}:{digest}'
+        return f'{prefix}:{slot}', f'{prefix}:{slot - 1}'
+
+    def wait(self, ident, now=None):
+        """
+        Seconds until ``ident`` is under the limit again; 0 when it is
+        """
+        rate = self.rate()
+        if not rate:
+            return 0
+        limit, seconds = rate
+        slot, into = divmod(now or time.time(), seconds)
+        current_key, previous_key = self._keys(ident, int(slot))
+        counts = _cache().get_many([current_key, previous_key])
+        current = counts.get(current_key, 0)
+        previous = counts.get(previous_key, 0)
+        if current + previous * (1 - into / seconds) < limit:
+            return 0
+        if current >= limit:
+            # Past the next boundary, and then until this window (the
+            # previous one by then) has slid far enough out
+            wait = seconds - into + seconds * (1 - limit / current)
+        else:
+            wait = seconds * (1 - (limit - current) / previous) - into
+        return max(math.ceil(wait), 1)
+
+    def hit(self, ident, now=None):
+        rate = self.rate()
+        if not rate:
+            return
+        seconds = rate[1]
+        key = self._keys(ident, int((now or time.time()) // seconds))[0]
+        cache = _cache()
+        # Kept while it can still be the previous window
+        if not cache.add(key, 1, timeout=2 * seconds):
+            try:
+                cache.incr(key)
+            except ValueError:  # Expired in between
+                cache.set(key, 1, timeout=2 * seconds)
+
+
+login_failures_by_ip = SlidingWindow('login-ip', 'LOGIN_IP_FAILURE_RATE', (30, 15 * 60))
+login_failures_by_username = SlidingWindow('login-user', 'LOGIN_USERNAME_FAILURE_RATE', (10, 15 * 60))
+registrations_by_ip = SlidingWindow('register-ip', 'REGISTER_IP_RATE', (10, 60 * 60))
+
+
+def login_wait(request, username):
+    """
+    Seconds the client must wait before trying to log in as ``username``;
+    0 when it may try now
+    """
+    ip = client_ip(request)
+    return max(
+        login_failures_by_ip.wait(ip),
+        login_failures_by_username.wait(_username_from(username, ip)),
+    )
+
+
+def login_failed(request, username):
+    ip = client_ip(request)
+    login_failures_by_ip.hit(ip)
+    login_failures_by_username.hit(_username_from(username, ip))
+
+
+def _username_from(username, ip):
+    return f'{username or ""}\x00{ip}'
+
+
+def registration_wait(request):
+    return registrations_by_ip.wait(client_ip(request))
+
+
+def registered(request):
+    registrations_by_ip.hit(client_ip(request))
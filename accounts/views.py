@@ -4,8 +4,18 @@ from rest_framework.decorators import action
 from django.contrib.auth import authenticate, login, logout
 from django.shortcuts import get_object_or_404
 
+from gas_utility_portal.profiling import CProfileViewMixin
+from gas_utility_portal.sparse_fields import SparseFieldsViewMixin
+from service_requests import lookup as caller_lookup
+
+from . import throttling
 from .models import UserProfile
-from .serializers import UserProfileSerializer, CustomerProfileSerializer, StaffProfileSerializer
+from .serializers import (
+    UserProfileSerializer,
+    CustomerProfileSerializer,
+    StaffProfileSerializer,
+    CustomerLookupSerializer,
+)
 
 class IsOwnerOrStaff(permissions.BasePermission):
     """
@@ -28,9 +38,9 @@ class IsOwnerOrStaff(permissions.BasePermission):
         # Regular users can only see/modify their own accounts
         return obj == request.user
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(CProfileViewMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
-    API endpoint for user profiles
+    API endpoint for user profiles; reads accept ?fields=
     """
     queryset = UserProfile.objects.all()
     permission_classes = [IsOwnerOrStaff]
@@ -65,15 +75,28 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def login(self, request):
+        """
+        Log in; clients with too many recent failures are refused before
+        the password is checked
+        """
         username = request.data.get('username')
         password = request.data.get('password')
         
+        wait = throttling.login_wait(request, username)
+        if wait:
+            return Response(
+                {'error': 'Too many failed login attempts, try again later'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(wait)}
+            )
+        
         user = authenticate(username=username, password=password)
         if user is not None:
             login(request, user)
             serializer = self.get_serializer(user)
             return Response(serializer.data)
         
+        throttling.login_failed(request, username)
         return Response(
             {'error': 'Invalid credentials'},
             status=status.HTTP_401_UNAUTHORIZED
@@ -103,9 +126,18 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         """
         Register a new customer account
         """
+        wait = throttling.registration_wait(request)
+        if wait:
+            return Response(
+                {'error': 'Too many registrations from this address, try again later'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(wait)}
+            )
+        
         serializer = CustomerProfileSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
+            throttling.registered(request)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -124,5 +156,42 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         staff_users = UserProfile.objects.filter(
             role__in=[UserProfile.SUPPORT_AGENT, UserProfile.MANAGER, UserProfile.ADMIN]
         )
-        serializer = StaffProfileSerializer(staff_users, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        serializer = StaffProfileSerializer(staff_users, many=True, **self.get_sparse_options())
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def lookup(self, request):
+        """
+        Identify a caller by ?q= customer ID, gas meter ID, phone number or
+        service address (?by= one of those to search only it) and return
+        each matching customer with their open requests and history (staff only)
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'You do not have permission to look up customers'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        value = request.query_params.get('q', '').strip()
+        by = request.query_params.get('by') or None
+        if not value:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if by is not None and by not in caller_lookup.LOOKUPS:
+            return Response(
+                {'error': f'by must be one of: {", ".join(caller_lookup.LOOKUPS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        customers = caller_lookup.find_customers(value, by=by)
+        summaries = caller_lookup.summaries(customers)
+        matches = [
+            {
+                'customer': customer,
+                'matched_on': customer.matched_on,
+                'open_requests': summaries[customer.id][0],
+                'history': summaries[customer.id][1],
+            }
+            for customer in customers
+        ]
+        serializer = CustomerLookupSerializer(matches, many=True)
+        return Response({'matches': serializer.data})
@@ -1,3 +1,39 @@
+# dashboard/admin.py
 from django.contrib import admin
+from .models import DailyRequestSnapshot, DwellTimeReport, SnapshotDay
 
-# Register your models here.
+@admin.register(SnapshotDay)
+class SnapshotDayAdmin(admin.ModelAdmin):
+    list_display = ['day', 'requests', 'built_at']
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(DailyRequestSnapshot)
+class DailyRequestSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['day', 'category', 'priority', 'agent', 'opened', 'closed', 'reopened', 'backlog']
+    list_filter = ['category', 'priority']
+    date_hierarchy = 'day'
+    list_select_related = ['category', 'agent']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(DwellTimeReport)
+class DwellTimeReportAdmin(admin.ModelAdmin):
+    list_display = ['period', 'start', 'computed_at']
+    list_filter = ['period']
+    exclude = ['data']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
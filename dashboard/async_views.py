@@ -0,0 +1,314 @@
+# dashboard/async_views.py
+"""
+Async dashboard endpoints under ``/api/dashboard/async/``.
+
+Same figures, role scoping and response bodies as DashboardViewSet, but
+each endpoint issues its independent aggregate queries together: one
+conditional-count query per request database instead of one count per
+figure, and ``overview`` returns stats, breakdowns and (for managers)
+agent performance in a single response.
+
+Django's async ORM methods (``acount()``, ``aaggregate()``) run every query
+on one thread-sensitive worker, so gathering them does not overlap any
+database work. Queries are instead run with ``sync_to_async(...,
+thread_sensitive=False)``, each on its own thread and connection, at most
+DASHBOARD_QUERY_WORKERS at once. As for /api/batch/, this is skipped inside
+a transaction, whose writes other connections could not see, and for
+in-memory SQLite; the queries then run one after another.
+"""
+import asyncio
+import functools
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from accounts.models import UserProfile
+from service_requests import sharding
+from service_requests.models import ServiceRequest
+from service_requests.workflow import PRIORITY_LABELS, STATUS_LABELS
+from .serializers import (
+    AgentPerformanceSerializer,
+    CategoryBreakdownSerializer,
+    DashboardStatsSerializer,
+    PriorityBreakdownSerializer,
+    StatusBreakdownSerializer,
+)
+
+STATS = {
+    'total_requests': Count('id'),
+    'new_requests': Count('id', filter=Q(status=ServiceRequest.NEW)),
+    'in_progress_requests': Count(
+        'id', filter=Q(status__in=[ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS])
+    ),
+    'completed_requests': Count('id', filter=Q(status=ServiceRequest.COMPLETED)),
+    'high_priority_requests': Count('id', filter=Q(priority=ServiceRequest.HIGH)),
+    'urgent_requests': Count('id', filter=Q(priority=ServiceRequest.URGENT)),
+}
+STAFF_STATS = {
+    'unassigned_requests': Count('id', filter=Q(assigned_to__isnull=True)),
+}
+
+# breakdown -> (grouped field, response key, labels, serializer)
+BREAKDOWNS = {
+    'category_breakdown': ('category__name', 'category_name', None, CategoryBreakdownSerializer),
+    'status_breakdown': ('status', 'status', STATUS_LABELS, StatusBreakdownSerializer),
+    'priority_breakdown': ('priority', 'priority', PRIORITY_LABELS, PriorityBreakdownSerializer),
+}
+
+_COMPLETED_WITH_TIME = Q(status=ServiceRequest.COMPLETED, completed_at__isnull=False)
+_NO_TOTALS = {'assigned': 0, 'completed': 0, 'timed': 0, 'time_taken': timedelta()}
+
+
+def _concurrent_reads_allowed():
+    if getattr(settings, 'DASHBOARD_QUERY_WORKERS', 4) <= 1:
+        return False
+    for alias in {DEFAULT_DB_ALIAS, *sharding.databases()}:
+        connection = connections[alias]
+        if connection.in_atomic_block:
+            return False
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            return False
+    return True
+
+
+def _on_own_connection(query, *args):
+    try:
+        return query(*args)
+    finally:
+        connections.close_all()
+
+
+class _Queries:
+    """
+    Runs blocking ORM calls for one request, concurrently when allowed
+    """
+    def __init__(self, concurrent):
+        self.concurrent = concurrent
+        self.slots = asyncio.Semaphore(max(getattr(settings, 'DASHBOARD_QUERY_WORKERS', 4), 1))
+
+    async def run(self, query, *args):
+        if not self.concurrent:
+            return await sync_to_async(query)(*args)
+        async with self.slots:
+            return await sync_to_async(_on_own_connection, thread_sensitive=False)(query, *args)
+
+    async def each(self, query, parts):
+        return await asyncio.gather(*(self.run(query, part) for part in parts))
+
+
+def _requests(user):
+    """
+    The user's requests, one queryset per request database
+    """
+    if user.is_customer:
+        return [ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)]
+    return sharding.each(ServiceRequest.objects.all())
+
+
+def _aggregate(queryset, aggregates):
+    return queryset.aggregate(**aggregates)
+
+
+def _grouped(queryset, field):
+    return list(queryset.order_by().values_list(field).annotate(n=Count('pk')))
+
+
+def _agent_totals(queryset):
+    return list(
+        queryset.filter(assigned_to__role=UserProfile.SUPPORT_AGENT).order_by().values(
+            'assigned_to_id'
+        ).annotate(
+            assigned=Count('id'),
+            completed=Count('id', filter=Q(status=ServiceRequest.COMPLETED)),
+            timed=Count('id', filter=_COMPLETED_WITH_TIME),
+            time_taken=Sum(
+                ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField()),
+                filter=_COMPLETED_WITH_TIME
+            ),
+        )
+    )
+
+
+def _agents():
+    return list(
+        UserProfile.objects.filter(role=UserProfile.SUPPORT_AGENT).values_list(
+            'id', 'first_name', 'last_name'
+        )
+    )
+
+
+def _customer_count():
+    return UserProfile.objects.filter(role=UserProfile.CUSTOMER).count()
+
+
+async def _stats(request, user, queries):
+    aggregates = {**STATS, **STAFF_STATS} if user.is_staff_member else STATS
+    calls = [queries.each(functools.partial(_aggregate, aggregates=aggregates), _requests(user))]
+    if user.is_staff_member:
+        calls.append(queries.run(_customer_count))
+    results = await asyncio.gather(*calls)
+
+    stats_data = {name: sum(part[name] for part in results[0]) for name in aggregates}
+    if user.is_staff_member:
+        stats_data['total_customers'] = results[1]
+    return DashboardStatsSerializer(stats_data, context={'request': request}).data
+
+
+async def _breakdown(name, user, queries):
+    field, key, labels, serializer_class = BREAKDOWNS[name]
+    counts = Counter()
+    for part in await queries.each(functools.partial(_grouped, field=field), _requests(user)):
+        for value, count in part:
+            counts[value] += count
+
+    total = sum(counts.values())
+    breakdown_data = []
+    for value, count in counts.most_common():
+        percentage = (count / total * 100) if total > 0 else 0
+        breakdown_data.append({
+            key: labels.get(value, value) if labels else value,
+            'count': count,
+            'percentage': round(percentage, 2)
+        })
+    return serializer_class(breakdown_data, many=True).data
+
+
+def _may_view_agent_performance(user):
+    return user.is_staff_member and user.role in [UserProfile.MANAGER, UserProfile.ADMIN]
+
+
+async def _agent_performance(queries):
+    agents, parts = await asyncio.gather(
+        queries.run(_agents),
+        queries.each(_agent_totals, sharding.each(ServiceRequest.objects.all())),
+    )
+    # Summed over the shards; the average is taken once all are in
+    totals = {}
+    for part in parts:
+        for row in part:
+            total = totals.setdefault(row['assigned_to_id'], dict(_NO_TOTALS))
+            for name in ('assigned', 'completed', 'timed'):
+                total[name] += row[name]
+            total['time_taken'] += row['time_taken'] or timedelta()
+
+    performance_data = []
+    for agent_id, first_name, last_name in agents:
+        total = totals.get(agent_id, _NO_TOTALS)
+        assigned_count = total['assigned']
+        completed_count = total['completed']
+        resolution_rate = (completed_count / assigned_count * 100) if assigned_count > 0 else 0
+        performance_data.append({
+            'agent_name': f"{first_name} {last_name}",
+            'assigned_count': assigned_count,
+            'completed_count': completed_count,
+            'resolution_rate': round(resolution_rate, 2),
+            'avg_completion_time': total['time_taken'] / total['timed'] if total['timed'] else None
+        })
+    return AgentPerformanceSerializer(performance_data, many=True).data
+
+
+def _authenticate(request):
+    """
+    The user signed in through the DRF API's authentication classes, so
+    HTTP Basic attempts fall under the login throttles; None when no
+    credentials are given
+    """
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    user = Request(request, authenticators=authenticators).user
+    return user if user.is_authenticated else None
+
+
+def dashboard_view(view):
+    """
+    Authenticated async GET view called as ``view(request, user, queries)``
+    """
+    @require_GET
+    @functools.wraps(view)
+    async def wrapper(request):
+        try:
+            user = await sync_to_async(_authenticate)(request)
+        except exceptions.Throttled as e:
+            response = JsonResponse({'detail': e.detail}, status=e.status_code)
+            response['Retry-After'] = str(e.wait)
+            return response
+        except exceptions.AuthenticationFailed as e:
+            user, detail = None, e.detail
+        else:
+            detail = exceptions.NotAuthenticated.default_detail
+        if user is None:
+            # 403 like the DRF API, whose first authentication class is the session
+            return JsonResponse({'detail': detail}, status=403)
+        request.user = user
+        queries = _Queries(await sync_to_async(_concurrent_reads_allowed)())
+        return await view(request, user, queries)
+    return wrapper
+
+
+@dashboard_view
+async def stats(request, user, queries):
+    """
+    Get overall dashboard statistics
+    """
+    return JsonResponse(await _stats(request, user, queries))
+
+
+@dashboard_view
+async def category_breakdown(request, user, queries):
+    """
+    Get breakdown of requests by category
+    """
+    return JsonResponse(await _breakdown('category_breakdown', user, queries), safe=False)
+
+
+@dashboard_view
+async def status_breakdown(request, user, queries):
+    """
+    Get breakdown of requests by status
+    """
+    return JsonResponse(await _breakdown('status_breakdown', user, queries), safe=False)
+
+
+@dashboard_view
+async def priority_breakdown(request, user, queries):
+    """
+    Get breakdown of requests by priority
+    """
+    return JsonResponse(await _breakdown('priority_breakdown', user, queries), safe=False)
+
+
+@dashboard_view
+async def agent_performance(request, user, queries):
+    """
+    Get agent performance metrics (staff only)
+    """
+    if not _may_view_agent_performance(user):
+        return JsonResponse(
+            {'error': 'You do not have permission to view agent performance'},
+            status=403
+        )
+    return JsonResponse(await _agent_performance(queries), safe=False)
+
+
+@dashboard_view
+async def overview(request, user, queries):
+    """
+    Get stats and every breakdown in one response, plus agent performance
+    for managers and admins
+    """
+    sections = {
+        'stats': _stats(request, user, queries),
+        **{name: _breakdown(name, user, queries) for name in BREAKDOWNS},
+    }
+    if _may_view_agent_performance(user):
+        sections['agent_performance'] = _agent_performance(queries)
+    results = await asyncio.gather(*sections.values())
+    return JsonResponse(dict(zip(sections, results)))
@@ -0,0 +1,227 @@
+# dashboard/benchmarks.py
+"""
+Endpoint benchmark harness.
+
+Each endpoint in ENDPOINTS is called repeatedly through the Django test
+client as a user of the given role. Wall-clock latency percentiles, SQL
+query counts and SQL time are collected per endpoint and can be compared
+against a stored baseline to catch regressions.
+"""
+import json
+import math
+import time
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.db import connection
+from django.test import Client
+
+from accounts.models import UserProfile
+from service_requests.models import ServiceRequest
+from . import snapshots
+
+API = '/api'
+
+# (name, method, path, role, data)
+# ``path`` is formatted with the fixture context; ``data`` is a dict or a
+# callable taking the iteration number.
+ENDPOINTS = [
+    ('categories-list', 'get', API + '/service-requests/categories/', 'customer', None),
+    ('requests-list', 'get', API + '/service-requests/requests/', 'agent', None),
+    ('requests-list-customer', 'get', API + '/service-requests/requests/', 'customer', None),
+    ('requests-search', 'get', API + '/service-requests/requests/?search=leak', 'agent', None),
+    ('requests-detail', 'get', API + '/service-requests/requests/{request_pk}/', 'agent', None),
+    ('requests-comments', 'get', API + '/service-requests/requests/{request_pk}/comments/', 'agent', None),
+    ('requests-attachments', 'get', API + '/service-requests/requests/{request_pk}/attachments/', 'agent', None),
+    ('requests-change-status', 'post', API + '/service-requests/requests/{workflow_pk}/change_status/', 'agent',
+     lambda i: {'status': ServiceRequest.ON_HOLD if i % 2 == 0 else ServiceRequest.IN_PROGRESS}),
+    ('requests-emergency-queue', 'get', API + '/service-requests/requests/emergency_queue/', 'agent', None),
+    ('requests-nearby', 'get',
+     API + '/service-requests/requests/nearby/?lat={nearby_lat}&lon={nearby_lon}&radius_km=2', 'agent', None),
+    ('requests-dispatch-batches', 'get', API + '/service-requests/requests/dispatch_batches/', 'manager', None),
+    ('dashboard-stats', 'get', API + '/dashboard/dashboard/stats/', 'manager', None),
+    ('dashboard-stats-customer', 'get', API + '/dashboard/dashboard/stats/', 'customer', None),
+    ('dashboard-category-breakdown', 'get', API + '/dashboard/dashboard/category_breakdown/', 'manager', None),
+    ('dashboard-status-breakdown', 'get', API + '/dashboard/dashboard/status_breakdown/', 'manager', None),
+    ('dashboard-priority-breakdown', 'get', API + '/dashboard/dashboard/priority_breakdown/', 'manager', None),
+    ('dashboard-agent-performance', 'get', API + '/dashboard/dashboard/agent_performance/', 'manager', None),
+    ('dashboard-at-risk', 'get', API + '/dashboard/dashboard/at_risk/', 'manager', None),
+    ('dashboard-report', 'get', API + '/dashboard/dashboard/report/?from={report_from}', 'manager', None),
+    ('dashboard-dwell-times', 'get', API + '/dashboard/dashboard/dwell_times/?period=week&refresh=1', 'manager', None),
+    # Async counterparts; overview replaces the five calls above
+    ('dashboard-async-stats', 'get', API + '/dashboard/async/stats/', 'manager', None),
+    ('dashboard-async-stats-customer', 'get', API + '/dashboard/async/stats/', 'customer', None),
+    ('dashboard-async-category-breakdown', 'get', API + '/dashboard/async/category_breakdown/', 'manager', None),
+    ('dashboard-async-status-breakdown', 'get', API + '/dashboard/async/status_breakdown/', 'manager', None),
+    ('dashboard-async-priority-breakdown', 'get', API + '/dashboard/async/priority_breakdown/', 'manager', None),
+    ('dashboard-async-agent-performance', 'get', API + '/dashboard/async/agent_performance/', 'manager', None),
+    ('dashboard-async-overview', 'get', API + '/dashboard/async/overview/', 'manager', None),
+    ('users-list', 'get', API + '/accounts/users/', 'manager', None),
+    ('users-current-user', 'get', API + '/accounts/users/current_user/', 'customer', None),
+    ('users-staff-users', 'get', API + '/accounts/users/staff_users/', 'manager', None),
+    ('users-lookup-meter', 'get', API + '/accounts/users/lookup/?q={lookup_meter}', 'agent', None),
+    ('users-lookup-phone', 'get', API + '/accounts/users/lookup/?q={lookup_phone}&by=phone', 'agent', None),
+    ('users-login', 'post', API + '/accounts/users/login/', None,
+     lambda i: {'username': 'bench_customer', 'password': BENCH_PASSWORD}),
+]
+
+BENCH_PASSWORD = 'bench-pass-123'
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and timing them precisely
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def prepare_fixtures():
+    """
+    Create benchmark users and pick target rows; returns the path context
+    and a ``role -> user`` map
+    """
+    users = {}
+    for role, name in [
+        (UserProfile.CUSTOMER, 'bench_customer'),
+        (UserProfile.SUPPORT_AGENT, 'bench_agent'),
+        (UserProfile.MANAGER, 'bench_manager'),
+    ]:
+        user, created = UserProfile.objects.get_or_create(
+            username=name,
+            defaults={'role': role, 'first_name': 'Bench', 'last_name': role.title()}
+        )
+        if created:
+            user.set_password(BENCH_PASSWORD)
+            user.save()
+        users[role] = user
+
+    target = ServiceRequest.objects.order_by('-id').first()
+    if target is None:
+        raise RuntimeError('No service requests to benchmark; generate data first')
+
+    # Give the benchmark customer a realistic share of requests
+    ServiceRequest.objects.filter(
+        id__in=ServiceRequest.objects.order_by('-id').values('id')[:50]
+    ).update(customer=users[UserProfile.CUSTOMER])
+
+    workflow_target = ServiceRequest.objects.exclude(id=target.id).order_by('-id').first() or target
+    ServiceRequest.objects.filter(id=workflow_target.id).update(status=ServiceRequest.IN_PROGRESS)
+
+    located = ServiceRequest.objects.filter(geohash__isnull=False).order_by('-id').first()
+
+    caller = UserProfile.objects.filter(
+        role=UserProfile.CUSTOMER, meter_key__isnull=False, phone_key__isnull=False
+    ).order_by('-id').first() or users[UserProfile.CUSTOMER]
+
+    context = {
+        'request_pk': target.id,
+        'workflow_pk': workflow_target.id,
+        'lookup_meter': quote(caller.gas_meter_id or ''),
+        'lookup_phone': quote(caller.phone_number or ''),
+        'nearby_lat': located.latitude if located else 0,
+        'nearby_lon': located.longitude if located else 0,
+        'report_from': snapshots.last_complete_day() - timedelta(days=30),
+    }
+    roles = {
+        'customer': users[UserProfile.CUSTOMER],
+        'agent': users[UserProfile.SUPPORT_AGENT],
+        'manager': users[UserProfile.MANAGER],
+    }
+    return context, roles
+
+
+def run(context, roles, iterations=20, warmup=2, only=None):
+    """
+    Benchmark every endpoint (or those named in ``only``) and return a
+    ``name -> metrics`` dict
+    """
+    results = {}
+    clients = {}
+    for name, method, path, role, data in ENDPOINTS:
+        if only and name not in only:
+            continue
+        if role not in clients:
+            # Record server errors as 5xx results instead of aborting the run
+            client = Client(raise_request_exception=False)
+            if role is not None:
+                client.force_login(roles[role])
+            clients[role] = client
+        client = clients[role]
+        url = path.format(**context)
+        call = getattr(client, method)
+
+        latencies, query_counts, sql_times, statuses = [], [], [], set()
+        for i in range(warmup + iterations):
+            payload = data(i) if callable(data) else data
+            timer = QueryTimer()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                response = call(url, payload) if payload is not None else call(url)
+                elapsed = time.perf_counter() - start
+            if i < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            query_counts.append(timer.count)
+            sql_times.append(timer.seconds * 1000)
+            statuses.add(response.status_code)
+
+        results[name] = {
+            'method': method.upper(),
+            'url': url,
+            'status_codes': sorted(statuses),
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries': max(query_counts),
+            'sql_ms_p50': round(percentile(sql_times, 50), 3),
+        }
+    return results
+
+
+def compare(results, baseline, latency_tolerance=0.25, query_tolerance=0):
+    """
+    Return a list of human-readable budget regressions against ``baseline``
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries'] + query_tolerance:
+            regressions.append(
+                f"{name}: {current['queries']} queries (baseline {previous['queries']})"
+            )
+        budget = previous['p95_ms'] * (1 + latency_tolerance)
+        if current['p95_ms'] > budget:
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']:.1f}ms over budget {budget:.1f}ms "
+                f"(baseline {previous['p95_ms']:.1f}ms)"
+            )
+        if any(code >= 500 for code in current['status_codes']):
+            regressions.append(f"{name}: server errors {current['status_codes']}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['endpoints']
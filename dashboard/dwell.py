@@ -0,0 +1,304 @@
+# dashboard/dwell.py
+"""
+Time-in-status analytics from the status history.
+
+Every RequestStatusHistory row ends a stretch of its request's life: the
+request was in ``previous_status`` from the previous change (or its
+creation) until ``changed_at``. ``analyze()`` takes the stretches ending
+within a period and builds dwell-time histograms per status, per category
+and status, and per agent and status, then ranks the open statuses by the
+time spent in them and lists the longest stretches.
+
+The start of each stretch comes from a LAG() window over the request's
+history, computed by the database; rows are then streamed and folded into
+fixed-size histograms, so memory does not grow with the history table.
+Only requests with a change in the period are read, through the
+``changed_at`` index, and their history in order through
+``sr_history_request_idx``. Archived requests are read from their stored
+history when the period reaches back past ARCHIVE_AFTER_DAYS.
+
+Finished periods cannot change, so ``report()`` stores each one's result
+in DwellTimeReport and serves it from there. The current period is kept
+in the cache for DWELL_CURRENT_CACHE_SECONDS, so repeated calls do not
+each rescan it. The agent of a stretch is the request's current assignee;
+the history records status changes only.
+"""
+import bisect
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import Coalesce, Lag
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import UserProfile
+from service_requests import archive, sharding
+from service_requests.models import ArchivedServiceRequest, RequestStatusHistory, ServiceCategory, ServiceRequest
+from service_requests.workflow import STATUS_LABELS
+from .models import DwellTimeReport
+from .snapshots import day_start
+
+# Histogram bucket upper bounds (seconds); one more bucket holds the rest
+DWELL_BUCKETS = (
+    60, 5 * 60, 15 * 60, 30 * 60, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 12 * 3600,
+    86400, 2 * 86400, 3 * 86400, 5 * 86400, 7 * 86400, 14 * 86400, 30 * 86400, 90 * 86400,
+)
+PERIODS = [choice for choice, _ in DwellTimeReport.PERIOD_CHOICES]
+
+
+class DwellError(ValueError):
+    pass
+
+
+class _Dwell:
+    """
+    Fixed-size histogram of stretch lengths
+    """
+    __slots__ = ('counts', 'total', 'longest')
+
+    def __init__(self):
+        self.counts = [0] * (len(DWELL_BUCKETS) + 1)
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(DWELL_BUCKETS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.longest:
+            self.longest = seconds
+
+    def percentile(self, pct):
+        """
+        Interpolated within the bucket holding the rank; the last bucket
+        ends at the longest stretch
+        """
+        count = sum(self.counts)
+        rank = pct / 100 * count
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and running + bucket_count >= rank:
+                low = DWELL_BUCKETS[index - 1] if index else 0
+                high = min(DWELL_BUCKETS[index], self.longest) if index < len(DWELL_BUCKETS) else self.longest
+                return low + (high - low) * max(rank - running, 0) / bucket_count
+            running += bucket_count
+        return None
+
+    def summary(self, buckets=False):
+        count = sum(self.counts)
+        summary = {
+            'count': count,
+            'total_seconds': round(self.total),
+            'mean_seconds': round(self.total / count, 1) if count else None,
+            'p50_seconds': round(self.percentile(50), 1) if count else None,
+            'p90_seconds': round(self.percentile(90), 1) if count else None,
+            'p95_seconds': round(self.percentile(95), 1) if count else None,
+            'max_seconds': round(self.longest, 1),
+        }
+        if buckets:
+            # Cumulative buckets, Prometheus style
+            summary['buckets'] = []
+            running = 0
+            for bound, bucket_count in zip((*DWELL_BUCKETS, None), self.counts):
+                running += bucket_count
+                summary['buckets'].append({'le': bound, 'count': running})
+        return summary
+
+
+def period_bounds(period, start):
+    """
+    ``(first day, day after the last)`` of the day, week (from Monday) or
+    month holding ``start``
+    """
+    if period == DwellTimeReport.DAY:
+        return start, start + timedelta(days=1)
+    if period == DwellTimeReport.WEEK:
+        first = start - timedelta(days=start.weekday())
+        return first, first + timedelta(days=7)
+    if period == DwellTimeReport.MONTH:
+        first = start.replace(day=1)
+        return first, (first + timedelta(days=32)).replace(day=1)
+    raise DwellError(f"period must be one of: {', '.join(PERIODS)}")
+
+
+def last_finished(period, now=None):
+    """
+    First day of the latest finished ``period``
+    """
+    today = timezone.localdate(now or timezone.now())
+    first, _ = period_bounds(period, today)
+    return period_bounds(period, first - timedelta(days=1))[0]
+
+
+def _stretches(start, end):
+    """
+    ``(request id, status, began_at, ended_at, category_id, agent_id)`` of
+    every stretch ending between ``start`` and ``end``
+    """
+    for part in sharding.each(RequestStatusHistory.objects.all()):
+        changed = RequestStatusHistory.objects.using(part.db).filter(
+            changed_at__gte=start, changed_at__lt=end
+        ).values('service_request_id')
+        rows = part.filter(service_request_id__in=changed, changed_at__lt=end).annotate(
+            began_at=Coalesce(
+                Window(
+                    Lag('changed_at'),
+                    partition_by=[F('service_request_id')],
+                    order_by=[F('changed_at').asc(), F('id').asc()],
+                ),
+                F('service_request__created_at'),
+            )
+        ).order_by().values_list(
+            'service_request_id', 'previous_status', 'began_at', 'changed_at',
+            'service_request__category_id', 'service_request__assigned_to_id'
+        )
+        for row in rows.iterator(chunk_size=2000):
+            # Earlier rows only supply the start of the first stretch in the period
+            if row[3] >= start:
+                yield row
+
+    if start >= archive.cutoff():
+        return
+    for part in sharding.each(ArchivedServiceRequest.objects.all()):
+        for archived in part.filter(created_at__lt=end, last_activity_at__gte=start).iterator(chunk_size=200):
+            began_at = archived.created_at
+            values = archived.data['request']
+            for row in sorted(
+                archived.data.get('status_history', []),
+                key=lambda row: (parse_datetime(row['changed_at']), row['id'])
+            ):
+                changed_at = parse_datetime(row['changed_at'])
+                if start <= changed_at < end:
+                    yield (
+                        archived.id, row['previous_status'], began_at, changed_at,
+                        archived.category_id, values['assigned_to_id']
+                    )
+                began_at = changed_at
+
+
+def analyze(start, end):
+    """
+    Dwell-time statistics of the stretches ending between ``start`` and
+    ``end`` (aware datetimes)
+    """
+    long_after = {
+        status: hours * 3600
+        for status, hours in getattr(settings, 'DWELL_LONG_STRETCH_HOURS', {}).items()
+    }
+    keep = getattr(settings, 'DWELL_LONGEST_STRETCHES', 20)
+    by_status, by_category, by_agent = {}, {}, {}
+    long_counts = {}
+    longest = []
+
+    for request_id, status, began_at, ended_at, category_id, agent_id in _stretches(start, end):
+        seconds = max((ended_at - began_at).total_seconds(), 0.0)
+        for groups, key in (
+            (by_status, status), (by_category, (category_id, status)), (by_agent, (agent_id, status))
+        ):
+            if key not in groups:
+                groups[key] = _Dwell()
+            groups[key].add(seconds)
+        if status in long_after and seconds > long_after[status]:
+            long_counts[status] = long_counts.get(status, 0) + 1
+        if status in ServiceRequest.OPEN_STATUSES:
+            stretch = (seconds, request_id, status, began_at, ended_at, category_id, agent_id)
+            if len(longest) < keep:
+                heapq.heappush(longest, stretch)
+            elif stretch > longest[0]:
+                heapq.heapreplace(longest, stretch)
+
+    categories = dict(ServiceCategory.objects.values_list('id', 'name'))
+    agent_ids = {agent_id for agent_id, _ in by_agent if agent_id}
+    agent_ids.update(stretch[6] for stretch in longest if stretch[6])
+    agents = {
+        pk: f'{first_name} {last_name}'
+        for pk, first_name, last_name in UserProfile.objects.filter(id__in=agent_ids).values_list(
+            'id', 'first_name', 'last_name'
+        )
+    }
+
+    open_total = sum(by_status[status].total for status in ServiceRequest.OPEN_STATUSES if status in by_status)
+    bottlenecks = []
+    for status in ServiceRequest.OPEN_STATUSES:
+        if status not in by_status:
+            continue
+        dwell = by_status[status]
+        bottlenecks.append({
+            'status': status,
+            'status_display': str(STATUS_LABELS.get(status, status)),
+            'share_of_open_time': round(dwell.total / open_total, 4) if open_total else None,
+            'p90_seconds': round(dwell.percentile(90), 1),
+            'long_stretches': long_counts.get(status, 0),
+            'long_after_seconds': long_after.get(status),
+        })
+    bottlenecks.sort(key=lambda row: row['share_of_open_time'] or 0, reverse=True)
+
+    return {
+        'statuses': {status: dwell.summary(buckets=True) for status, dwell in sorted(by_status.items())},
+        'categories': [
+            {'category_id': category_id, 'category_name': categories.get(category_id), 'status': status,
+             **dwell.summary()}
+            for (category_id, status), dwell in sorted(by_category.items())
+        ],
+        'agents': [
+            {'agent_id': agent_id, 'agent_name': agents.get(agent_id), 'status': status, **dwell.summary()}
+            for (agent_id, status), dwell in sorted(by_agent.items(), key=lambda item: (item[0][0] or 0, item[0][1]))
+        ],
+        'bottlenecks': bottlenecks,
+        'longest_stretches': [
+            {'request': request_id, 'status': status, 'seconds': round(seconds, 1),
+             'began_at': began_at.isoformat(), 'ended_at': ended_at.isoformat(),
+             'category_name': categories.get(category_id), 'agent_name': agents.get(agent_id)}
+            for seconds, request_id, status, began_at, ended_at, category_id, agent_id in sorted(
+                longest, reverse=True
+            )
+        ],
+    }
+
+
+def report(period, start=None, refresh=False, now=None):
+    """
+    Dwell-time statistics of the ``period`` holding ``start`` (default: the
+    latest finished one). Finished periods are computed once and stored;
+    the current period is cached for DWELL_CURRENT_CACHE_SECONDS
+    """
+    now = now or timezone.now()
+    if period not in PERIODS:
+        raise DwellError(f"period must be one of: {', '.join(PERIODS)}")
+    if start is not None:
+        first_year = getattr(settings, 'DWELL_FIRST_YEAR', 2000)
+        if start > timezone.localdate(now):
+            raise DwellError('The period has not started yet')
+        if start.year < first_year:
+            raise DwellError(f'start must be in {first_year} or later')
+    first, after = period_bounds(period, start or last_finished(period, now))
+    if first > timezone.localdate(now):
+        raise DwellError('The period has not started yet')
+    finished = after <= timezone.localdate(now)
+
+    current_key = f'dwell:{period}:{first.isoformat()}'
+    if not refresh and finished:
+        stored = DwellTimeReport.objects.filter(period=period, start=first).first()
+        if stored is not None:
+            return {**stored.data, 'computed_at': stored.computed_at}
+    elif not refresh:
+        cached = cache.get(current_key)
+        if cached is not None:
+            return cached
+
+    data = {
+        'period': period,
+        'from': first.isoformat(),
+        'to': (after - timedelta(days=1)).isoformat(),
+        'finished': finished,
+        **analyze(day_start(first), min(day_start(after), now)),
+    }
+    if finished:
+        DwellTimeReport.objects.update_or_create(
+            period=period, start=first, defaults={'computed_at': now, 'data': data}
+        )
+    else:
+        cache.set(current_key, {**data, 'computed_at': now}, getattr(settings, 'DWELL_CURRENT_CACHE_SECONDS', 300))
+    return {**data, 'computed_at': now}
@@ -0,0 +1,131 @@
+# dashboard/management/commands/benchmark_endpoints.py
+import json
+import platform
+import sys
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from dashboard import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark API endpoints through the Django test client and report '
+        'latency percentiles, query counts and SQL time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000, help='Generated customers')
+        parser.add_argument('--requests', type=int, default=10000, help='Generated service requests')
+        parser.add_argument('--comments-per-request', type=float, default=2)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run this endpoint (repeatable)')
+        parser.add_argument(
+            '--use-existing-db', action='store_true',
+            help='Benchmark the configured database instead of a fresh generated test database'
+        )
+        parser.add_argument('--output', help='Write JSON results to this file')
+        parser.add_argument('--baseline', help='Fail if results regress against this JSON file')
+        parser.add_argument('--save-baseline', help='Write results as a new baseline file')
+        parser.add_argument('--latency-tolerance', type=float, default=0.25,
+                            help='Allowed p95 growth over baseline, as a fraction')
+        parser.add_argument('--query-tolerance', type=int, default=0,
+                            help='Allowed extra queries over baseline')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = benchmarks.load_baseline(options['baseline'])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {e}")
+
+        setup_test_environment()
+        old_config = None
+        try:
+            if not options['use_existing_db']:
+                old_config = setup_databases(verbosity=0, interactive=False)
+                self._generate(options)
+            context, roles = benchmarks.prepare_fixtures()
+            results = benchmarks.run(
+                context, roles,
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                only=options['endpoints']
+            )
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'dataset': None if options['use_existing_db'] else {
+                'customers': options['customers'],
+                'requests': options['requests'],
+                'comments_per_request': options['comments_per_request'],
+            },
+            'endpoints': results,
+        }
+        self._print_table(results)
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                f.write(payload)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+
+        if baseline is not None:
+            regressions = benchmarks.compare(
+                results, baseline,
+                latency_tolerance=options['latency_tolerance'],
+                query_tolerance=options['query_tolerance']
+            )
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(self.style.ERROR(line))
+                sys.exit(1)
+            self.stdout.write(self.style.SUCCESS('All endpoints within baseline budgets'))
+
+    def _generate(self, options):
+        self.stdout.write(f"Generating {options['customers']} customers / {options['requests']} requests...")
+        quiet = StringIO()
+        call_command('create_sample_data', stdout=quiet)
+        # The test database may be in-memory, which worker processes cannot share
+        call_command(
+            'generate_load_data',
+            customers=options['customers'],
+            agents=max(options['customers'] // 100, 5),
+            requests=options['requests'],
+            comments_per_request=options['comments_per_request'],
+            workers=1,
+            stdout=quiet
+        )
+
+    def _print_table(self, results):
+        header = (
+            f"{'endpoint':<36} {'status':<10} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'queries':>8} {'sql ms':>9}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, r in results.items():
+            codes = ','.join(str(c) for c in r['status_codes'])
+            self.stdout.write(
+                f"{name:<36} {codes:<10} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                f"{r['p99_ms']:>9.1f} {r['queries']:>8} {r['sql_ms_p50']:>9.1f}"
+            )
@@ -0,0 +1,40 @@
+# dashboard/management/commands/build_snapshots.py
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the daily reporting snapshots (run nightly): by default every day '
+        'after the latest one built, up to yesterday. Rebuilding days is safe'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Rebuild this day (YYYY-MM-DD) only')
+        parser.add_argument('--from', dest='first_day', type=date.fromisoformat, help='First day to (re)build')
+        parser.add_argument('--to', dest='last_day', type=date.fromisoformat, help='Last day (default: yesterday)')
+
+    def handle(self, *args, **options):
+        first_day, last_day = options['first_day'], options['last_day']
+        if options['date']:
+            if first_day or last_day:
+                raise CommandError('Use --date or --from/--to, not both')
+            first_day = last_day = options['date']
+
+        started = time.perf_counter()
+        try:
+            built = snapshots.build(first_day, last_day)
+        except snapshots.SnapshotError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        if not built:
+            self.stdout.write('Snapshots are up to date')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {len(built)} day(s), {built[0]} to {built[-1]}, in {elapsed:.1f}s'
+        ))
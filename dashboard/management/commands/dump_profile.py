@@ -0,0 +1,111 @@
+# dashboard/management/commands/dump_profile.py
+import glob
+import io
+import os
+import pstats
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gas_utility_portal import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Dump profiles captured by the live profiler: merged collapsed stacks '
+        '(flamegraph.pl / speedscope input), hottest frames, or cProfile stats'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Capture files; default: all sampler captures')
+        parser.add_argument('--list', action='store_true', help='List captures in PROFILING_DIR')
+        parser.add_argument('--latest', action='store_true', help='Only the most recent capture')
+        parser.add_argument('--top', type=int, help='Print the N frames with the most self samples')
+        parser.add_argument('--output', help='Write merged collapsed stacks to this file')
+        parser.add_argument('--sort', default='cumulative', help='Sort key for cProfile captures')
+        parser.add_argument('--limit', type=int, default=40, help='Rows to print for cProfile captures')
+        parser.add_argument('--clear', action='store_true', help='Delete all captures')
+
+    def handle(self, *args, **options):
+        directory = profiling.output_dir()
+        captures = sorted(
+            glob.glob(os.path.join(directory, '*' + profiling.STACK_SUFFIX))
+            + glob.glob(os.path.join(directory, '*' + profiling.CPROFILE_SUFFIX)),
+            key=os.path.getmtime
+        )
+
+        if options['clear']:
+            for path in captures:
+                os.remove(path)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {len(captures)} capture(s) from {directory}'))
+            return
+
+        if options['list']:
+            if not captures:
+                self.stdout.write(f'No captures in {directory}')
+            for path in captures:
+                self.stdout.write(f'{os.path.basename(path)}  {os.path.getsize(path)} bytes')
+            return
+
+        files = [self._resolve(directory, name) for name in options['files']]
+        if not files:
+            files = [path for path in captures if path.endswith(profiling.STACK_SUFFIX)]
+        if options['latest']:
+            files = files[-1:]
+        if not files:
+            raise CommandError(f'No captures in {directory}')
+
+        cprofiles = [path for path in files if path.endswith(profiling.CPROFILE_SUFFIX)]
+        if cprofiles:
+            report = io.StringIO()
+            stats = pstats.Stats(*cprofiles, stream=report)
+            stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+            self.stdout.write(report.getvalue())
+
+        stacks = Counter()
+        for path in files:
+            if path.endswith(profiling.STACK_SUFFIX):
+                with open(path) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if stack:
+                            stacks[stack] += int(count)
+        if not stacks:
+            return
+
+        if options['top']:
+            self._print_top(stacks, options['top'])
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                self._write_stacks(stacks, f)
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {len(stacks)} stacks ({sum(stacks.values())} samples) to {options['output']}"
+            ))
+        else:
+            self._write_stacks(stacks, self.stdout)
+
+    def _resolve(self, directory, name):
+        for path in (name, os.path.join(directory, name)):
+            if os.path.exists(path):
+                return path
+        raise CommandError(f'Capture not found: {name}')
+
+    def _write_stacks(self, stacks, stream):
+        for stack, count in stacks.most_common():
+            stream.write(f'{stack} {count}\n')
+
+    def _print_top(self, stacks, limit):
+        total = sum(stacks.values())
+        self_samples = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(f'{total} samples')
+        self.stdout.write(f"{'self %':>7} {'total %':>8}  frame")
+        for frame, count in self_samples.most_common(limit):
+            self.stdout.write(
+                f'{100 * count / total:6.1f}% {100 * inclusive[frame] / total:7.1f}%  {frame}'
+            )
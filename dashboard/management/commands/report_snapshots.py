@@ -0,0 +1,42 @@
+# dashboard/management/commands/report_snapshots.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Print request counts and time in status for a range of days from the daily snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first_day', type=date.fromisoformat, required=True)
+        parser.add_argument('--to', dest='last_day', type=date.fromisoformat, help='Default: yesterday')
+        parser.add_argument('--by', choices=list(snapshots.GROUPINGS), default='category')
+
+    def handle(self, *args, **options):
+        last_day = options['last_day'] or snapshots.last_complete_day()
+        try:
+            result = snapshots.report(options['first_day'], last_day, options['by'])
+        except snapshots.SnapshotError as e:
+            raise CommandError(str(e))
+
+        by = result['by']
+        label = 'agent_name' if by == 'agent' else by
+        hours = [name for name in snapshots.COUNTERS if name.endswith('_seconds')]
+        header = f"{by:<28}{'opened':>9}{'closed':>9}{'reopened':>9}{'backlog':>9}" + ''.join(
+            f"{name[:-len('_seconds')] + ' h':>15}" for name in hours
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in result['rows']:
+            group = row[label] if row[label] is not None else '(unassigned)'
+            self.stdout.write(
+                f"{str(group)[:27]:<28}{row['opened']:>9}{row['closed']:>9}{row['reopened']:>9}{row['backlog']:>9}"
+                + ''.join(f'{row[name] / 3600:>15.1f}' for name in hours)
+            )
+        if result['missing_days']:
+            self.stdout.write(self.style.WARNING(
+                f"{len(result['missing_days'])} day(s) not built yet, from {result['missing_days'][0]}; "
+                'run build_snapshots'
+            ))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('service_requests', '0011_geo_dispatch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotDay',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('built_at', models.DateTimeField()),
+                ('requests', models.PositiveIntegerField(help_text='Requests open at some point of the day')),
+            ],
+            options={
+                'verbose_name': 'Snapshot Day',
+                'verbose_name_plural': 'Snapshot Days',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRequestSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], max_length=10)),
+                ('opened', models.PositiveIntegerField(default=0)),
+                ('closed', models.PositiveIntegerField(default=0, help_text='Moved from an open to a finished status')),
+                ('reopened', models.PositiveIntegerField(default=0)),
+                ('backlog', models.PositiveIntegerField(default=0, help_text='Open at the end of the day')),
+                ('new_seconds', models.PositiveBigIntegerField(default=0)),
+                ('assigned_seconds', models.PositiveBigIntegerField(default=0)),
+                ('in_progress_seconds', models.PositiveBigIntegerField(default=0)),
+                ('on_hold_seconds', models.PositiveBigIntegerField(default=0)),
+                ('agent', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='service_requests.servicecategory')),
+            ],
+            options={
+                'verbose_name': 'Daily Request Snapshot',
+                'verbose_name_plural': 'Daily Request Snapshots',
+                'indexes': [models.Index(fields=['day'], name='snapshot_day_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DwellTimeReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('start', models.DateField()),
+                ('computed_at', models.DateTimeField()),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'verbose_name': 'Dwell Time Report',
+                'verbose_name_plural': 'Dwell Time Reports',
+                'unique_together': {('period', 'start')},
+            },
+        ),
+    ]
@@ -1,3 +1,91 @@
+# dashboard/models.py
 from django.db import models
+from django.utils.translation import gettext_lazy as _
+from accounts.models import UserProfile
+from service_requests.models import ServiceCategory, ServiceRequest
 
-# Create your models here.
+class SnapshotDay(models.Model):
+    """
+    A day whose DailyRequestSnapshot rows have been built by
+    dashboard.snapshots; days with no activity have no snapshot rows
+    """
+    day = models.DateField(primary_key=True)
+    built_at = models.DateTimeField()
+    requests = models.PositiveIntegerField(help_text="Requests open at some point of the day")
+
+    class Meta:
+        verbose_name = _('Snapshot Day')
+        verbose_name_plural = _('Snapshot Days')
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"Snapshot of {self.day}"
+
+class DailyRequestSnapshot(models.Model):
+    """
+    Request activity of one day for one category, priority and agent:
+    one narrow row of counters, summed by range reports
+    """
+    day = models.DateField()
+    category = models.ForeignKey(
+        ServiceCategory,
+        on_delete=models.PROTECT,
+        related_name='+'
+    )
+    priority = models.CharField(max_length=10, choices=ServiceRequest.PRIORITY_CHOICES)
+    # Kept when the agent's account is deleted, like their requests' history
+    agent = models.ForeignKey(
+        UserProfile,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    opened = models.PositiveIntegerField(default=0)
+    closed = models.PositiveIntegerField(default=0, help_text="Moved from an open to a finished status")
+    reopened = models.PositiveIntegerField(default=0)
+    backlog = models.PositiveIntegerField(default=0, help_text="Open at the end of the day")
+    # Seconds spent in each open status during the day
+    new_seconds = models.PositiveBigIntegerField(default=0)
+    assigned_seconds = models.PositiveBigIntegerField(default=0)
+    in_progress_seconds = models.PositiveBigIntegerField(default=0)
+    on_hold_seconds = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('Daily Request Snapshot')
+        verbose_name_plural = _('Daily Request Snapshots')
+        indexes = [
+            models.Index(fields=['day'], name='snapshot_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.category_id}/{self.priority}/{self.agent_id}"
+
+class DwellTimeReport(models.Model):
+    """
+    Time-in-status analytics of one finished period, computed once by
+    dashboard.dwell and served from here afterwards
+    """
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
+    PERIOD_CHOICES = [
+        (DAY, _('Day')),
+        (WEEK, _('Week')),
+        (MONTH, _('Month')),
+    ]
+
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    computed_at = models.DateTimeField()
+    data = models.JSONField()
+
+    class Meta:
+        verbose_name = _('Dwell Time Report')
+        verbose_name_plural = _('Dwell Time Reports')
+        unique_together = [('period', 'start')]
+
+    def __str__(self):
+        return f"Dwell times for the {self.period} of {self.start}"
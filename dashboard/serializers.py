@@ -68,4 +68,18 @@ class AgentPerformanceSerializer(serializers.Serializer):
     assigned_count = serializers.IntegerField()
     completed_count = serializers.IntegerField()
     resolution_rate = serializers.FloatField()
-    avg_completion_time = serializers.DurationField(allow_null=True)
\ No newline at end of file
+    avg_completion_time = serializers.DurationField(allow_null=True)
+
+class AtRiskRequestSerializer(serializers.Serializer):
+    """
+    Serializer for open requests approaching their SLA deadline
+    """
+    id = serializers.IntegerField()
+    request_id = serializers.UUIDField()
+    title = serializers.CharField()
+    status = serializers.CharField()
+    priority = serializers.CharField()
+    category_name = serializers.CharField()
+    assigned_to_name = serializers.CharField(allow_null=True)
+    due_at = serializers.DateTimeField()
+    time_remaining = serializers.DurationField()
\ No newline at end of file
@@ -0,0 +1,277 @@
+# dashboard/snapshots.py
+"""
+Daily snapshot warehouse for reporting.
+
+``build()`` replays each request's status history over a range of days
+and stores, per day, category, priority and agent, one DailyRequestSnapshot
+row of counters: requests opened, closed and reopened, the backlog open at
+the end of the day, and the seconds spent in each open status. Range
+reports (``report()``) then sum those rows instead of aggregating the live
+request and history tables. Days are local dates; only past days are built.
+
+A day is rebuilt by deleting its rows and inserting them again in one
+transaction, so a rebuild can be repeated at will. Only the requests open at
+some point of the range are read: those open now and those whose status
+changed since the range began, found through the status history
+``changed_at`` index, plus archived requests when the range reaches back
+past ARCHIVE_AFTER_DAYS.
+
+Category, priority and agent are the request's current ones; the history
+records status changes only. Requests without any status history are taken
+to have had their current status since creation.
+"""
+import bisect
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import UserProfile
+from service_requests import archive, sharding
+from service_requests.models import ArchivedServiceRequest, RequestStatusHistory, ServiceRequest
+from .models import DailyRequestSnapshot, SnapshotDay
+
+OPEN_STATUSES = frozenset(ServiceRequest.OPEN_STATUSES)
+# Open status -> snapshot column of seconds spent in it
+STATUS_SECONDS = {status: f'{status}_seconds' for status in ServiceRequest.OPEN_STATUSES}
+COUNTERS = ('opened', 'closed', 'reopened', 'backlog', *STATUS_SECONDS.values())
+_COLUMN = {name: index for index, name in enumerate(COUNTERS)}
+
+# Days replayed per pass of build(); bounds the history held in memory
+BUILD_CHUNK_DAYS = 31
+# Request ids per history query
+ID_BATCH_SIZE = 500
+# Longest range report() covers, in days
+REPORT_MAX_DAYS = 3 * 366
+
+GROUPINGS = {
+    'day': 'day',
+    'category': 'category__name',
+    'priority': 'priority',
+    'agent': 'agent_id',
+}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def last_complete_day(now=None):
+    return timezone.localdate(now or timezone.now()) - timedelta(days=1)
+
+
+def _timelines(first_day, end):
+    """
+    ``(created_at, status, category_id, priority, agent_id, changes)`` of
+    every request open at some point between ``first_day`` and ``end``;
+    ``changes`` are the ``(changed_at, previous, new)`` status changes in
+    time order
+    """
+    start = day_start(first_day)
+    fields = ('id', 'created_at', 'status', 'category_id', 'priority', 'assigned_to_id')
+    for part in sharding.each(ServiceRequest.objects.all()):
+        requests = {}
+        for row in part.filter(status__in=OPEN_STATUSES, created_at__lt=end).order_by().values_list(*fields):
+            requests[row[0]] = row[1:]
+        changed = set(
+            RequestStatusHistory.objects.using(part.db).filter(changed_at__gte=start).order_by().values_list(
+                'service_request_id', flat=True
+            ).distinct()
+        )
+        changed -= requests.keys()
+        changed = sorted(changed)
+        for i in range(0, len(changed), ID_BATCH_SIZE):
+            for row in part.filter(id__in=changed[i:i + ID_BATCH_SIZE], created_at__lt=end).order_by().values_list(
+                *fields
+            ):
+                requests[row[0]] = row[1:]
+
+        ids = sorted(requests)
+        for i in range(0, len(ids), ID_BATCH_SIZE):
+            batch = ids[i:i + ID_BATCH_SIZE]
+            changes = {pk: [] for pk in batch}
+            for pk, changed_at, previous, new in RequestStatusHistory.objects.using(part.db).filter(
+                service_request_id__in=batch
+            ).order_by('changed_at', 'id').values_list(
+                'service_request_id', 'changed_at', 'previous_status', 'new_status'
+            ):
+                changes[pk].append((changed_at, previous, new))
+            for pk in batch:
+                yield (*requests[pk], changes[pk])
+
+    if start >= archive.cutoff():
+        return
+    # Archived requests were inactive for ARCHIVE_AFTER_DAYS before archival
+    for part in sharding.each(ArchivedServiceRequest.objects.all()):
+        for archived in part.filter(created_at__lt=end, last_activity_at__gte=start).iterator():
+            values = archived.data['request']
+            changes = sorted(
+                (parse_datetime(row['changed_at']), row['id'], row['previous_status'], row['new_status'])
+                for row in archived.data.get('status_history', [])
+            )
+            yield (
+                archived.created_at, archived.status, archived.category_id,
+                values['priority'], values['assigned_to_id'],
+                [(changed_at, previous, new) for changed_at, _, previous, new in changes],
+            )
+
+
+def _replay(timeline, bounds, facts):
+    """
+    Add one request's counters for the days delimited by ``bounds`` to
+    ``facts``, ``{(day index, category, priority, agent): counters}``;
+    returns the indexes of the days it was open in
+    """
+    created_at, current, category_id, priority, agent_id, changes = timeline
+    days = len(bounds) - 1
+
+    def counters(index):
+        key = (index, category_id, priority, agent_id)
+        if key not in facts:
+            facts[key] = [0] * len(COUNTERS)
+        return facts[key]
+
+    def day_of(moment):
+        # -1 before the range, ``days`` after it
+        return bisect.bisect_right(bounds, moment) - 1
+
+    index = day_of(created_at)
+    if 0 <= index < days:
+        counters(index)[_COLUMN['opened']] += 1
+
+    # (start, status) of each stretch of the request's life
+    segments = [(created_at, changes[0][1] if changes else current)]
+    for changed_at, previous, new in changes:
+        index = day_of(changed_at)
+        if 0 <= index < days:
+            if previous in OPEN_STATUSES and new not in OPEN_STATUSES:
+                counters(index)[_COLUMN['closed']] += 1
+            elif previous not in OPEN_STATUSES and new in OPEN_STATUSES:
+                counters(index)[_COLUMN['reopened']] += 1
+        segments.append((max(changed_at, created_at), new))
+
+    open_days = set()
+    for n, (begin, status) in enumerate(segments):
+        if status not in OPEN_STATUSES:
+            continue
+        end = segments[n + 1][0] if n + 1 < len(segments) else None
+        column = _COLUMN[STATUS_SECONDS[status]]
+        low, high = max(begin, bounds[0]), bounds[-1] if end is None else min(end, bounds[-1])
+        if low < high:
+            for index in range(day_of(low), day_of(high - timedelta(microseconds=1)) + 1):
+                counters(index)[column] += round(
+                    (min(high, bounds[index + 1]) - max(low, bounds[index])).total_seconds()
+                )
+                open_days.add(index)
+        # Backlog: open at the midnight ending the day
+        last = len(bounds) if end is None else bisect.bisect_left(bounds, end)
+        for boundary in range(max(bisect.bisect_left(bounds, begin), 1), last):
+            counters(boundary - 1)[_COLUMN['backlog']] += 1
+    return open_days
+
+
+def _build_days(first_day, days, now):
+    bounds = [day_start(first_day + timedelta(days=n)) for n in range(days + 1)]
+    facts = {}
+    requests = [0] * days
+    for timeline in _timelines(first_day, bounds[-1]):
+        for index in _replay(timeline, bounds, facts):
+            requests[index] += 1
+
+    with transaction.atomic():
+        DailyRequestSnapshot.objects.filter(day__range=(first_day, first_day + timedelta(days=days - 1))).delete()
+        DailyRequestSnapshot.objects.bulk_create(
+            [
+                DailyRequestSnapshot(
+                    day=first_day + timedelta(days=index), category_id=category_id, priority=priority,
+                    agent_id=agent_id, **dict(zip(COUNTERS, row))
+                )
+                for (index, category_id, priority, agent_id), row in facts.items()
+            ],
+            batch_size=1000
+        )
+        for n in range(days):
+            SnapshotDay.objects.update_or_create(
+                day=first_day + timedelta(days=n), defaults={'built_at': now, 'requests': requests[n]}
+            )
+
+
+def build(first_day=None, last_day=None, now=None):
+    """
+    Build (or rebuild) the snapshots of ``first_day`` to ``last_day``.
+    By default every day after the latest built one up to yesterday, or
+    just yesterday when nothing has been built yet. Returns the days built
+    """
+    now = now or timezone.now()
+    yesterday = last_complete_day(now)
+    last_day = last_day or yesterday
+    if last_day > yesterday:
+        raise SnapshotError(f'Only days up to {yesterday} are complete')
+    if first_day is None:
+        latest = SnapshotDay.objects.order_by('-day').values_list('day', flat=True).first()
+        first_day = latest + timedelta(days=1) if latest else last_day
+    if first_day > last_day:
+        return []
+
+    built = []
+    while first_day <= last_day:
+        days = min(BUILD_CHUNK_DAYS, (last_day - first_day).days + 1)
+        _build_days(first_day, days, now)
+        built.extend(first_day + timedelta(days=n) for n in range(days))
+        first_day += timedelta(days=days)
+    return built
+
+
+def report(first_day, last_day, by='category'):
+    """
+    Counters of ``first_day`` to ``last_day`` summed per ``by`` (a GROUPINGS
+    key), read from the snapshots alone. Backlog is the backlog at the end
+    of the range, or of each day when grouping by day; days not built yet
+    are listed in ``missing_days``
+    """
+    if by not in GROUPINGS:
+        raise SnapshotError(f"by must be one of: {', '.join(GROUPINGS)}")
+    if first_day > last_day:
+        raise SnapshotError('The range ends before it starts')
+    if (last_day - first_day).days >= REPORT_MAX_DAYS:
+        raise SnapshotError(f'The range may cover at most {REPORT_MAX_DAYS} days')
+
+    field = GROUPINGS[by]
+    sums = {name: Sum(name) for name in COUNTERS if name != 'backlog'}
+    sums['backlog'] = Sum('backlog') if by == 'day' else Sum('backlog', filter=Q(day=last_day))
+    rows = list(
+        DailyRequestSnapshot.objects.filter(day__range=(first_day, last_day)).values(field).annotate(
+            **sums
+        ).order_by(field)
+    )
+    if by == 'agent':
+        names = {
+            pk: f'{first_name} {last_name}'
+            for pk, first_name, last_name in UserProfile.objects.filter(
+                id__in=[row['agent_id'] for row in rows if row['agent_id']]
+            ).values_list('id', 'first_name', 'last_name')
+        }
+    for row in rows:
+        row[by] = row.pop(field)
+        if by == 'agent':
+            row['agent_name'] = names.get(row[by]) if row[by] else None
+        for name in COUNTERS:
+            row[name] = row[name] or 0
+
+    built = set(SnapshotDay.objects.filter(day__range=(first_day, last_day)).values_list('day', flat=True))
+    days = (last_day - first_day).days + 1
+    return {
+        'from': first_day,
+        'to': last_day,
+        'by': by,
+        'missing_days': [
+            day for day in (first_day + timedelta(days=n) for n in range(days)) if day not in built
+        ],
+        'rows': rows,
+    }
@@ -1,3 +1,282 @@
-from django.test import TestCase
+import base64
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts import throttling
+from accounts.models import UserProfile
+from service_requests import archive
+from service_requests.models import RequestStatusHistory, ServiceCategory, ServiceRequest
+from . import dwell, snapshots
+from .models import DailyRequestSnapshot, SnapshotDay
+
+DASHBOARD_URL = '/api/dashboard/dashboard/'
+
+
+class DwellTimeReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = UserProfile.objects.create_user('manager', password='pass', role=UserProfile.MANAGER)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def get(self, **params):
+        return self.client.get(DASHBOARD_URL + 'dwell_times/', params)
+
+    def test_start_out_of_range_is_refused(self):
+        for period, start in (('month', '9999-12-15'), ('week', '0001-01-01'), ('day', '1999-12-31')):
+            with self.subTest(period=period, start=start):
+                self.assertEqual(self.get(period=period, start=start).status_code, 400)
+
+    def test_finished_period_is_reported(self):
+        response = self.get(period='day', start='2024-02-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['finished'])
+
+    def test_current_period_is_cached(self):
+        first = self.get(period='day', start=str(timezone.localdate()))
+        self.assertEqual(first.status_code, 200)
+        self.assertFalse(first.data['finished'])
+        with self.assertNumQueries(0):
+            again = dwell.report('day', timezone.localdate())
+        self.assertEqual(again['computed_at'], first.data['computed_at'])
+
+
+class DwellAnalyzeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agent = UserProfile.objects.create_user(
+            'agent', password='pass', role=UserProfile.SUPPORT_AGENT, first_name='Ada', last_name='Agent'
+        )
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def create(self, created_at, changes, **fields):
+        """
+        A request created at ``created_at`` that moved through ``changes``,
+        ``(new status, hours after creation)`` pairs
+        """
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            assigned_to=self.agent, **fields
+        )
+        ServiceRequest.objects.filter(pk=service_request.pk).update(created_at=created_at)
+        previous = ServiceRequest.NEW
+        for status, hours in changes:
+            change = RequestStatusHistory.objects.create(
+                service_request=service_request, previous_status=previous, new_status=status, changed_by=self.agent
+            )
+            RequestStatusHistory.objects.filter(pk=change.pk).update(changed_at=created_at + timedelta(hours=hours))
+            previous = status
+        return service_request
+
+    def test_stretches_start_at_the_previous_change(self):
+        base = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        worked = self.create(base, [
+            (ServiceRequest.ASSIGNED, 1), (ServiceRequest.IN_PROGRESS, 3), (ServiceRequest.COMPLETED, 6)
+        ])
+        # No earlier change: its first stretch starts at creation
+        self.create(base + timedelta(hours=4), [(ServiceRequest.ASSIGNED, 1)])
+
+        data = dwell.analyze(base + timedelta(hours=2), base + timedelta(days=1))
+        totals = {status: (row['count'], row['total_seconds']) for status, row in data['statuses'].items()}
+        # The first stretch ended before the period
+        self.assertEqual(totals, {
+            ServiceRequest.NEW: (1, 3600),
+            ServiceRequest.ASSIGNED: (1, 2 * 3600),
+            ServiceRequest.IN_PROGRESS: (1, 3 * 3600),
+        })
+        longest = data['longest_stretches'][0]
+        self.assertEqual(
+            (longest['request'], longest['status'], longest['seconds'], longest['agent_name']),
+            (worked.id, ServiceRequest.IN_PROGRESS, 3 * 3600, 'Ada Agent')
+        )
+        self.assertEqual(data['bottlenecks'][0]['status'], ServiceRequest.IN_PROGRESS)
+
+    def test_archived_history_is_read(self):
+        base = timezone.now().replace(microsecond=0) - timedelta(days=400)
+        self.create(base, [(ServiceRequest.ASSIGNED, 1), (ServiceRequest.CLOSED, 4)])
+        ServiceRequest.objects.update(status=ServiceRequest.CLOSED, last_activity_at=base + timedelta(hours=4))
+        self.assertEqual(archive.archive(), 1)
+
+        data = dwell.analyze(base + timedelta(hours=2), base + timedelta(days=1))
+        self.assertEqual(
+            {status: row['total_seconds'] for status, row in data['statuses'].items()},
+            {ServiceRequest.ASSIGNED: 3 * 3600}
+        )
+        data = dwell.analyze(base, base + timedelta(days=1))
+        self.assertEqual(
+            {status: row['total_seconds'] for status, row in data['statuses'].items()},
+            {ServiceRequest.NEW: 3600, ServiceRequest.ASSIGNED: 3 * 3600}
+        )
+
+
+class SnapshotBuildTests(TestCase):
+    DAY = date(2024, 3, 5)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def at(self, day, hour):
+        return snapshots.day_start(self.DAY + timedelta(days=day)) + timedelta(hours=hour)
+
+    def create(self, created_at, changes, status):
+        """
+        A request created at ``created_at``, now in ``status``, that moved
+        through ``changes``, ``(previous, new, changed_at)`` triples
+        """
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            status=status
+        )
+        ServiceRequest.objects.filter(pk=service_request.pk).update(created_at=created_at)
+        for previous, new, changed_at in changes:
+            change = RequestStatusHistory.objects.create(
+                service_request=service_request, previous_status=previous, new_status=new, changed_by=self.customer
+            )
+            RequestStatusHistory.objects.filter(pk=change.pk).update(changed_at=changed_at)
+
+    def build(self):
+        snapshots.build(self.DAY, self.DAY + timedelta(days=2))
+        return [
+            DailyRequestSnapshot.objects.filter(day=self.DAY + timedelta(days=n)).values(*snapshots.COUNTERS).first()
+            for n in range(3)
+        ]
+
+    def counters(self, **values):
+        return {name: values.get(name, 0) for name in snapshots.COUNTERS}
+
+    def test_reopened_within_a_day(self):
+        self.create(self.at(0, 8), [
+            (ServiceRequest.NEW, ServiceRequest.COMPLETED, self.at(0, 10)),
+            (ServiceRequest.COMPLETED, ServiceRequest.IN_PROGRESS, self.at(0, 12)),
+            (ServiceRequest.IN_PROGRESS, ServiceRequest.CLOSED, self.at(0, 15)),
+        ], ServiceRequest.CLOSED)
+        self.assertEqual(self.build(), [
+            self.counters(opened=1, closed=2, reopened=1, new_seconds=2 * 3600, in_progress_seconds=3 * 3600),
+            None,
+            None,
+        ])
+        self.assertEqual(list(SnapshotDay.objects.order_by('day').values_list('requests', flat=True)), [1, 0, 0])
+
+    def test_stretch_spanning_midnight(self):
+        self.create(self.at(1, 20), [
+            (ServiceRequest.NEW, ServiceRequest.ASSIGNED, self.at(1, 22)),
+            (ServiceRequest.ASSIGNED, ServiceRequest.IN_PROGRESS, self.at(2, 3)),
+        ], ServiceRequest.IN_PROGRESS)
+        self.assertEqual(self.build(), [
+            None,
+            self.counters(opened=1, backlog=1, new_seconds=2 * 3600, assigned_seconds=2 * 3600),
+            self.counters(backlog=1, assigned_seconds=3 * 3600, in_progress_seconds=21 * 3600),
+        ])
+
+    def test_request_without_history_keeps_its_status(self):
+        self.create(self.at(0, 6), [], ServiceRequest.ON_HOLD)
+        self.assertEqual(self.build(), [
+            self.counters(opened=1, backlog=1, on_hold_seconds=18 * 3600),
+            self.counters(backlog=1, on_hold_seconds=24 * 3600),
+            self.counters(backlog=1, on_hold_seconds=24 * 3600),
+        ])
+        # Rebuilding replaces the rows
+        self.assertEqual(len(self.build()), 3)
+        self.assertEqual(DailyRequestSnapshot.objects.count(), 3)
+
+
+class SnapshotReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = UserProfile.objects.create_user('manager', password='pass', role=UserProfile.MANAGER)
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def test_range_is_capped(self):
+        response = self.client.get(DASHBOARD_URL + 'report/', {'from': '0001-01-01', 'to': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_days_are_listed(self):
+        response = self.client.get(DASHBOARD_URL + 'report/', {'from': '2024-01-01', 'to': '2024-01-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['missing_days']), 3)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, LOGIN_USERNAME_FAILURE_RATE=(10, 15 * 60))
+class AsyncDashboardAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        UserProfile.objects.create_user('manager', password='right-pass-123', role=UserProfile.MANAGER)
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def get(self, password, url='/api/dashboard/async/stats/'):
+        credentials = base64.b64encode(f'manager:{password}'.encode()).decode()
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}')
+
+    def test_session(self):
+        self.client.force_login(UserProfile.objects.get())
+        self.assertEqual(self.client.get('/api/dashboard/async/overview/').status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/dashboard/async/overview/').status_code, 403)
+
+    def test_basic_credentials(self):
+        self.assertEqual(self.get('right-pass-123').status_code, 200)
+        self.assertEqual(self.get('wrong').status_code, 403)
+
+    def test_failed_basic_logins_are_throttled(self):
+        for _ in range(10):
+            self.assertEqual(self.get('wrong').status_code, 403)
+        response = self.get('right-pass-123')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Counted with the DRF API's failures
+        self.assertEqual(self.get('right-pass-123', DASHBOARD_URL + 'stats/').status_code, 429)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PROFILING_ENABLED=True)
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        UserProfile.objects.create_user('agent', password='agent-pass-123', role=UserProfile.SUPPORT_AGENT)
+        UserProfile.objects.create_user('customer', password='customer-pass-123')
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.output = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output.cleanup)
+        self.enterContext(override_settings(PROFILING_DIR=self.output.name))
+
+    def get(self, username, password, url=DASHBOARD_URL + 'stats/'):
+        credentials = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}', HTTP_X_PROFILE='cprofile')
+
+    def test_staff_request_is_captured(self):
+        response = self.get('agent', 'agent-pass-123')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response['X-Profile-File'], os.listdir(self.output.name))
+
+    def test_other_callers_are_not_captured(self):
+        for username, password in (('customer', 'customer-pass-123'), ('agent', 'wrong')):
+            with self.subTest(username=username):
+                self.assertNotIn('X-Profile-File', self.get(username, password))
+        self.assertEqual(os.listdir(self.output.name), [])
+
+    def test_caller_is_authenticated_once(self):
+        with mock.patch.object(throttling, 'login_failed', wraps=throttling.login_failed) as failed:
+            self.assertEqual(self.get('agent', 'wrong').status_code, 403)
+        failed.assert_called_once()
+
+    def test_sessions_are_staff_only(self):
+        self.assertEqual(self.get('customer', 'customer-pass-123', '/api/dashboard/profiling/').status_code, 403)
+        response = self.get('agent', 'agent-pass-123', '/api/dashboard/profiling/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Profile-File', response)
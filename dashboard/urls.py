@@ -1,11 +1,23 @@
 # dashboard/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'dashboard', views.DashboardViewSet, basename='dashboard')
+router.register(r'profiling', views.ProfilingViewSet, basename='profiling')
+
+# Async versions of the dashboard endpoints, best served through asgi.py
+async_urlpatterns = [
+    path('stats/', async_views.stats, name='dashboard-async-stats'),
+    path('category_breakdown/', async_views.category_breakdown, name='dashboard-async-category-breakdown'),
+    path('status_breakdown/', async_views.status_breakdown, name='dashboard-async-status-breakdown'),
+    path('priority_breakdown/', async_views.priority_breakdown, name='dashboard-async-priority-breakdown'),
+    path('agent_performance/', async_views.agent_performance, name='dashboard-async-agent-performance'),
+    path('overview/', async_views.overview, name='dashboard-async-overview'),
+]
 
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
@@ -1,23 +1,39 @@
 # dashboard/views.py
+import re
+
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from django.db.models import Count, Q, Avg
+from django.db.models import Q, Avg, F, ExpressionWrapper, DurationField
+from django.conf import settings
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
 from collections import OrderedDict
 
 from accounts.models import UserProfile
 from service_requests.models import ServiceRequest, ServiceCategory
+from service_requests.workflow import STATUS_LABELS, PRIORITY_LABELS
+from service_requests import sharding, sla
+from gas_utility_portal import profiling
+from . import dwell, snapshots
 from .serializers import (
     DashboardStatsSerializer,
     CategoryBreakdownSerializer,
     StatusBreakdownSerializer,
     PriorityBreakdownSerializer,
-    AgentPerformanceSerializer
+    AgentPerformanceSerializer,
+    AtRiskRequestSerializer
 )
 
-class DashboardViewSet(viewsets.ViewSet):
+class IsStaffMember(permissions.BasePermission):
+    """
+    Custom permission to only allow staff members
+    """
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_staff_member
+
+class DashboardViewSet(profiling.CProfileViewMixin, viewsets.ViewSet):
     """
     API endpoint for dashboard statistics and metrics
     """
@@ -32,9 +48,9 @@ class DashboardViewSet(viewsets.ViewSet):
         
         # Base queryset based on user role
         if user.is_customer:
-            requests_qs = ServiceRequest.objects.filter(customer=user)
+            requests_qs = ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)
         else:
-            requests_qs = ServiceRequest.objects.all()
+            requests_qs = sharding.scatter(ServiceRequest.objects.all())
         
         # Calculate basic stats
         total_requests = requests_qs.count()
@@ -74,23 +90,21 @@ class DashboardViewSet(viewsets.ViewSet):
         
         # Base queryset based on user role
         if user.is_customer:
-            requests_qs = ServiceRequest.objects.filter(customer=user)
+            requests_qs = ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)
         else:
-            requests_qs = ServiceRequest.objects.all()
+            requests_qs = sharding.scatter(ServiceRequest.objects.all())
         
-        # Get category breakdown
-        category_data = requests_qs.values('category__name').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        # Get category breakdown, summed over the shards
+        category_data = sharding.count_by(requests_qs, 'category__name')
         
         total = requests_qs.count()
         breakdown_data = []
         
-        for item in category_data:
-            percentage = (item['count'] / total * 100) if total > 0 else 0
+        for category_name, count in category_data:
+            percentage = (count / total * 100) if total > 0 else 0
             breakdown_data.append({
-                'category_name': item['category__name'],
-                'count': item['count'],
+                'category_name': category_name,
+                'count': count,
                 'percentage': round(percentage, 2)
             })
         
@@ -106,24 +120,22 @@ class DashboardViewSet(viewsets.ViewSet):
         
         # Base queryset based on user role
         if user.is_customer:
-            requests_qs = ServiceRequest.objects.filter(customer=user)
+            requests_qs = ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)
         else:
-            requests_qs = ServiceRequest.objects.all()
+            requests_qs = sharding.scatter(ServiceRequest.objects.all())
         
-        # Get status breakdown
-        status_data = requests_qs.values('status').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        # Get status breakdown, summed over the shards
+        status_data = sharding.count_by(requests_qs, 'status')
         
         total = requests_qs.count()
         breakdown_data = []
         
-        for item in status_data:
-            percentage = (item['count'] / total * 100) if total > 0 else 0
-            status_display = dict(ServiceRequest.STATUS_CHOICES).get(item['status'], item['status'])
+        for status_value, count in status_data:
+            percentage = (count / total * 100) if total > 0 else 0
+            status_display = STATUS_LABELS.get(status_value, status_value)
             breakdown_data.append({
                 'status': status_display,
-                'count': item['count'],
+                'count': count,
                 'percentage': round(percentage, 2)
             })
         
@@ -139,24 +151,22 @@ class DashboardViewSet(viewsets.ViewSet):
         
         # Base queryset based on user role
         if user.is_customer:
-            requests_qs = ServiceRequest.objects.filter(customer=user)
+            requests_qs = ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)
         else:
-            requests_qs = ServiceRequest.objects.all()
+            requests_qs = sharding.scatter(ServiceRequest.objects.all())
         
-        # Get priority breakdown
-        priority_data = requests_qs.values('priority').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        # Get priority breakdown, summed over the shards
+        priority_data = sharding.count_by(requests_qs, 'priority')
         
         total = requests_qs.count()
         breakdown_data = []
         
-        for item in priority_data:
-            percentage = (item['count'] / total * 100) if total > 0 else 0
-            priority_display = dict(ServiceRequest.PRIORITY_CHOICES).get(item['priority'], item['priority'])
+        for priority, count in priority_data:
+            percentage = (count / total * 100) if total > 0 else 0
+            priority_display = PRIORITY_LABELS.get(priority, priority)
             breakdown_data.append({
                 'priority': priority_display,
-                'count': item['count'],
+                'count': count,
                 'percentage': round(percentage, 2)
             })
         
@@ -181,7 +191,7 @@ class DashboardViewSet(viewsets.ViewSet):
         performance_data = []
         
         for agent in agents:
-            assigned_requests = ServiceRequest.objects.filter(assigned_to=agent)
+            assigned_requests = sharding.scatter(ServiceRequest.objects.filter(assigned_to=agent))
             completed_requests = assigned_requests.filter(status=ServiceRequest.COMPLETED)
             
             assigned_count = assigned_requests.count()
@@ -195,7 +205,9 @@ class DashboardViewSet(viewsets.ViewSet):
             
             if completed_with_times.exists():
                 avg_time = completed_with_times.aggregate(
-                    avg_time=Avg('completed_at') - Avg('created_at')
+                    avg_time=Avg(ExpressionWrapper(
+                        F('completed_at') - F('created_at'), output_field=DurationField()
+                    ))
                 )['avg_time']
             else:
                 avg_time = None
@@ -209,4 +221,171 @@ class DashboardViewSet(viewsets.ViewSet):
             })
         
         serializer = AgentPerformanceSerializer(performance_data, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def at_risk(self, request):
+        """
+        Get open requests due within ?hours= (default 4), soonest deadline first (staff only)
+        """
+        user = request.user
+        
+        if not user.is_staff_member:
+            return Response(
+                {'error': 'You do not have permission to view at-risk requests'},
+                status=403
+            )
+        
+        try:
+            hours = float(request.query_params.get('hours', 4))
+            limit = int(request.query_params.get('limit', 50))
+        except ValueError:
+            return Response({'error': 'hours and limit must be numbers'}, status=400)
+        max_hours = getattr(settings, 'SLA_AT_RISK_MAX_HOURS', 31 * 24)
+        # Also refuses nan, which fails every comparison
+        if not 0 < hours <= max_hours:
+            return Response({'error': f'hours must be above 0 and at most {max_hours}'}, status=400)
+        limit = max(1, min(limit, getattr(settings, 'SLA_AT_RISK_MAX_RESULTS', 500)))
+        
+        now = timezone.now()
+        rows = sla.at_risk(timedelta(hours=hours), now=now).values(
+            'id', 'request_id', 'title', 'status', 'priority', 'due_at',
+            'category__name', 'assigned_to__first_name', 'assigned_to__last_name',
+            'assigned_to_id'
+        )[:limit]
+        
+        at_risk_data = []
+        for row in rows:
+            at_risk_data.append({
+                'id': row['id'],
+                'request_id': row['request_id'],
+                'title': row['title'],
+                'status': row['status'],
+                'priority': row['priority'],
+                'category_name': row['category__name'],
+                'assigned_to_name': (
+                    f"{row['assigned_to__first_name']} {row['assigned_to__last_name']}"
+                    if row['assigned_to_id'] else None
+                ),
+                'due_at': row['due_at'],
+                'time_remaining': row['due_at'] - now,
+            })
+        
+        serializer = AtRiskRequestSerializer(at_risk_data, many=True)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def report(self, request):
+        """
+        Get request counts and time in each open status for ?from= to ?to=
+        (default yesterday), per ?by= category, priority, agent or day, from
+        the daily snapshots (managers and admins only)
+        """
+        user = request.user
+        
+        if not user.is_staff_member or user.role not in [UserProfile.MANAGER, UserProfile.ADMIN]:
+            return Response(
+                {'error': 'You do not have permission to view reports'},
+                status=403
+            )
+        
+        try:
+            first_day = date.fromisoformat(request.query_params['from'])
+            last_day = request.query_params.get('to')
+            last_day = date.fromisoformat(last_day) if last_day else snapshots.last_complete_day()
+        except (KeyError, ValueError):
+            return Response({'error': 'from (and to) must be dates as YYYY-MM-DD'}, status=400)
+        
+        try:
+            return Response(snapshots.report(first_day, last_day, request.query_params.get('by', 'category')))
+        except snapshots.SnapshotError as e:
+            return Response({'error': str(e)}, status=400)
+    
+    @action(detail=False, methods=['get'])
+    def dwell_times(self, request):
+        """
+        Get time-in-status distributions per status, category and agent,
+        bottleneck statuses and the longest stretches for the ?period= (day,
+        week or month, default month) holding ?start= (default the latest
+        finished one) (staff only)
+        """
+        user = request.user
+        
+        if not user.is_staff_member:
+            return Response(
+                {'error': 'You do not have permission to view dwell times'},
+                status=403
+            )
+        
+        start = request.query_params.get('start')
+        try:
+            start = date.fromisoformat(start) if start else None
+        except ValueError:
+            return Response({'error': 'start must be a date as YYYY-MM-DD'}, status=400)
+        # Recomputing a stored period is for managers and admins
+        refresh = request.query_params.get('refresh') in ('1', 'true') and user.role in [
+            UserProfile.MANAGER, UserProfile.ADMIN
+        ]
+        
+        try:
+            return Response(dwell.report(request.query_params.get('period', 'month'), start, refresh=refresh))
+        except dwell.DwellError as e:
+            return Response({'error': str(e)}, status=400)
+
+
+class ProfilingViewSet(profiling.CProfileViewMixin, viewsets.ViewSet):
+    """
+    API endpoint controlling the sampling profiler of the worker process
+    that serves the call (staff only)
+    """
+    permission_classes = [IsStaffMember]
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not profiling.enabled():
+            raise NotFound('Profiling is disabled; set PROFILING_ENABLED')
+    
+    def list(self, request):
+        """
+        Get the state of the latest sampling session in this worker
+        """
+        sampler = profiling.current()
+        return Response(sampler.status() if sampler else {'running': False})
+    
+    @action(detail=False, methods=['post'])
+    def start(self, request):
+        """
+        Start sampling for ``seconds`` and/or ``requests``, optionally only
+        paths matching the ``pattern`` regex, every ``interval`` seconds
+        """
+        try:
+            seconds = request.data.get('seconds')
+            max_requests = request.data.get('requests')
+            options = {
+                'seconds': float(seconds) if seconds else None,
+                'requests': int(max_requests) if max_requests else None,
+                'pattern': request.data.get('pattern') or None,
+                'interval': float(request.data.get('interval', 0.005)),
+            }
+        except (TypeError, ValueError):
+            return Response({'error': 'seconds, requests and interval must be numbers'}, status=400)
+        
+        try:
+            sampler = profiling.start(**options)
+        except re.error as e:
+            return Response({'error': f'Invalid pattern: {e}'}, status=400)
+        except profiling.SessionRunning as e:
+            return Response({'error': str(e)}, status=409)
+        except profiling.ProfilingError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(sampler.status(), status=201)
+    
+    @action(detail=False, methods=['post'])
+    def stop(self, request):
+        """
+        Stop the running session and write its collapsed stacks
+        """
+        sampler = profiling.stop()
+        if sampler is None:
+            return Response({'error': 'No profiling session in this worker'}, status=404)
+        return Response(sampler.status())
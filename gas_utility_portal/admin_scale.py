@@ -0,0 +1,210 @@
+# gas_utility_portal/admin_scale.py
+"""
+Admin building blocks for tables with millions of rows.
+
+``LargeTableAdminMixin`` keeps the changelist to index-backed queries:
+a count that stops at ADMIN_EXACT_COUNT_LIMIT instead of ``COUNT(*)`` over
+the whole table (or the planner's estimate, on PostgreSQL),
+no second "total" count, and search limited to typed exact matches and
+index-friendly prefix ranges declared in ``indexed_search_fields``. The
+ordinary ``search_fields`` search (substring matches, a table scan) stays
+available through the "Search" sidebar filter, one search at a time.
+``PaginatedInlineMixin`` shows a page of related rows on the change page
+instead of all of them.
+"""
+import math
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+
+
+def _prefix_range(field, term):
+    """
+    ``field`` starting with ``term`` (case-sensitive) as a range an
+    ordinary B-tree index can serve
+    """
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(**{f'{field}__gte': term, f'{field}__lt': upper})
+
+
+def estimate_rows(model, using='default'):
+    """
+    Cheap row count estimate for ``model``'s table, or None.
+
+    Only PostgreSQL keeps one (``pg_class.reltuples``, refreshed by
+    autovacuum). Elsewhere there is none: the largest id overstates the
+    count by every deleted row, which after archival is most of the table
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been vacuumed or analyzed
+        return int(row[0]) if row and row[0] >= 0 else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ADMIN_EXACT_COUNT_LIMIT rows.
+
+    An unfiltered table larger than that reports its estimated size where
+    the database keeps one (PostgreSQL); any other result larger than that
+    reports the limit, so on SQLite the pages past it are reached by
+    narrowing the filters or search.
+    """
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10_000)
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+
+class FullTextSearchFilter(admin.SimpleListFilter):
+    """
+    Sidebar switch between the indexed search and the ``search_fields``
+    one; filters nothing itself
+    """
+    title = 'search'
+    parameter_name = 'search_mode'
+    FULL_TEXT = 'full'
+
+    def lookups(self, request, model_admin):
+        return [(self.FULL_TEXT, 'Full text (slow)')]
+
+    def choices(self, changelist):
+        choices = list(super().choices(changelist))
+        choices[0]['display'] = 'Indexed'
+        return choices
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class LargeTableAdminMixin:
+    """
+    ModelAdmin mixin for large tables.
+
+    ``indexed_search_fields`` is searched by default; ``search_fields``
+    only when the "Full text" search filter is picked. Each entry of
+    ``indexed_search_fields`` is
+    ``(lookup, kind)`` or ``(lookup, kind, normalize)`` where kind is
+    ``'exact'`` (terms that do not convert to the field's type are
+    skipped) or ``'prefix'``. A lookup through a relation is searched with
+    an ``IN`` subquery on the related table's index. Every lookup should be
+    indexed.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    indexed_search_fields = ()
+
+    def full_text_search(self, request):
+        return bool(self.search_fields) and (
+            request.GET.get(FullTextSearchFilter.parameter_name) == FullTextSearchFilter.FULL_TEXT
+        )
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if self.search_fields:
+            return [*list_filter, FullTextSearchFilter]
+        return list_filter
+
+    def get_search_fields(self, request):
+        if self.full_text_search(request):
+            return super().get_search_fields(request)
+        # Non-empty so the changelist shows the search box
+        return [lookup for lookup, *_ in self.indexed_search_fields]
+
+    def _search_condition(self, lookup, kind, term):
+        *relations, name = lookup.split('__')
+        model = self.model
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        field = model._meta.get_field(name)
+        if kind == 'exact':
+            try:
+                field.to_python(term)
+            except ValidationError:
+                return None
+            condition = Q(**{name: term})
+        else:
+            condition = _prefix_range(name, term)
+        if relations:
+            # Only single-level relations are supported
+            return Q(**{f'{relations[0]}__in': model._base_manager.filter(condition).values('pk')})
+        return condition
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.full_text_search(request):
+            return super().get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        conditions = Q()
+        for lookup, kind, *normalize in self.indexed_search_fields:
+            term = normalize[0](search_term) if normalize else search_term
+            if not term:
+                continue
+            condition = self._search_condition(lookup, kind, term)
+            if condition is not None:
+                conditions |= condition
+        if not conditions:
+            return queryset.none(), False
+        return queryset.filter(conditions), False
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset editing one page of the related rows
+    """
+    page = 1
+    per_page = 20
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = super().get_queryset()
+            self.total = queryset.count()
+            self.pages = max(1, math.ceil(self.total / self.per_page))
+            self.page = min(self.page, self.pages)
+            start = (self.page - 1) * self.per_page
+            self._page_queryset = queryset[start:start + self.per_page]
+        return self._page_queryset
+
+
+class PaginatedInlineMixin:
+    """
+    InlineModelAdmin mixin showing ``per_page`` related rows at a time,
+    selected with ``?<model name>_page=``; set ``ordering`` so pages are
+    stable
+    """
+    formset = PaginatedInlineFormSet
+    template = 'admin/edit_inline/paginated_tabular.html'
+    per_page = 20
+
+    def page_param(self):
+        return f'{self.model._meta.model_name}_page'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        try:
+            page = max(1, int(request.GET.get(self.page_param(), 1)))
+        except ValueError:
+            page = 1
+        return type(formset.__name__, (formset,), {
+            'page': page, 'per_page': self.per_page, 'page_param': self.page_param(),
+        })
+
+
+class PaginatedTabularInline(PaginatedInlineMixin, admin.TabularInline):
+    pass
@@ -0,0 +1,248 @@
+# gas_utility_portal/batch.py
+"""
+Batched API calls: ``POST /api/batch/`` with a list of sub-requests, one
+combined response.
+
+Each sub-request is resolved with the project URLconf and dispatched to
+its view through the BATCH_MIDDLEWARE chain only (metrics, instrumentation,
+profiling), not the full stack: it reuses the outer request's
+already-authenticated user and session, so authentication runs once per
+batch. Every sub-response keeps its own status code.
+
+Runs of consecutive GETs are dispatched concurrently on a small thread
+pool when the database allows: each thread uses its own connection, so
+this is skipped inside a transaction, whose writes other connections could
+not see, and for in-memory SQLite. Writes run in order. With
+``"atomic": true`` the whole batch runs in one transaction per request
+database (every shard, see service_requests.sharding), all rolled back at
+the first sub-request that fails.
+"""
+import contextvars
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import HttpRequest, JsonResponse, QueryDict
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from service_requests import sharding
+
+from .profiling import CProfileViewMixin
+
+logger = logging.getLogger('django.request')
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+READ_METHODS = ('GET',)
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _error(code, message):
+    return {'status': code, 'headers': {}, 'body': {'error': message}}
+
+
+def _concurrent_reads_allowed():
+    if getattr(settings, 'BATCH_MAX_WORKERS', 4) <= 1:
+        return False
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block:
+        return False
+    return not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+def _call_view(request):
+    match = request.resolver_match
+    try:
+        return match.func(request, *match.args, **match.kwargs)
+    except Exception:
+        if settings.DEBUG:
+            raise
+        logger.exception('Internal Server Error in batch: %s', request.path)
+        return JsonResponse({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _middleware_chain():
+    """
+    BATCH_MIDDLEWARE around the view, with their process_view hooks, as
+    Django's handler builds the full stack
+    """
+    view_hooks = []
+
+    def view(request):
+        match = request.resolver_match
+        for hook in view_hooks:
+            response = hook(request, match.func, match.args, match.kwargs)
+            if response is not None:
+                return response
+        return _call_view(request)
+
+    handler = view
+    for path in reversed(getattr(settings, 'BATCH_MIDDLEWARE', [])):
+        handler = import_string(path)(handler)
+        if hasattr(handler, 'process_view'):
+            view_hooks.insert(0, handler.process_view)
+    return handler
+
+
+class BatchView(CProfileViewMixin, APIView):
+    """
+    Run several API calls in one round trip.
+
+    Body: ``{"requests": [{"method": "GET", "path": "/api/...", "body": {...}},
+    ...], "atomic": false}``. Returns ``{"responses": [{"status", "headers",
+    "body"}, ...]}`` in the same order, plus ``rolled_back`` for atomic
+    batches.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        operations = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return Response(
+                {'error': 'requests must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = getattr(settings, 'BATCH_MAX_OPERATIONS', 20)
+        if len(operations) > limit:
+            return Response(
+                {'error': f'At most {limit} requests per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        self.handler = _middleware_chain()
+        if request.data.get('atomic'):
+            responses, rolled_back = self._run_atomic(request, operations)
+            return Response({'responses': responses, 'rolled_back': rolled_back})
+        return Response({'responses': self._run(request, operations)})
+
+    def _run(self, request, operations):
+        concurrent = _concurrent_reads_allowed()
+        responses = []
+        reads = []
+        for operation in operations:
+            if concurrent and self._method(operation) in READ_METHODS:
+                reads.append(operation)
+                continue
+            responses += self._run_reads(request, reads)
+            reads = []
+            responses.append(self._dispatch(request, operation))
+        responses += self._run_reads(request, reads)
+        return responses
+
+    def _run_reads(self, request, operations):
+        if len(operations) < 2:
+            return [self._dispatch(request, operation) for operation in operations]
+        workers = min(len(operations), getattr(settings, 'BATCH_MAX_WORKERS', 4))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                # Copied context keeps per-request instrumentation attached
+                pool.submit(contextvars.copy_context().run, self._dispatch_in_thread, request, operation)
+                for operation in operations
+            ]
+            return [future.result() for future in futures]
+
+    def _dispatch_in_thread(self, request, operation):
+        try:
+            return self._dispatch(request, operation)
+        finally:
+            connections.close_all()
+
+    def _run_atomic(self, request, operations):
+        responses = []
+        try:
+            with ExitStack() as stack:
+                for alias in sharding.databases():
+                    stack.enter_context(transaction.atomic(using=alias))
+                for operation in operations:
+                    response = self._dispatch(request, operation)
+                    responses.append(response)
+                    if response['status'] >= 400:
+                        raise _Rollback
+        except _Rollback:
+            skipped = _error(status.HTTP_424_FAILED_DEPENDENCY, 'Not run: an earlier request in the batch failed')
+            responses += [skipped] * (len(operations) - len(responses))
+            return responses, True
+        return responses, False
+
+    def _method(self, operation):
+        return str(operation.get('method', 'GET')).upper() if isinstance(operation, dict) else None
+
+    def _dispatch(self, request, operation):
+        method = self._method(operation)
+        if method not in METHODS:
+            return _error(status.HTTP_400_BAD_REQUEST, f'method must be one of: {", ".join(METHODS)}')
+        path = operation.get('path')
+        if not isinstance(path, str) or not path.startswith('/api/'):
+            return _error(status.HTTP_400_BAD_REQUEST, 'path must be an /api/ URL')
+        path, _, query = path.partition('?')
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return _error(status.HTTP_404_NOT_FOUND, 'Not found.')
+        if getattr(match.func, 'view_class', None) is BatchView:
+            return _error(status.HTTP_400_BAD_REQUEST, 'Batches cannot be nested')
+
+        sub = self._build_request(request, method, path, query, operation.get('body'))
+        sub.resolver_match = match
+        try:
+            response = self.handler(sub)
+        except Exception:
+            if settings.DEBUG:
+                raise
+            return _error(status.HTTP_500_INTERNAL_SERVER_ERROR, 'Internal server error')
+        return self._payload(response)
+
+    def _build_request(self, request, method, path, query, body):
+        outer = request._request
+        content = b'' if body is None else json.dumps(body).encode()
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = path
+        sub.META = {
+            # The outer request is profiled as a whole, if asked for
+            **{name: value for name, value in outer.META.items() if name != 'HTTP_X_PROFILE'},
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+        }
+        sub.content_type = 'application/json'
+        sub.content_params = {}
+        sub.GET = QueryDict(query)
+        sub.COOKIES = outer.COOKIES
+        sub._stream = io.BytesIO(content)
+        sub._read_started = False
+        # Authenticated once for the whole batch; CSRF was checked on it too
+        sub.user = request.user
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+        sub._dont_enforce_csrf_checks = True
+        if hasattr(outer, 'session'):
+            sub.session = outer.session
+        return sub
+
+    def _payload(self, response):
+        if hasattr(response, 'data'):
+            body = response.data
+        elif getattr(response, 'streaming', False):
+            body = None
+        else:
+            body = response.content.decode(response.charset or 'utf-8')
+            if response.get('Content-Type', '').startswith('application/json') and body:
+                body = json.loads(body)
+        return {
+            'status': response.status_code,
+            'headers': {name: value for name, value in response.items() if name != 'Content-Length'},
+            'body': body,
+        }
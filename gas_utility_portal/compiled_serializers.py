@@ -0,0 +1,158 @@
+# gas_utility_portal/compiled_serializers.py
+"""
+Compiled read-only serialization for list endpoints.
+
+A ``ModelSerializer`` builds every row by walking its field objects:
+``get_attribute``, ``to_representation`` and, for ``SerializerMethodField``,
+one method call per row. ``CompiledSerializer`` inspects the serializer
+once per request instead. It selects exactly the rendered columns with
+``values_list()``, takes method fields from SQL expressions the serializer
+declares in ``sql_fields``, and encodes each column with a function picked
+up front. Identity encoders are skipped entirely. The output is the same
+as the serializer's, key for key and byte for byte once rendered.
+
+Serializers with fields that cannot be compiled fall back to the regular
+path.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import fields as drf_fields
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def _datetime_encoder(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', None) or field.default_timezone()
+    if output_format is None or output_format.lower() != drf_fields.ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def encode(value):
+        if timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return encode
+
+
+def _choice_encoder(field):
+    mapping = field.choice_strings_to_values
+    if all(isinstance(key, str) and key == value for key, value in mapping.items()):
+        # Stored values are the rendered values; DRF passes unknown ones through
+        return None
+    return field.to_representation
+
+
+def _encoder(field, model_field):
+    """
+    Function turning a non-null database value into the field's output,
+    or None when the value is already the output
+    """
+    if isinstance(field, drf_fields.ChoiceField):
+        return _choice_encoder(field)
+    if isinstance(field, drf_fields.DateTimeField):
+        return _datetime_encoder(field)
+    if isinstance(field, drf_fields.UUIDField):
+        return str if field.uuid_format == 'hex_verbose' else field.to_representation
+    if isinstance(field, drf_fields.IntegerField) and model_field.get_internal_type() in (
+        'AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField',
+        'BigIntegerField', 'SmallIntegerField', 'PositiveIntegerField',
+        'PositiveBigIntegerField', 'PositiveSmallIntegerField',
+    ):
+        return None
+    if isinstance(field, drf_fields.CharField) and model_field.get_internal_type() in (
+        'CharField', 'TextField', 'SlugField', 'EmailField', 'URLField',
+    ):
+        return None
+    return field.to_representation
+
+
+class CompiledSerializer:
+    """
+    Encoder table for one serializer instance's readable fields
+    """
+    def __init__(self, serializer):
+        model = serializer.Meta.model
+        sql_fields = getattr(serializer, 'sql_fields', {})
+        self.names = []
+        self.columns = []
+        self.annotations = {}
+        self.encoders = []
+
+        for field in serializer._readable_fields:
+            name = field.field_name
+            if name in sql_fields:
+                alias = f'_compiled_{name}'
+                self.annotations[alias] = sql_fields[name]
+                self.names.append(name)
+                self.columns.append(alias)
+                continue
+            if isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)) \
+                    or len(field.source_attrs) != 1:
+                raise NotCompilable(f'{name} has no SQL equivalent')
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                raise NotCompilable(f'{name} is not a model field')
+            if model_field.is_relation:
+                raise NotCompilable(f'{name} is a relation')
+            encoder = _encoder(field, model_field)
+            if encoder is not None:
+                self.encoders.append((name, encoder))
+            self.names.append(name)
+            self.columns.append(model_field.attname)
+
+    def values(self, queryset):
+        if self.annotations:
+            queryset = queryset.annotate(**self.annotations)
+        return queryset.values_list(*self.columns)
+
+    def encode(self, rows):
+        names = self.names
+        encoders = self.encoders
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, encode in encoders:
+                value = item[name]
+                if value is not None:
+                    item[name] = encode(value)
+            data.append(item)
+        return data
+
+
+def compile_serializer(serializer):
+    """
+    CompiledSerializer for ``serializer``, or None if it cannot be compiled
+    """
+    try:
+        return CompiledSerializer(serializer)
+    except NotCompilable:
+        return None
+
+
+class CompiledListMixin:
+    """
+    ViewSet mixin serving ``list`` through CompiledSerializer when the list
+    serializer can be compiled and ``API_COMPILED_LIST_SERIALIZATION`` is on
+    """
+    def list(self, request, *args, **kwargs):
+        compiled = None
+        if getattr(settings, 'API_COMPILED_LIST_SERIALIZATION', True):
+            compiled = compile_serializer(self.get_serializer())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.encode(page))
+        return Response(compiled.encode(queryset))
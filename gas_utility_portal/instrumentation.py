@@ -0,0 +1,223 @@
+# gas_utility_portal/instrumentation.py
+"""
+Per-request SQL and timing instrumentation.
+
+Every database connection, in any thread, gets an execute wrapper that
+counts and times each query for the sampled request whose context it runs
+in, grouped by fingerprint so repeated statements (N+1 loops) stand out.
+Worker threads started with the request's context (batch sub-requests,
+``sync_to_async``) are counted too; a batch sub-request is counted both on
+its own and in its batch. DRF serializer ``.data`` evaluation is timed
+separately. Results go out as a ``Server-Timing`` header, to staff or with
+DEBUG on, and as a structured log line when the request is slow.
+
+Unsampled requests only pay for one ``random()`` call and a context lookup
+per query.
+"""
+import contextvars
+import functools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('gas_utility_portal.requests')
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+# Collapse placeholder lists so "IN (%s, %s)" and "IN (%s)" match
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('(%s...)', sql)).strip()
+
+
+def current_metrics():
+    """
+    Metrics for the request being handled in this context, or None when
+    the request is not sampled
+    """
+    return _current.get()
+
+
+class RequestMetrics:
+    """
+    Timings and query statistics gathered for one request
+    """
+    __slots__ = (
+        'started', 'view_name', 'query_count', 'sql_seconds', 'fingerprints',
+        'serialize_seconds', 'serialize_sql_seconds', '_serialize_depth', 'total_seconds',
+        'parent', '_lock',
+    )
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.view_name = None
+        self.query_count = 0
+        self.sql_seconds = 0.0
+        self.fingerprints = Counter()
+        self.serialize_seconds = 0.0
+        self.serialize_sql_seconds = 0.0
+        self._serialize_depth = 0
+        self.total_seconds = None
+
+    def record(self, sql, elapsed):
+        # Worker threads of the request record concurrently
+        with self._lock:
+            self.query_count += 1
+            self.sql_seconds += elapsed
+            if self._serialize_depth:
+                self.serialize_sql_seconds += elapsed
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+    def server_timing(self):
+        serialize = max(self.serialize_seconds - self.serialize_sql_seconds, 0.0)
+        app = max(self.total_seconds - self.sql_seconds - serialize, 0.0)
+        return ', '.join([
+            f'db;dur={self.sql_seconds * 1000:.2f};desc="{self.query_count} queries"',
+            f'serialize;dur={serialize * 1000:.2f}',
+            f'app;dur={app * 1000:.2f}',
+            f'total;dur={self.total_seconds * 1000:.2f}',
+        ])
+
+    def as_dict(self, duplicate_threshold):
+        return {
+            'view': self.view_name,
+            'queries': self.query_count,
+            'sql_ms': round(self.sql_seconds * 1000, 2),
+            'serialize_ms': round(self.serialize_seconds * 1000, 2),
+            'serialize_sql_ms': round(self.serialize_sql_seconds * 1000, 2),
+            'total_ms': round(self.total_seconds * 1000, 2),
+            'duplicate_queries': [
+                {'sql': sql[:500], 'count': count}
+                for sql, count in self.duplicates(duplicate_threshold)[:5]
+            ],
+        }
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        while metrics is not None:
+            metrics.record(sql, elapsed)
+            metrics = metrics.parent
+
+
+def _install(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    _install(connection)
+
+
+def _timed_data(fget):
+    @functools.wraps(fget)
+    def data(serializer):
+        metrics = _current.get()
+        if metrics is None:
+            return fget(serializer)
+        # Only the outermost .data call is timed; nested serializers and
+        # ListSerializer -> Serializer super() calls run inside it
+        metrics._serialize_depth += 1
+        start = time.perf_counter()
+        try:
+            return fget(serializer)
+        finally:
+            metrics._serialize_depth -= 1
+            if not metrics._serialize_depth:
+                metrics.serialize_seconds += time.perf_counter() - start
+    data._instrumented = True
+    return data
+
+
+def instrument_serializers():
+    """
+    Wrap DRF serializer ``.data`` properties so their evaluation is timed
+    """
+    from rest_framework import serializers
+
+    for cls in (serializers.BaseSerializer, serializers.Serializer, serializers.ListSerializer):
+        prop = cls.__dict__.get('data')
+        if isinstance(prop, property) and not getattr(prop.fget, '_instrumented', False):
+            setattr(cls, 'data', property(_timed_data(prop.fget)))
+
+
+def _is_staff(request):
+    # Set by DRF for API views once the view has run
+    user = getattr(request, 'user', None)
+    return bool(user is not None and getattr(user, 'is_staff_member', False))
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Record query counts, SQL time, serializer time and total time for a
+    sample of requests
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 1.0)
+        self.slow_ms = getattr(settings, 'INSTRUMENTATION_SLOW_REQUEST_MS', 500)
+        self.duplicate_threshold = getattr(settings, 'INSTRUMENTATION_DUPLICATE_THRESHOLD', 5)
+        self.server_timing = getattr(settings, 'INSTRUMENTATION_SERVER_TIMING', True)
+        instrument_serializers()
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        # Connections opened before this module was loaded
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+        metrics = RequestMetrics(parent=_current.get())
+        request.metrics = metrics
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics.total_seconds = time.perf_counter() - metrics.started
+        if metrics.view_name is None and request.resolver_match is not None:
+            metrics.view_name = request.resolver_match.view_name
+
+        if self.server_timing and (settings.DEBUG or _is_staff(request)):
+            response['Server-Timing'] = metrics.server_timing()
+
+        if metrics.total_seconds * 1000 >= self.slow_ms:
+            record = metrics.as_dict(self.duplicate_threshold)
+            record.update({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+            })
+            logger.warning(json.dumps(record), extra={'request_metrics': record})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None and request.resolver_match is not None:
+            metrics.view_name = request.resolver_match.view_name
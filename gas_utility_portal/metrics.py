@@ -0,0 +1,453 @@
+# gas_utility_portal/metrics.py
+"""
+Prometheus text-format metrics shared by every worker process.
+
+All samples live in one memory-mapped file. Each entry is a UTF-8 key
+(the rendered sample name and labels) followed by a float64 value.
+Updates take a POSIX record lock on the file, so every gunicorn worker,
+management command and the scrape itself see the same numbers without a
+collector process. Entries are appended, never moved, so a label set
+keeps its place in the exposition output.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+_HEADER = struct.Struct('<q')  # bytes in use, header included
+_KEY_LENGTH = struct.Struct('<i')
+_VALUE = struct.Struct('<d')
+_INITIAL_SIZE = 1 << 20
+
+# Default latency buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+class SharedStore:
+    """
+    ``key -> float`` map in a file mapped by every process
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+
+    def _open(self):
+        # Reopen after a fork so each process holds its own descriptor;
+        # record locks belong to the process, not the descriptor
+        if self._pid == os.getpid():
+            return
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock(fd):
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, _INITIAL_SIZE)
+                os.pwrite(fd, _HEADER.pack(_HEADER.size), 0)
+        self._fd = fd
+        self._map = mmap.mmap(fd, os.fstat(fd).st_size)
+        self._positions = {}
+        self._scanned = _HEADER.size
+        self._pid = os.getpid()
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(fd):
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._open()
+            with self._file_lock(self._fd):
+                self._refresh()
+                yield
+
+    def _refresh(self):
+        """
+        Pick up growth and entries appended by other processes
+        """
+        size = os.fstat(self._fd).st_size
+        if size != len(self._map):
+            self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+        used = _HEADER.unpack_from(self._map, 0)[0]
+        position = self._scanned
+        while position < used:
+            length = _KEY_LENGTH.unpack_from(self._map, position)[0]
+            start = position + _KEY_LENGTH.size
+            key = self._map[start:start + length].decode()
+            value_position = _aligned(start + length)
+            self._positions[key] = value_position
+            position = value_position + _VALUE.size
+        self._scanned = used
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+        encoded = key.encode()
+        start = self._scanned
+        value_position = _aligned(start + _KEY_LENGTH.size + len(encoded))
+        end = value_position + _VALUE.size
+        if end > len(self._map):
+            size = len(self._map)
+            while size < end:
+                size *= 2
+            os.ftruncate(self._fd, size)
+            self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+        _KEY_LENGTH.pack_into(self._map, start, len(encoded))
+        self._map[start + _KEY_LENGTH.size:start + _KEY_LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self._map, value_position, 0.0)
+        _HEADER.pack_into(self._map, 0, end)
+        self._positions[key] = value_position
+        self._scanned = end
+        return value_position
+
+    def inc(self, items):
+        """
+        Add ``amount`` to each ``(key, amount)`` pair in one locked update
+        """
+        with self._locked():
+            for key, amount in items:
+                position = self._position(key)
+                value = _VALUE.unpack_from(self._map, position)[0]
+                _VALUE.pack_into(self._map, position, value + amount)
+
+    def set(self, items):
+        with self._locked():
+            for key, value in items:
+                # Position first: adding the key may remap the file
+                position = self._position(key)
+                _VALUE.pack_into(self._map, position, value)
+
+    def set_min(self, key, value):
+        """
+        Lower a value, treating 0 as unset
+        """
+        with self._locked():
+            position = self._position(key)
+            current = _VALUE.unpack_from(self._map, position)[0]
+            if not current or value < current:
+                _VALUE.pack_into(self._map, position, value)
+
+    def get(self, key, default=0.0):
+        with self._locked():
+            position = self._positions.get(key)
+            if position is None:
+                return default
+            return _VALUE.unpack_from(self._map, position)[0]
+
+    def items(self):
+        with self._locked():
+            return [
+                (key, _VALUE.unpack_from(self._map, position)[0])
+                for key, position in self._positions.items()
+            ]
+
+
+def _default_path():
+    # One file per database so test runs never mix with the real counters
+    name = str(settings.DATABASES['default']['NAME'])
+    digest = hashlib.sha1(name.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'gas_utility_portal-{digest}.metrics')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SharedStore(getattr(settings, 'METRICS_FILE', None) or _default_path())
+    return _store
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Child:
+    """
+    One label set of a metric; holds its pre-rendered sample keys
+    """
+    def __init__(self, metric, values):
+        self.metric = metric
+        self.key = f'{metric.name}\x00{metric.name}{_labels(metric.labelnames, values)}'
+
+    def inc(self, amount=1):
+        store().inc([(self.key, amount)])
+
+    def dec(self, amount=1):
+        store().inc([(self.key, -amount)])
+
+    def set(self, value):
+        store().set([(self.key, value)])
+
+    def set_min(self, value):
+        store().set_min(self.key, value)
+
+
+class _HistogramChild:
+    def __init__(self, metric, values):
+        name = metric.name
+        prefix = f'{name}\x00{name}'
+        self.bounds = metric.buckets
+        self.bucket_keys = [
+            f'{prefix}_bucket{_labels((*metric.labelnames, "le"), (*values, bound))}'
+            for bound in (*(repr(float(b)) for b in metric.buckets), '+Inf')
+        ]
+        self.sum_key = f'{prefix}_sum{_labels(metric.labelnames, values)}'
+        self.count_key = f'{prefix}_count{_labels(metric.labelnames, values)}'
+
+    def observe(self, value):
+        # Buckets are stored cumulative; every key is written each time so
+        # a label set's samples are appended together and stay in order
+        items = [
+            (key, 1 if value <= bound else 0)
+            for key, bound in zip(self.bucket_keys, (*self.bounds, float('inf')))
+        ]
+        items.append((self.sum_key, value))
+        items.append((self.count_key, 1))
+        store().inc(items)
+
+
+class Metric:
+    kind = None
+    child_class = _Child
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self.child_class(self, [str(v) for v in values])
+        return child
+
+    def samples(self, stored, current):
+        return stored
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    child_class = _HistogramChild
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class ComputedGauge(Metric):
+    """
+    Gauge derived at scrape time from other stored values; ``func`` gets
+    the ``key -> value`` map and returns ``(label_values, value)`` pairs
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func, labelnames=()):
+        self.func = func
+        super().__init__(name, documentation, labelnames)
+
+    def samples(self, stored, current):
+        return [
+            (f'{self.name}{_labels(self.labelnames, values)}', value)
+            for values, value in self.func(current)
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collect_hooks = []
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Duplicate metric {metric.name}')
+        self._metrics[metric.name] = metric
+
+    def on_collect(self, func):
+        """
+        Decorator: run ``func`` before each scrape (e.g. lazy initialisation)
+        """
+        self._collect_hooks.append(func)
+        return func
+
+    def render(self):
+        for hook in self._collect_hooks:
+            hook()
+        stored = {}
+        current = {}
+        for key, value in store().items():
+            family, sample = key.split('\x00', 1)
+            stored.setdefault(family, []).append((sample, value))
+            current[key] = value
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample, value in metric.samples(stored.get(metric.name, []), current):
+                lines.append(f'{sample} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Request latency by view action and method',
+    ['view', 'method']
+)
+request_count = Counter(
+    'http_requests_total', 'Responses by view action, method and status code',
+    ['view', 'method', 'status']
+)
+request_queries = Histogram(
+    'http_request_db_queries', 'Database queries issued per request',
+    ['view'], buckets=QUERY_COUNT_BUCKETS
+)
+cache_lookups = Counter(
+    'cache_lookups_total', 'In-process cache lookups by cache and result',
+    ['cache', 'result']
+)
+
+
+def _cache_hit_ratio(current):
+    totals = {}
+    for values, child in cache_lookups._children.items():
+        cache, result = values
+        hits, total = totals.get(cache, (0.0, 0.0))
+        value = current.get(child.key, 0.0)
+        totals[cache] = (hits + (value if result == 'hit' else 0.0), total + value)
+    return [((cache,), hits / total) for cache, (hits, total) in totals.items() if total]
+
+
+cache_hit_ratio = ComputedGauge(
+    'cache_hit_ratio', 'Share of cache lookups served from cache since the metrics file was created',
+    _cache_hit_ratio, ['cache']
+)
+
+
+def record_cache(cache, hit):
+    cache_lookups.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+class _QueryCounter:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and query count for every request, labelled by
+    DRF action (``ViewSet.action``) or URL name
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        view = getattr(request, '_metrics_view', None) or 'unmatched'
+        method = request.method
+        request_latency.labels(view, method).observe(elapsed)
+        request_count.labels(view, method, response.status_code).inc()
+        request_queries.labels(view).observe(counter.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            action = actions.get(request.method.lower(), request.method.lower())
+            request._metrics_view = f'{view_func.cls.__name__}.{action}'
+        elif hasattr(view_func, 'cls'):
+            request._metrics_view = view_func.cls.__name__
+        else:
+            request._metrics_view = request.resolver_match.view_name or view_func.__name__
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint; open to METRICS_ALLOWED_IPS and staff users
+    """
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    user = getattr(request, 'user', None)
+    if request.META.get('REMOTE_ADDR') not in allowed and not getattr(user, 'is_staff_member', False):
+        return HttpResponseForbidden('Metrics are not available from this address')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
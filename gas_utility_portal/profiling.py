@@ -0,0 +1,302 @@
+# gas_utility_portal/profiling.py
+"""
+Opt-in live profiling for a single worker process.
+
+Two tools, both idle until a staff member (``is_staff_member``) asks for
+them at runtime, so no restart is needed; ``PROFILING_ENABLED = False``
+forbids both:
+
+* A statistical stack sampler. A session is started over the API on
+  whichever worker serves that call, for a number of seconds and/or
+  requests, optionally restricted to paths matching a regex. While a
+  matching request runs, its thread's stack is sampled on ``SIGPROF``
+  (CPU time) when the session was started from the main thread, as with
+  gunicorn sync workers, or from a sampler thread otherwise. Samples are
+  aggregated in memory as collapsed stacks and written to ``PROFILING_DIR``
+  when the session ends.
+* A one-shot ``cProfile`` capture of a single request, triggered by the
+  ``X-Profile: cprofile`` request header. It starts once the API view has
+  authenticated the caller as staff (views opt in with
+  ``CProfileViewMixin``); other callers are served unprofiled.
+
+``manage.py dump_profile`` reads the files from ``PROFILING_DIR``.
+"""
+import cProfile
+import itertools
+import os
+import re
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+STACK_SUFFIX = '.collapsed'
+CPROFILE_SUFFIX = '.prof'
+
+_session = None
+# Re-entrant: the SIGPROF handler may stop the session on the main thread
+_session_lock = threading.RLock()
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class SessionRunning(ProfilingError):
+    pass
+
+
+def enabled():
+    return getattr(settings, 'PROFILING_ENABLED', False)
+
+
+def output_dir():
+    path = getattr(settings, 'PROFILING_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'gas_utility_portal-profiles'
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+_sequence = itertools.count(1)
+
+
+def _output_path(prefix, suffix):
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    name = f'{prefix}-{stamp}-{os.getpid()}-{next(_sequence)}{suffix}'
+    return os.path.join(output_dir(), name)
+
+
+_labels = {}
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        roots = sorted((str(settings.BASE_DIR), *filter(None, sys.path)), key=len, reverse=True)
+        for root in roots:
+            if filename.startswith(root):
+                filename = filename[len(root):].lstrip(os.sep)
+                break
+        # Collapsed stacks separate frames with ';'
+        name = getattr(code, 'co_qualname', code.co_name)
+        label = _labels[code] = f'{name} ({filename})'.replace(';', ':')
+    return label
+
+
+def collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class StackSampler:
+    """
+    Sample the stacks of threads serving matching requests
+    """
+    def __init__(self, interval=0.005, seconds=None, requests=None, pattern=None):
+        if not seconds and not requests:
+            raise ProfilingError('Give a duration in seconds, a number of requests, or both')
+        max_seconds = getattr(settings, 'PROFILING_MAX_SECONDS', 300)
+        self.interval = max(interval, 0.001)
+        self.seconds = min(seconds or max_seconds, max_seconds)
+        self.max_requests = requests
+        self.pattern = pattern
+        self._pattern = re.compile(pattern) if pattern else None
+        self.stacks = Counter()
+        self.samples = 0
+        self.requests = 0
+        self.started = time.monotonic()
+        self.deadline = self.started + self.seconds
+        self.output = None
+        self.mode = None
+        self._threads = {}
+        self._stopped = threading.Event()
+
+    def start(self):
+        if threading.current_thread() is threading.main_thread():
+            self.mode = 'signal'
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            # Signal handlers can only be installed from the main thread
+            self.mode = 'thread'
+            threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def _on_signal(self, signum, frame):
+        self._sample(frame)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample(None)
+
+    def _sample(self, interrupted):
+        if time.monotonic() >= self.deadline:
+            stop()
+            return
+        idents = list(self._threads)
+        if not idents:
+            return
+        main = threading.main_thread().ident
+        frames = None
+        for ident in idents:
+            if ident == main and interrupted is not None:
+                frame = interrupted
+            else:
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(ident)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+
+    def matches(self, path):
+        return self._pattern is None or self._pattern.search(path) is not None
+
+    def enter(self):
+        # Counted: batch sub-requests run inside their outer request
+        ident = threading.get_ident()
+        self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def exit(self):
+        ident = threading.get_ident()
+        depth = self._threads.pop(ident, 0) - 1
+        if depth > 0:
+            self._threads[ident] = depth
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            stop()
+
+    def finish(self):
+        self._stopped.set()
+        if self.mode == 'signal':
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGPROF, self._previous_handler)
+        self._threads.clear()
+        self.output = _output_path('stacks', STACK_SUFFIX)
+        with open(self.output, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'mode': self.mode,
+            'pattern': self.pattern,
+            'interval': self.interval,
+            'seconds': self.seconds,
+            'max_requests': self.max_requests,
+            'requests': self.requests,
+            'samples': self.samples,
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'running': not self._stopped.is_set(),
+            'output': self.output,
+        }
+
+
+def start(**options):
+    """
+    Start a sampling session in this process
+    """
+    global _session
+    with _session_lock:
+        if _session is not None and not _session._stopped.is_set():
+            raise SessionRunning('A profiling session is already running in this worker')
+        sampler = StackSampler(**options)
+        sampler.start()
+        _session = sampler
+    return sampler
+
+
+def stop():
+    """
+    End the running session, if any, and write its collapsed stacks
+    """
+    with _session_lock:
+        sampler = _session
+        if sampler is None or sampler._stopped.is_set():
+            return sampler
+        sampler.finish()
+    return sampler
+
+
+def current():
+    """
+    The latest session in this process, stopping it first if it has expired
+    """
+    sampler = _session
+    if sampler is not None and not sampler._stopped.is_set() and time.monotonic() >= sampler.deadline:
+        stop()
+    return sampler
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_authenticated and user.is_staff_member)
+
+
+class CProfileViewMixin:
+    """
+    Start the ``X-Profile: cprofile`` capture of a request once the view has
+    authenticated the caller, if they are staff. The middleware stops it
+    after the response is rendered and writes it out
+    """
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        wrapped = request._request
+        if getattr(wrapped, '_cprofile_requested', False) and _is_staff(request):
+            wrapped._cprofile = cProfile.Profile()
+            wrapped._cprofile.enable()
+
+
+class ProfilingMiddleware:
+    """
+    Feed matching requests to the running sampler and write the cProfile
+    capture of requests carrying ``X-Profile: cprofile``
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+
+        sampler = current()
+        if sampler is not None and sampler._stopped.is_set():
+            sampler = None
+        if sampler is not None and not sampler.matches(request.path):
+            sampler = None
+
+        if sampler is not None:
+            sampler.enter()
+        try:
+            if request.META.get(PROFILE_HEADER, '').lower() == 'cprofile':
+                return self._cprofile(request)
+            return self.get_response(request)
+        finally:
+            if sampler is not None:
+                sampler.exit()
+
+    def _cprofile(self, request):
+        request._cprofile_requested = True
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler = getattr(request, '_cprofile', None)
+            if profiler is not None:
+                profiler.disable()
+        if profiler is None:
+            return response
+        path = _output_path('request', CPROFILE_SUFFIX)
+        profiler.dump_stats(path)
+        response['X-Profile-File'] = os.path.basename(path)
+        return response
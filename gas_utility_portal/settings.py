@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gas_utility_portal.instrumentation.RequestInstrumentationMiddleware',
+    'gas_utility_portal.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gas_utility_portal.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'gas_utility_portal.urls'
@@ -85,9 +88,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
 }
 
+# Region sharding of service requests (service_requests.sharding). Inactive
+# with a single database. To run locally with one SQLite file per shard:
+#
+#   DATABASES['east'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'east.sqlite3'}
+#   REQUEST_SHARD_DATABASES = ['default', 'east']
+#   SERVICE_REGIONS = {'east': ['0', '1', '2']}    # ZIP code prefixes
+#   REQUEST_SHARDS = {'east': 'east'}               # region -> database
+#
+# then ``migrate --database east`` and ``sync_shard_reference_data``.
+# REQUEST_SHARD_DATABASES is append-only: a database's position fixes the
+# id range its requests are numbered from.
+DATABASE_ROUTERS = ['service_requests.routers.RequestShardRouter']
+REQUEST_SHARD_DATABASES = ['default']
+SERVICE_REGIONS = {}
+REQUEST_SHARDS = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -107,6 +126,16 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing: accounts.hashers first so hashes are made at
+# PASSWORD_HASH_ITERATIONS; the others only verify older hashes
+PASSWORD_HASHERS = [
+    'accounts.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Custom user model
 AUTH_USER_MODEL = 'accounts.UserProfile'
 
@@ -139,7 +168,7 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'accounts.authentication.ThrottledBasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -153,6 +182,162 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Service request auto-assignment; each process rebuilds its agent loads
+# from the database this often, picking up other processes' assignments
+SERVICE_REQUEST_AUTO_ASSIGN = True
+SERVICE_REQUEST_AGENT_CAPACITY = 25  # Open requests per agent before low/medium priority waits
+SERVICE_REQUEST_BALANCER_TTL_SECONDS = 60
+
+# Duplicate report detection: same meter/address within the window and
+# title/description shingle similarity at or above the threshold
+SERVICE_REQUEST_DUPLICATE_WINDOW_HOURS = 24
+SERVICE_REQUEST_DUPLICATE_CANDIDATES = 20
+SERVICE_REQUEST_DUPLICATE_THRESHOLD = 0.3
+
+# /api/dashboard/dashboard/at_risk/: the furthest look-ahead (hours) and most
+# requests returned
+SLA_AT_RISK_MAX_HOURS = 31 * 24
+SLA_AT_RISK_MAX_RESULTS = 500
+
+# Cache holding the SLA policies, and how long (seconds) a worker may use
+# them after a policy changed where the cache is not shared
+SLA_POLICY_CACHE = 'default'
+SLA_POLICY_CACHE_SECONDS = 60
+
+# Emergency queue long-polling and time-to-dispatch objective; the
+# dispatch latency report reaches back at most EMERGENCY_LATENCY_MAX_DAYS.
+# Cursors trail the clock by EMERGENCY_QUEUE_SETTLE_SECONDS so changes from
+# still-open transactions are not skipped. A waiting poll holds a worker,
+# so waits stay short
+EMERGENCY_QUEUE_POLL_SECONDS = 1.0
+EMERGENCY_QUEUE_MAX_WAIT_SECONDS = 5
+EMERGENCY_QUEUE_SETTLE_SECONDS = 2
+EMERGENCY_DISPATCH_SLO_SECONDS = 15 * 60
+EMERGENCY_LATENCY_MAX_DAYS = 366
+
+# Delta sync for field agent clients: a pass ends SYNC_SETTLE_SECONDS
+# behind the clock so rows from still-open transactions are not skipped;
+# cursors older than the tombstone retention must sync from scratch
+SYNC_SETTLE_SECONDS = 2
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Comment threads: cursor page size (?page_size= up to the maximum) of the
+# comments action, and comments embedded in request details (the latest)
+COMMENT_PAGE_SIZE = 50
+COMMENT_MAX_PAGE_SIZE = 200
+REQUEST_DETAIL_COMMENTS = 20
+
+# /api/batch/: sub-requests per call, and threads for concurrent GETs
+# (used only outside transactions and not with in-memory SQLite)
+BATCH_MAX_OPERATIONS = 20
+BATCH_MAX_WORKERS = 4
+# Middleware each sub-request runs through; the rest of MIDDLEWARE only
+# runs for the outer request
+BATCH_MIDDLEWARE = [
+    'gas_utility_portal.instrumentation.RequestInstrumentationMiddleware',
+    'gas_utility_portal.metrics.MetricsMiddleware',
+    'gas_utility_portal.profiling.ProfilingMiddleware',
+]
+
+# Large-table admin changelists count at most this many rows exactly;
+# bigger unfiltered tables show PostgreSQL's estimate, or this limit
+ADMIN_EXACT_COUNT_LIMIT = 10_000
+
+# Archival: completed, closed and cancelled requests with no activity for
+# ARCHIVE_AFTER_DAYS are moved to the archive table by archive_requests,
+# ARCHIVE_BATCH_SIZE per transaction
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 500
+
+# Caller lookup (/api/accounts/users/lookup/): most customers returned for
+# one search
+LOOKUP_MAX_MATCHES = 10
+
+# /api/dashboard/async/: queries run at once per call, each on its own
+# connection (1 runs them in turn; also the case inside transactions and
+# with in-memory SQLite)
+DASHBOARD_QUERY_WORKERS = 4
+
+# Geocoding of service addresses (service_requests.geo): the geocoder class,
+# and for the default one a CSV of ZIP code centroids with columns
+# postal_code, latitude, longitude. Without a file nothing is geocoded.
+GEOCODER = 'service_requests.geo.PostalCodeGazetteer'
+GEO_GAZETTEER_CSV = None
+# /api/service-requests/requests/nearby/: most requests returned, and the
+# largest radius (km) searched
+GEO_NEARBY_MAX_RESULTS = 500
+GEO_NEARBY_MAX_RADIUS_KM = 25
+
+# Dispatch planning: most visits per field batch, and how far (km) a visit
+# may be from the first one of its batch
+DISPATCH_BATCH_SIZE = 8
+DISPATCH_RADIUS_KM = 5.0
+
+# Time-in-status analytics (/api/dashboard/dashboard/dwell_times/): hours
+# after which a stretch in a status counts as long, and how many of the
+# longest stretches to list
+DWELL_LONG_STRETCH_HOURS = {'new': 4, 'assigned': 24, 'in_progress': 72, 'on_hold': 72}
+DWELL_LONGEST_STRETCHES = 20
+# Earliest year a dwell-time report may start in, and how long (seconds)
+# the report of the current, unfinished period is cached
+DWELL_FIRST_YEAR = 2000
+DWELL_CURRENT_CACHE_SECONDS = 300
+
+# Login throttling (accounts.throttling), checked before any password is
+# hashed: (count, seconds) sliding windows of failed logins per client
+# address and per username from one address, and of registrations per
+# address; None turns one off. Counters live in the LOGIN_THROTTLE_CACHE
+# cache, per process as configured in CACHES; point it at Redis or
+# Memcached to share them between workers.
+LOGIN_THROTTLE_CACHE = 'throttle'
+LOGIN_IP_FAILURE_RATE = (30, 15 * 60)
+LOGIN_USERNAME_FAILURE_RATE = (10, 15 * 60)
+REGISTER_IP_RATE = (10, 60 * 60)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
+# Password hashing cost (accounts.hashers): PBKDF2 iterations (None:
+# Django's default). Hashes made at another cost are upgraded after the
+# user's next login by PASSWORD_UPGRADE_WORKERS background threads (0: during
+# the login request).
+PASSWORD_HASH_ITERATIONS = None
+PASSWORD_UPGRADE_WORKERS = 1
+
+# Per-request SQL/timing instrumentation; sampled requests get a
+# Server-Timing header and are logged when slower than the threshold
+INSTRUMENTATION_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+INSTRUMENTATION_SLOW_REQUEST_MS = 500
+INSTRUMENTATION_DUPLICATE_THRESHOLD = 5  # Same query fingerprint this often suggests N+1
+INSTRUMENTATION_SERVER_TIMING = True
+
+# Prometheus metrics: samples are shared by all worker processes through a
+# memory-mapped file (default: one per database in the system temp dir)
+METRICS_FILE = None
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # Staff users may scrape from anywhere
+
+# Serve list endpoints from values() rows with precomputed encoders when the
+# list serializer supports it; output is identical to the regular serializer
+API_COMPILED_LIST_SERIALIZATION = True
+
+# Live profiling (staff only): sampler sessions are started at
+# runtime via /api/dashboard/profiling/, single-request cProfile captures via
+# the "X-Profile: cprofile" header. Nothing runs until one is requested; set
+# PROFILING_ENABLED = False to forbid both. Output goes to PROFILING_DIR
+# (default: system temp dir); read it with dump_profile.
+PROFILING_ENABLED = True
+PROFILING_DIR = None
+PROFILING_MAX_SECONDS = 300
+
 # CORS settings - adjust as needed for your frontend
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Set to specific origins in production
 CORS_ALLOW_CREDENTIALS = True
@@ -0,0 +1,156 @@
+# gas_utility_portal/sparse_fields.py
+"""
+Sparse fieldsets and expand control for API serializers.
+
+``?fields=id,title,customer.first_name`` keeps only the listed fields;
+dotted names select fields of a nested serializer. ``?expand=customer,
+comments`` embeds only the listed relations: any other expandable to-one
+relation is rendered as its primary key, and any other expandable to-many
+relation is left out. Without the parameters output is unchanged.
+
+Fields are pruned when the serializer builds them, before anything is
+evaluated. The view uses the same selection to trim ``select_related`` and
+``prefetch_related``, so dropped relations are never queried.
+"""
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fields(value):
+    """
+    Turn ``"a,b.c,b.d"`` into ``{'a': None, 'b': {'c': None, 'd': None}}``
+    """
+    tree = {}
+    for path in value.split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        node = tree
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1:
+                node.setdefault(part, None)
+            else:
+                child = node.get(part)
+                if child is None:
+                    child = node[part] = {}
+                node = child
+    return tree
+
+
+def parse_list(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin accepting ``fields`` and ``expand`` keyword arguments
+    (strings in query parameter syntax, or already parsed).
+
+    ``expandable_fields`` names the relations subject to ``expand``.
+    ``select_related_fields`` and ``prefetch_related_fields`` map field names
+    to the lookups they need; a prefetch value may be a callable taking the
+    serializer context and returning the lookup.
+    """
+    expandable_fields = ()
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        self._sparse_fields = parse_fields(fields) if isinstance(fields, str) else fields
+        self._sparse_expand = parse_list(expand) if isinstance(expand, str) else expand
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def _selection(cls, fields, expand):
+        """
+        Names of the relation fields that will be rendered in full
+        """
+        selected = parse_fields(fields) if isinstance(fields, str) else fields
+        expand = parse_list(expand) if isinstance(expand, str) else expand
+        names = set(cls.select_related_fields) | set(cls.prefetch_related_fields)
+        if selected is not None:
+            names &= set(selected)
+        if expand is not None:
+            names = {
+                name for name in names
+                if name not in cls.expandable_fields or name in expand
+                or (selected and selected.get(name))
+            }
+        return names
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fields=None, expand=None, context=None):
+        """
+        Add only the joins and prefetches the selected fields need
+        """
+        names = cls._selection(fields, expand)
+        select = [cls.select_related_fields[name] for name in names if name in cls.select_related_fields]
+        prefetch = []
+        for name in names:
+            lookup = cls.prefetch_related_fields.get(name)
+            if lookup is not None:
+                prefetch.append(lookup(context or {}) if callable(lookup) else lookup)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self._sparse_fields
+        expand = self._sparse_expand
+
+        if selected is not None:
+            fields = {name: field for name, field in fields.items() if name in selected}
+
+        if expand is not None:
+            for name in self.expandable_fields:
+                field = fields.get(name)
+                if field is None or name in expand or (selected and selected.get(name)):
+                    continue
+                if isinstance(field, (serializers.ListSerializer, serializers.SerializerMethodField)):
+                    del fields[name]
+                else:
+                    fields[name] = serializers.PrimaryKeyRelatedField(
+                        read_only=True,
+                        source=None if field.source == name else field.source
+                    )
+
+        if selected:
+            for name, nested in selected.items():
+                field = fields.get(name)
+                target = getattr(field, 'child', field)
+                if nested and isinstance(target, SparseFieldsMixin):
+                    target._sparse_fields = nested
+        return fields
+
+
+class SparseFieldsViewMixin:
+    """
+    ViewSet mixin passing ``?fields=`` and ``?expand=`` to serializers that
+    support them on read requests, and trimming the queryset to match
+    """
+    sparse_actions = ('list', 'retrieve', 'update', 'partial_update')
+
+    def get_sparse_options(self):
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return {}
+        params = request.query_params
+        return {key: params[key] for key in ('fields', 'expand') if key in params}
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, SparseFieldsMixin):
+            for key, value in self.get_sparse_options().items():
+                kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def optimize_queryset(self, queryset):
+        if getattr(self, 'action', None) not in self.sparse_actions:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, SparseFieldsMixin):
+            return queryset
+        return serializer_class.optimize_queryset(
+            queryset, context=self.get_serializer_context(), **self.get_sparse_options()
+        )
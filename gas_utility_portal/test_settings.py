@@ -0,0 +1,14 @@
+# gas_utility_portal/test_settings.py
+"""
+Settings for ``manage.py test``: the project settings plus a second request
+database for the sharding tests, which enable it with override_settings
+"""
+from .settings import *
+
+DATABASES = {
+    **DATABASES,
+    'test_shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
@@ -0,0 +1,187 @@
+import contextvars
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from accounts.models import UserProfile
+from service_requests import sharding
+from service_requests.models import ServiceCategory, ServiceRequest
+from . import instrumentation, metrics
+from .admin_scale import EstimatedCountPaginator
+
+BATCH_URL = '/api/batch/'
+
+
+class BatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', service_address='1 Main St, Springfield 01234')
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+
+    def batch(self, operations, **options):
+        return self.client.post(BATCH_URL, {'requests': operations, **options}, content_type='application/json')
+
+    def test_sub_requests_run_through_the_batch_middleware(self):
+        sample = metrics.request_count.labels('ServiceCategoryViewSet.list', 'GET', 200).key
+        before = metrics.store().get(sample)
+        response = self.batch([{'path': '/api/service-requests/categories/'}] * 2)
+        self.assertEqual([sub['status'] for sub in response.json()['responses']], [200, 200])
+        self.assertEqual(metrics.store().get(sample) - before, 2)
+
+    def create_then_fail(self):
+        return self.batch([
+            {'method': 'POST', 'path': '/api/service-requests/requests/', 'body': {
+                'category_id': self.category.id, 'title': 'Meter reading', 'description': 'Too high',
+                'priority': 'medium', 'service_address': self.customer.service_address,
+            }},
+            {'path': '/api/service-requests/requests/0/'},
+        ], atomic=True)
+
+    def test_atomic_batch_rolls_back(self):
+        response = self.create_then_fail().json()
+        self.assertTrue(response['rolled_back'])
+        self.assertEqual(response['responses'][0]['status'], 201)
+        self.assertFalse(ServiceRequest.objects.exists())
+
+
+@override_settings(
+    REQUEST_SHARD_DATABASES=['default', 'test_shard'],
+    SERVICE_REGIONS={'east': ['0']},
+    REQUEST_SHARDS={'east': 'test_shard'},
+)
+class ShardedBatchTests(BatchTests):
+    databases = {'default', 'test_shard'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Replication runs on commit, which a test case never reaches
+        sharding.copy_reference_data('test_shard')
+
+    def test_atomic_batch_rolls_back(self):
+        self.assertEqual(sharding.database_of(self.customer), 'test_shard')
+        self.assertTrue(self.create_then_fail().json()['rolled_back'])
+        self.assertFalse(ServiceRequest.objects.using('test_shard').exists())
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0, DEBUG=False)
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer')
+        cls.agent = UserProfile.objects.create_user('agent', role=UserProfile.SUPPORT_AGENT)
+
+    def get(self, user, path='/api/service-requests/categories/'):
+        self.client.force_login(user)
+        return self.client.get(path)
+
+    def test_server_timing_is_sent_to_staff_only(self):
+        self.assertNotIn('Server-Timing', self.get(self.customer))
+        self.assertIn('Server-Timing', self.get(self.agent))
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_is_sent_to_everyone_in_debug(self):
+        self.assertIn('Server-Timing', self.get(self.customer))
+
+    def test_batch_counts_its_sub_requests(self):
+        def queries(headers):
+            return int(re.search(r'"(\d+) queries"', headers['Server-Timing']).group(1))
+
+        self.client.force_login(self.agent)
+        response = self.client.post(BATCH_URL, {'requests': [{'path': '/api/service-requests/categories/'}] * 3},
+                                    content_type='application/json')
+        subs = [queries(sub['headers']) for sub in response.json()['responses']]
+        self.assertGreater(min(subs), 0)
+        self.assertGreater(queries(response), sum(subs))
+
+    def test_queries_in_worker_threads_are_counted(self):
+        def query():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connections.close_all()
+
+        outer = instrumentation.RequestMetrics()
+        token = instrumentation._current.set(outer)
+        try:
+            inner = instrumentation.RequestMetrics(parent=outer)
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(query,))
+            inner_token = instrumentation._current.set(inner)
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(query,))
+            instrumentation._current.reset(inner_token)
+            for started in (thread, worker):
+                started.start()
+                started.join()
+        finally:
+            instrumentation._current.reset(token)
+        self.assertEqual((outer.query_count, inner.query_count), (2, 1))
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=3)
+class EstimatedCountPaginatorTests(TestCase):
+    def count(self, queryset):
+        return EstimatedCountPaginator(queryset, 2).count
+
+    def test_count_is_exact_up_to_the_limit(self):
+        categories = [ServiceCategory.objects.create(name=f'Category {n}', slug=f'category-{n}') for n in range(8)]
+        # Archived away: the largest id no longer says how many rows there are
+        ServiceCategory.objects.exclude(pk__in=[categories[0].pk, categories[-1].pk]).delete()
+        self.assertEqual(self.count(ServiceCategory.objects.all()), 2)
+
+    def test_larger_results_report_the_limit(self):
+        for n in range(5):
+            ServiceCategory.objects.create(name=f'Category {n}', slug=f'category-{n}')
+        self.assertEqual(self.count(ServiceCategory.objects.all()), 3)
+        self.assertEqual(self.count(ServiceCategory.objects.filter(slug__endswith='1')), 1)
+
+
+class SharedStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'test.metrics')
+        self.store = metrics.SharedStore(self.path)
+
+    def test_updates(self):
+        self.store.inc([('a', 2), ('b', 1)])
+        self.store.inc([('a', 0.5)])
+        self.store.set([('c', 7)])
+        self.store.set_min('c', 9)
+        self.store.set_min('d', 3)
+        self.assertEqual(sorted(self.store.items()), [('a', 2.5), ('b', 1.0), ('c', 7.0), ('d', 3.0)])
+        self.assertEqual(self.store.get('missing', None), None)
+
+    def test_entries_are_shared_through_the_file(self):
+        self.store.inc([('a', 1)])
+        other = metrics.SharedStore(self.path)
+        other.inc([('a', 1), ('b', 4)])
+        self.store.inc([('b', 1)])
+        self.assertEqual(sorted(self.store.items()), [('a', 2.0), ('b', 5.0)])
+        self.assertEqual(sorted(other.items()), [('a', 2.0), ('b', 5.0)])
+
+    def test_file_grows(self):
+        keys = [f'{n}:' + 'x' * 100_000 for n in range(20)]
+        self.store.set((key, n) for n, key in enumerate(keys))
+        self.assertGreater(os.path.getsize(self.path), 1 << 20)
+        self.assertEqual(metrics.SharedStore(self.path).get(keys[-1]), 19)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_forked_process_reopens_the_file(self):
+        self.store.inc([('a', 1)])
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.store.inc([('a', 1), ('b', 1)])
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(sorted(self.store.items()), [('a', 2.0), ('b', 1.0)])
@@ -7,6 +7,9 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .batch import BatchView
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
@@ -14,6 +17,10 @@ urlpatterns = [
     path('api/accounts/', include('accounts.urls')),
     path('api/service-requests/', include('service_requests.urls')),
     path('api/dashboard/', include('dashboard.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
+    
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
     
     # Include auth URLs for browsable API
     path('api-auth/', include('rest_framework.urls')),
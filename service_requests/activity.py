@@ -0,0 +1,113 @@
+# service_requests/activity.py
+"""
+Maintained activity counters on ServiceRequest: ``comment_count``,
+``public_comment_count``, ``attachment_count`` and ``last_activity_at``.
+
+Adding or deleting a comment or attachment, through the API, the admin
+inlines or anywhere else, adjusts its request with one ``F()`` UPDATE, so
+concurrent writers never lose an increment. Decrements stop at zero:
+children written in bulk were never counted, and a counter that drifted
+below them must not make a delete fail. Edits to an existing comment
+(e.g. toggling ``is_internal`` in the admin) recount that request. Status
+changes touch ``last_activity_at`` through a workflow hook. ``recount()``
+rebuilds everything from the child tables; the
+``repair_activity_counters`` command runs it in batches.
+"""
+from django.db.models import Count, DateTimeField, F, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RequestAttachment, RequestComment, RequestStatusHistory, ServiceRequest
+
+
+def _adjust(using, service_request_id, sign, comments=0, public=0, attachments=0, when=None):
+    changes = {}
+    for field, amount in (
+        ('comment_count', comments), ('public_comment_count', public), ('attachment_count', attachments)
+    ):
+        if not amount:
+            continue
+        if sign > 0:
+            changes[field] = F(field) + amount
+        else:
+            # Rows written in bulk (e.g. load data) were never counted; a
+            # drifted counter must not make the delete fail
+            changes[field] = Greatest(F(field) - amount, 0)
+    if when is not None:
+        # Never moved back by a child committed out of order: delta sync
+        # relies on it covering every child's timestamp
+        when = Value(when, output_field=DateTimeField())
+        changes['last_activity_at'] = Greatest(Coalesce('last_activity_at', when), when)
+    ServiceRequest.objects.using(using).filter(pk=service_request_id).update(**changes)
+
+
+def _subquery(queryset, aggregate):
+    return Subquery(
+        queryset.filter(service_request=OuterRef('pk')).order_by().values('service_request').annotate(
+            value=aggregate
+        ).values('value')
+    )
+
+
+def recount(queryset):
+    """
+    Recompute the counters of every request in ``queryset`` with one UPDATE
+    """
+    def count(queryset, **filters):
+        return Coalesce(
+            _subquery(queryset.filter(**filters), Count('id')), 0, output_field=IntegerField()
+        )
+
+    def latest(queryset, field):
+        return Coalesce(_subquery(queryset, Max(field)), 'created_at')
+
+    comments = RequestComment.objects.using(queryset.db)
+    attachments = RequestAttachment.objects.using(queryset.db)
+    history = RequestStatusHistory.objects.using(queryset.db)
+    return queryset.update(
+        comment_count=count(comments),
+        public_comment_count=count(comments, is_internal=False),
+        attachment_count=count(attachments),
+        last_activity_at=Greatest(
+            'created_at',
+            latest(comments, 'created_at'),
+            latest(attachments, 'uploaded_at'),
+            latest(history, 'changed_at'),
+        ),
+    )
+
+
+def _cascading(origin):
+    # Children deleted along with their request need no adjustment
+    model = getattr(origin, 'model', type(origin))
+    return model is ServiceRequest
+
+
+@receiver(post_save, sender=RequestComment)
+def _track_comment(sender, instance, created, using=None, **kwargs):
+    if created:
+        _adjust(
+            using, instance.service_request_id, 1, comments=1,
+            public=0 if instance.is_internal else 1, when=instance.created_at
+        )
+    else:
+        recount(ServiceRequest.objects.using(using).filter(pk=instance.service_request_id))
+
+
+@receiver(post_delete, sender=RequestComment)
+def _track_comment_delete(sender, instance, origin=None, using=None, **kwargs):
+    if not _cascading(origin):
+        _adjust(using, instance.service_request_id, -1, comments=1, public=0 if instance.is_internal else 1)
+
+
+@receiver(post_save, sender=RequestAttachment)
+def _track_attachment(sender, instance, created, using=None, **kwargs):
+    if created:
+        _adjust(using, instance.service_request_id, 1, attachments=1, when=instance.uploaded_at)
+
+
+@receiver(post_delete, sender=RequestAttachment)
+def _track_attachment_delete(sender, instance, origin=None, using=None, **kwargs):
+    if not _cascading(origin):
+        _adjust(using, instance.service_request_id, -1, attachments=1)
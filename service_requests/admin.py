@@ -1,34 +1,91 @@
-from django.contrib import admin
-from .models import ServiceCategory, ServiceRequest, RequestAttachment, RequestComment, RequestStatusHistory
+from django import forms
+from django.contrib import admin, messages
+from accounts.normalize import normalize_address, normalize_meter_id
+from gas_utility_portal.admin_scale import LargeTableAdminMixin, PaginatedTabularInline
+from .models import (
+    ArchivedServiceRequest, ServiceCategory, ServiceRequest, SLAEscalation, SLAPolicy,
+    RequestAttachment, RequestComment, RequestStatusHistory
+)
+from . import archive, workflow
 
-class RequestAttachmentInline(admin.TabularInline):
+class RequestAttachmentInline(PaginatedTabularInline):
     model = RequestAttachment
     extra = 0
     readonly_fields = ['uploaded_at', 'uploaded_by']
+    ordering = ['-id']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('service_request', 'uploaded_by')
 
-class RequestCommentInline(admin.TabularInline):
+class RequestCommentInline(PaginatedTabularInline):
     model = RequestComment
     extra = 0
     readonly_fields = ['created_at', 'author']
+    ordering = ['-id']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('service_request', 'author')
 
-class RequestStatusHistoryInline(admin.TabularInline):
+class RequestStatusHistoryInline(PaginatedTabularInline):
     model = RequestStatusHistory
     extra = 0
     readonly_fields = ['changed_at', 'changed_by', 'previous_status', 'new_status']
+    ordering = ['-id']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('service_request', 'changed_by')
     
 @admin.register(ServiceCategory)
 class ServiceCategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'is_active']
+    list_display = ['name', 'slug', 'is_active', 'is_emergency', 'requires_field_visit']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'description']
-    list_filter = ['is_active']
+    list_filter = ['is_active', 'is_emergency', 'requires_field_visit']
+    filter_horizontal = ['agents']
+
+@admin.register(SLAPolicy)
+class SLAPolicyAdmin(admin.ModelAdmin):
+    list_display = ['category', 'priority', 'resolution_minutes']
+    list_filter = ['category', 'priority']
+
+@admin.register(SLAEscalation)
+class SLAEscalationAdmin(admin.ModelAdmin):
+    list_display = ['service_request_pk', 'previous_priority', 'new_priority', 'escalated_at']
+    list_filter = ['new_priority']
+    search_fields = ['=service_request_pk']
+    ordering = ['-escalated_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(ServiceRequest)
-class ServiceRequestAdmin(admin.ModelAdmin):
+class ServiceRequestAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['request_id', 'title', 'customer', 'category', 'status', 'priority', 'created_at', 'assigned_to']
-    list_filter = ['status', 'priority', 'category', 'created_at']
+    # Related rows are prefetched rather than joined (False would join them
+    # all): given joins, SQLite drives the query from the joined table and
+    # sorts every request
+    list_select_related = ()
+    list_filter = ['status', 'priority', 'category', 'sla_breached', 'created_at']
+    # Ids follow creation order: newest first without sorting the table
+    ordering = ['-id']
+    indexed_search_fields = [
+        ('id', 'exact'),
+        ('request_id', 'exact'),
+        ('customer__username', 'prefix'),
+        ('customer__customer_id', 'prefix'),
+        ('meter_key', 'prefix', normalize_meter_id),
+        ('address_key', 'prefix', normalize_address),
+    ]
     search_fields = ['title', 'description', 'request_id', 'customer__username', 'customer__email']
-    readonly_fields = ['request_id', 'created_at', 'updated_at', 'completed_at']
+    readonly_fields = [
+        'request_id', 'created_at', 'updated_at', 'completed_at', 'due_at', 'sla_breached',
+        'comment_count', 'public_comment_count', 'attachment_count', 'last_activity_at',
+        'latitude', 'longitude', 'geohash'
+    ]
+    raw_id_fields = ['customer', 'assigned_to', 'parent']
     inlines = [RequestAttachmentInline, RequestCommentInline, RequestStatusHistoryInline]
     fieldsets = [
         (None, {
@@ -38,52 +95,131 @@ class ServiceRequestAdmin(admin.ModelAdmin):
             'fields': ['status', 'priority', 'assigned_to']
         }),
         ('Dates', {
-            'fields': ['created_at', 'updated_at', 'completed_at']
+            'fields': ['created_at', 'updated_at', 'completed_at', 'due_at', 'sla_breached']
+        }),
+        ('Activity', {
+            'fields': ['comment_count', 'public_comment_count', 'attachment_count', 'last_activity_at']
         }),
         ('Customer Information', {
-            'fields': ['service_address', 'gas_meter_id']
+            'fields': ['service_address', 'latitude', 'longitude', 'geohash', 'gas_meter_id', 'parent']
         }),
     ]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('customer', 'category', 'assigned_to')
+    
+    actions = ['mark_in_progress', 'mark_on_hold', 'mark_completed', 'mark_closed', 'mark_cancelled']
+    
+    def get_form(self, request, obj=None, **kwargs):
+        form_class = super().get_form(request, obj, **kwargs)
+        
+        class WorkflowForm(form_class):
+            def clean_status(self):
+                """
+                Reject status changes the workflow does not allow
+                """
+                new_status = self.cleaned_data['status']
+                if self.instance.pk and 'status' in self.changed_data:
+                    try:
+                        workflow.check_transition(self.initial['status'], new_status, request.user)
+                    except workflow.TransitionError as e:
+                        raise forms.ValidationError(str(e))
+                return new_status
+        
+        return WorkflowForm
+    
     def save_model(self, request, obj, form, change):
         """
         Track status changes when saving from admin
         """
         if change and 'status' in form.changed_data:
-            # Get the previous status
-            old_obj = ServiceRequest.objects.get(pk=obj.pk)
-            previous_status = old_obj.status
-            
-            # Save the model first
-            super().save_model(request, obj, form, change)
-            
-            # Create status history entry
-            RequestStatusHistory.objects.create(
-                service_request=obj,
-                previous_status=previous_status,
-                new_status=obj.status,
-                changed_by=request.user,
+            previous_status = form.initial['status']
+            workflow.apply_transition(
+                obj, previous_status, request.user,
                 comment=f"Status changed from {previous_status} to {obj.status} via admin panel"
             )
-        else:
-            super().save_model(request, obj, form, change)
+        super().save_model(request, obj, form, change)
+    
+    def _bulk_transition(self, request, queryset, new_status):
+        changed, skipped = workflow.bulk_transition(
+            queryset, new_status, request.user,
+            comment=f"Status changed to {new_status} via admin bulk action"
+        )
+        self.message_user(request, f"{changed} request(s) moved to {workflow.STATUS_LABELS[new_status]}.")
+        if skipped:
+            self.message_user(
+                request,
+                f"{skipped} request(s) skipped: transition not allowed from their current status.",
+                level=messages.WARNING
+            )
+    
+    @admin.action(description='Mark selected requests as In Progress')
+    def mark_in_progress(self, request, queryset):
+        self._bulk_transition(request, queryset, ServiceRequest.IN_PROGRESS)
+    
+    @admin.action(description='Mark selected requests as On Hold')
+    def mark_on_hold(self, request, queryset):
+        self._bulk_transition(request, queryset, ServiceRequest.ON_HOLD)
+    
+    @admin.action(description='Mark selected requests as Completed')
+    def mark_completed(self, request, queryset):
+        self._bulk_transition(request, queryset, ServiceRequest.COMPLETED)
+    
+    @admin.action(description='Mark selected requests as Closed')
+    def mark_closed(self, request, queryset):
+        self._bulk_transition(request, queryset, ServiceRequest.CLOSED)
+    
+    @admin.action(description='Mark selected requests as Cancelled')
+    def mark_cancelled(self, request, queryset):
+        self._bulk_transition(request, queryset, ServiceRequest.CANCELLED)
 
 @admin.register(RequestAttachment)
-class RequestAttachmentAdmin(admin.ModelAdmin):
+class RequestAttachmentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['file_name', 'service_request', 'uploaded_by', 'uploaded_at']
+    list_select_related = ['service_request__customer', 'uploaded_by']
+    ordering = ['-id']
+    indexed_search_fields = [('service_request__request_id', 'exact'), ('uploaded_by__username', 'prefix')]
     search_fields = ['file_name', 'service_request__request_id']
     readonly_fields = ['uploaded_at']
+    raw_id_fields = ['service_request', 'uploaded_by']
 
 @admin.register(RequestComment)
-class RequestCommentAdmin(admin.ModelAdmin):
+class RequestCommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['service_request', 'author', 'created_at', 'is_internal']
+    list_select_related = ['service_request__customer', 'author']
     list_filter = ['is_internal', 'created_at']
+    ordering = ['-id']
+    indexed_search_fields = [('service_request__request_id', 'exact'), ('author__username', 'prefix')]
     search_fields = ['text', 'service_request__request_id', 'author__username']
     readonly_fields = ['created_at']
+    raw_id_fields = ['service_request', 'author']
 
 @admin.register(RequestStatusHistory)
-class RequestStatusHistoryAdmin(admin.ModelAdmin):
+class RequestStatusHistoryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['service_request', 'previous_status', 'new_status', 'changed_by', 'changed_at']
+    list_select_related = ['service_request__customer', 'changed_by']
     list_filter = ['previous_status', 'new_status', 'changed_at']
+    ordering = ['-id']
+    indexed_search_fields = [('service_request__request_id', 'exact'), ('changed_by__username', 'prefix')]
     search_fields = ['service_request__request_id', 'changed_by__username', 'comment']
-    readonly_fields = ['changed_at']
\ No newline at end of file
+    readonly_fields = ['changed_at']
+    raw_id_fields = ['service_request', 'changed_by']
+
+@admin.register(ArchivedServiceRequest)
+class ArchivedServiceRequestAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['request_id', 'customer', 'category', 'status', 'last_activity_at', 'archived_at']
+    list_select_related = ['customer', 'category']
+    ordering = ['-id']
+    indexed_search_fields = [('id', 'exact'), ('request_id', 'exact'), ('customer__username', 'prefix')]
+    actions = ['restore']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    @admin.action(description='Restore selected requests')
+    def restore(self, request, queryset):
+        restored = archive.restore(queryset)
+        self.message_user(request, f"{restored} request(s) restored.")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ServiceRequestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'service_requests'
+
+    def ready(self):
+        # Register signal receivers
+        from . import activity, assignment, emergency, metrics, sharding, sla, sync  # noqa: F401
@@ -0,0 +1,278 @@
+# service_requests/archive.py
+"""
+Hot/cold archival of finished service requests.
+
+Requests closed, cancelled or completed with no activity for
+ARCHIVE_AFTER_DAYS are moved, with their attachments, comments and status
+history, into ArchivedServiceRequest: one row per request holding every
+field value as JSON, kept in the same database as the request was. The hot
+tables, and every index and scan on them, then only grow with live work.
+
+``archive()`` walks the request table in id order and moves each batch in
+its own transaction, so an interrupted run loses nothing and the next run
+simply continues with what is left. A request that still has duplicates in
+the hot table waits until they are archived, so their ``parent`` link is
+kept. Archived rows are deleted with raw deletes, children first, without
+per-row signals; the only receiver that matters, the assigned agent's sync
+tombstone, is written in bulk instead. ``materialize()`` rebuilds an
+archived request as unsaved model instances for the read-only retrieve
+fallback; ``restore()`` puts requests back, along with the archived
+parents they link to. Attachment files stay where they are.
+"""
+import uuid
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from accounts.models import UserProfile
+
+from . import sharding
+from .activity import recount
+from .models import (
+    ArchivedServiceRequest,
+    RequestAttachment,
+    RequestComment,
+    RequestStatusHistory,
+    ServiceRequest,
+    SyncTombstone,
+)
+
+ARCHIVABLE_STATUSES = [ServiceRequest.COMPLETED, ServiceRequest.CLOSED, ServiceRequest.CANCELLED]
+
+# related name -> (model, user foreign key)
+CHILDREN = {
+    'attachments': (RequestAttachment, 'uploaded_by'),
+    'comments': (RequestComment, 'author'),
+    'status_history': (RequestStatusHistory, 'changed_by'),
+}
+
+
+def _dump_value(value):
+    if isinstance(value, (datetime, date)):
+        # Full precision; DjangoJSONEncoder would cut microseconds
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, FieldFile):
+        return value.name
+    return value
+
+
+def _dump(obj):
+    return {field.attname: _dump_value(field.value_from_object(obj)) for field in obj._meta.concrete_fields}
+
+
+def _load(model, values):
+    # Fields added since the row was archived keep their defaults
+    return model(**{
+        field.attname: field.to_python(values[field.attname])
+        for field in model._meta.concrete_fields if field.attname in values
+    })
+
+
+def cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=getattr(settings, 'ARCHIVE_AFTER_DAYS', 180))
+
+
+def archivable(before):
+    """
+    Requests finished with no activity since ``before``
+    """
+    return ServiceRequest.objects.filter(status__in=ARCHIVABLE_STATUSES, last_activity_at__lt=before)
+
+
+def _archive_batch(ids, before, using):
+    with transaction.atomic(using=using):
+        requests = list(archivable(before).using(using).filter(id__in=ids))
+        ids = {r.id for r in requests}
+        waiting = set(
+            ServiceRequest.objects.using(using).filter(
+                parent_id__in=ids
+            ).exclude(id__in=ids).values_list('parent_id', flat=True)
+        )
+        requests = [r for r in requests if r.id not in waiting]
+        if not requests:
+            return 0
+        ids = [r.id for r in requests]
+
+        children = {r.id: {name: [] for name in CHILDREN} for r in requests}
+        for name, (model, _) in CHILDREN.items():
+            # Kept in default order, as the detail view lists them
+            for child in model.objects.using(using).filter(service_request_id__in=ids):
+                children[child.service_request_id][name].append(_dump(child))
+
+        ArchivedServiceRequest.objects.using(using).bulk_create([
+            ArchivedServiceRequest(
+                id=r.id,
+                request_id=r.request_id,
+                customer_id=r.customer_id,
+                category_id=r.category_id,
+                status=r.status,
+                created_at=r.created_at,
+                last_activity_at=r.last_activity_at,
+                data={'request': _dump(r), **children[r.id]},
+            )
+            for r in requests
+        ])
+        # Children first; counters and gauges are left alone for closed
+        # requests, and the children are covered by their request's tombstone
+        for model, _ in CHILDREN.values():
+            model.objects.using(using).filter(service_request_id__in=ids)._raw_delete(using)
+        ServiceRequest.objects.using(using).filter(id__in=ids)._raw_delete(using)
+        SyncTombstone.objects.bulk_create([
+            SyncTombstone(
+                agent_id=r.assigned_to_id,
+                object_type=SyncTombstone.REQUEST,
+                object_id=r.id,
+                service_request_pk=r.id,
+            )
+            for r in requests if r.assigned_to_id
+        ])
+    return len(ids)
+
+
+def archive(before=None, batch_size=None, max_batches=None):
+    """
+    Archive requests finished before ``before`` (default: ARCHIVE_AFTER_DAYS
+    ago) in every request database; returns the number archived
+    """
+    before = before or cutoff()
+    batch_size = batch_size or getattr(settings, 'ARCHIVE_BATCH_SIZE', 500)
+    archived = batches = 0
+    for using in sharding.databases():
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            # Walks the primary key; no index on status/activity is needed
+            ids = list(
+                archivable(before).using(using).filter(
+                    id__gt=last_id
+                ).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            archived += _archive_batch(ids, before, using)
+            batches += 1
+            last_id = ids[-1]
+    return archived
+
+
+def _users(archived_requests):
+    ids = set()
+    for archived in archived_requests:
+        ids.add(archived.data['request'].get('assigned_to_id'))
+        for name, (_, user_field) in CHILDREN.items():
+            ids.update(values.get(f'{user_field}_id') for values in archived.data.get(name, []))
+    ids.discard(None)
+    return UserProfile.objects.in_bulk(ids)
+
+
+def _build(archived, users):
+    """
+    Unsaved request and children; references to users deleted since
+    archiving are cleared (assignee) or dropped (their rows would have been
+    deleted with them)
+    """
+    request = _load(ServiceRequest, archived.data['request'])
+    if request.assigned_to_id not in users:
+        request.assigned_to_id = None
+    children = {}
+    for name, (model, user_field) in CHILDREN.items():
+        rows = []
+        for values in archived.data.get(name, []):
+            user = users.get(values.get(f'{user_field}_id'))
+            if user is not None:
+                child = _load(model, values)
+                setattr(child, user_field, user)
+                child.service_request = request
+                rows.append(child)
+        children[name] = rows
+    return request, children
+
+
+def _cache(instance, name, model, rows):
+    queryset = model.objects.none()
+    queryset._result_cache = rows
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache[name] = queryset
+
+
+def materialize(archived, user=None):
+    """
+    Read-only ServiceRequest for ``archived`` with its relations and
+    children in place, ready for ServiceRequestDetailSerializer; comments
+    are limited to what ``user`` may see
+    """
+    users = _users([archived])
+    request, children = _build(archived, users)
+    request.customer = archived.customer
+    request.category = archived.category
+    request.assigned_to = users.get(request.assigned_to_id)
+    request._prefetched_objects_cache = {}
+    for name, (model, _) in CHILDREN.items():
+        _cache(request, name, model, children[name])
+    if user is not None:
+        request.visible_comments = [
+            c for c in children['comments'] if user.is_staff_member or not c.is_internal
+        ]
+    return request
+
+
+def _with_parents(batch, using):
+    """
+    ``batch`` plus the archived parents its requests link to, transitively
+    """
+    batch = list(batch)
+    seen = {archived.id for archived in batch}
+    wanted = {archived.data['request'].get('parent_id') for archived in batch} - seen - {None}
+    while wanted:
+        wanted -= set(ServiceRequest.objects.using(using).filter(id__in=wanted).values_list('id', flat=True))
+        parents = list(ArchivedServiceRequest.objects.using(using).filter(id__in=wanted))
+        batch += parents
+        seen |= {archived.id for archived in parents}
+        wanted = {archived.data['request'].get('parent_id') for archived in parents} - seen - {None}
+    return batch
+
+
+def restore(queryset, batch_size=None):
+    """
+    Move the archived requests in ``queryset`` back into the hot tables of
+    the database they are archived in, with the archived parents they link
+    to; returns the number restored
+    """
+    batch_size = batch_size or getattr(settings, 'ARCHIVE_BATCH_SIZE', 500)
+    restored = 0
+    for part in sharding.each(queryset):
+        using = part.db
+        last_id = 0
+        while True:
+            batch = list(part.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            with transaction.atomic(using=using):
+                batch = _with_parents(batch, using)
+                users = _users(batch)
+                built = [_build(archived, users) for archived in batch]
+                requests = [request for request, _ in built]
+                parents = {r.parent_id for r in requests if r.parent_id}
+                present = set(
+                    ServiceRequest.objects.using(using).filter(id__in=parents).values_list('id', flat=True)
+                )
+                present |= {r.id for r in requests}
+                # Only parents deleted since archiving are unlinked
+                for request in requests:
+                    if request.parent_id not in present:
+                        request.parent_id = None
+                # Rows come back exactly as archived
+                sharding.insert_raw(ServiceRequest, requests, using)
+                for name, (model, _) in CHILDREN.items():
+                    sharding.insert_raw(model, [child for _, children in built for child in children[name]], using)
+                ids = [r.id for r in requests]
+                # Rows of deleted users were dropped
+                recount(ServiceRequest.objects.using(using).filter(id__in=ids))
+                ArchivedServiceRequest.objects.using(using).filter(id__in=ids).delete()
+            restored += len(ids)
+    return restored
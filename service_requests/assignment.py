@@ -0,0 +1,288 @@
+# service_requests/assignment.py
+"""
+Workload-aware auto-assignment of service requests to support agents.
+
+Agent open-ticket loads are loaded with a single grouped query and then kept
+in memory as min-heaps, one per skill pool, updated incrementally as
+requests are assigned, completed or reopened. Heaps use lazy invalidation:
+a changed load pushes a fresh entry and stale entries are discarded when
+they reach the top.
+
+Each process keeps its own balancer and only sees the changes it makes, so
+it is rebuilt from the database every SERVICE_REQUEST_BALANCER_TTL_SECONDS;
+between rebuilds, assignments made by other processes may take an agent
+past capacity. It is also rebuilt when an agent joins or leaves the pool
+(role, active flag or skills).
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from accounts.models import UserProfile
+from gas_utility_portal import metrics
+from . import sharding
+from .models import ServiceCategory, ServiceRequest
+from .workflow import OPEN_STATUSES, priority_rank, status_changed
+
+# Pool key for agents eligible for any category
+ANY = None
+
+# Priorities that may be routed to an agent already at capacity
+OVERFLOW_PRIORITIES = frozenset([ServiceRequest.HIGH, ServiceRequest.URGENT])
+
+
+def agent_capacity():
+    return getattr(settings, 'SERVICE_REQUEST_AGENT_CAPACITY', 25)
+
+
+class AgentLoadBalancer:
+    """
+    In-memory least-loaded agent selection
+    """
+    def __init__(self, agents, capacity=None):
+        """
+        ``agents`` is an iterable of ``(agent_id, open_count, category_ids)``
+        """
+        self.capacity = agent_capacity() if capacity is None else capacity
+        self.built_at = time.monotonic()
+        self.loads = {}
+        self.pools = {ANY: []}
+        self._agent_pools = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        for agent_id, load, category_ids in agents:
+            self.loads[agent_id] = load
+            pools = (ANY, *category_ids)
+            self._agent_pools[agent_id] = pools
+            for key in pools:
+                self.pools.setdefault(key, []).append((load, next(self._seq), agent_id))
+        for heap in self.pools.values():
+            heapq.heapify(heap)
+
+    @classmethod
+    def from_database(cls, capacity=None):
+        """
+        Build a balancer from one grouped load query plus the skill table
+        """
+        agents = UserProfile.objects.filter(role=UserProfile.SUPPORT_AGENT, is_active=True)
+        if sharding.enabled():
+            # Requests are spread over the shards; add up each one's counts
+            loads = dict(sharding.count_by(
+                ServiceRequest.objects.filter(status__in=OPEN_STATUSES, assigned_to__isnull=False),
+                'assigned_to'
+            ))
+            agents = [(agent_id, loads.get(agent_id, 0)) for agent_id in agents.values_list('id', flat=True)]
+        else:
+            agents = agents.annotate(
+                open_count=Count('assigned_requests', filter=Q(assigned_requests__status__in=OPEN_STATUSES))
+            ).values_list('id', 'open_count')
+
+        skills = {}
+        for agent_id, category_id in ServiceCategory.agents.through.objects.values_list(
+            'userprofile_id', 'servicecategory_id'
+        ):
+            skills.setdefault(agent_id, []).append(category_id)
+
+        return cls(
+            ((agent_id, load, skills.get(agent_id, ())) for agent_id, load in agents),
+            capacity=capacity
+        )
+
+    def _peek(self, key):
+        heap = self.pools.get(key)
+        while heap:
+            load, _, agent_id = heap[0]
+            if self.loads.get(agent_id) == load:
+                return load, agent_id
+            heapq.heappop(heap)
+        return None
+
+    def _set_load(self, agent_id, load):
+        self.loads[agent_id] = load
+        seq = next(self._seq)
+        for key in self._agent_pools[agent_id]:
+            heap = self.pools[key]
+            heapq.heappush(heap, (load, seq, agent_id))
+            # Drop stale entries once they outnumber live ones
+            if len(heap) > 4 * len(self.loads) + 64:
+                self.pools[key] = heap = [
+                    entry for entry in heap if self.loads.get(entry[2]) == entry[0]
+                ]
+                heapq.heapify(heap)
+
+    def choose(self, category_id, priority):
+        """
+        Pick the least-loaded agent for a request and count it against them.
+
+        Skilled agents for the category are tried first, then any agent.
+        Returns ``None`` when every candidate is at capacity and the
+        priority does not allow overflow.
+        """
+        overflow = priority in OVERFLOW_PRIORITIES
+        with self._lock:
+            for key in (category_id, ANY):
+                top = self._peek(key)
+                if top is None:
+                    continue
+                load, agent_id = top
+                if load < self.capacity or overflow:
+                    self._set_load(agent_id, load + 1)
+                    return agent_id
+            return None
+
+    def adjust(self, agent_id, delta):
+        """
+        Apply a load change for an agent after an assign/complete event
+        """
+        with self._lock:
+            if agent_id in self.loads:
+                self._set_load(agent_id, max(self.loads[agent_id] + delta, 0))
+
+
+_balancer = None
+_balancer_lock = threading.Lock()
+
+
+def _expired(balancer):
+    ttl = getattr(settings, 'SERVICE_REQUEST_BALANCER_TTL_SECONDS', 60)
+    return balancer is None or time.monotonic() - balancer.built_at >= ttl
+
+
+def get_balancer():
+    """
+    Return the process-wide balancer, building it on first use and again
+    once it is SERVICE_REQUEST_BALANCER_TTL_SECONDS old
+    """
+    global _balancer
+    metrics.record_cache('agent_balancer', not _expired(_balancer))
+    if _expired(_balancer):
+        with _balancer_lock:
+            if _expired(_balancer):
+                _balancer = AgentLoadBalancer.from_database()
+    return _balancer
+
+
+def reset_balancer():
+    """
+    Drop the cached balancer so the next use reloads loads and skills
+    """
+    global _balancer
+    _balancer = None
+
+
+def auto_assign_enabled():
+    return getattr(settings, 'SERVICE_REQUEST_AUTO_ASSIGN', True)
+
+
+def auto_assign(service_request):
+    """
+    Assign a single unassigned request to the best available agent.
+    Returns the chosen agent id or ``None``.
+    """
+    if service_request.assigned_to_id or service_request.status not in OPEN_STATUSES:
+        return None
+    balancer = get_balancer()
+    agent_id = balancer.choose(service_request.category_id, service_request.priority)
+    if agent_id is None:
+        return None
+    service_request.assigned_to_id = agent_id
+    try:
+        service_request.save(update_fields=['assigned_to', 'updated_at'])
+    except Exception:
+        balancer.adjust(agent_id, -1)
+        raise
+    return agent_id
+
+
+def assign_backlog(batch_size=500, limit=None):
+    """
+    Auto-assign the unassigned open backlog, most urgent and oldest first,
+    one transaction per batch and request database.
+    Returns ``(assigned, left_unassigned)`` counts.
+    """
+    balancer = get_balancer()
+    backlog = sharding.scatter(ServiceRequest.objects.filter(
+        assigned_to__isnull=True, status__in=OPEN_STATUSES
+    ).order_by(priority_rank(), 'created_at', 'id').only(
+        'id', 'category_id', 'first_assigned_at', *ServiceRequest.TRACKED_FIELDS
+    ))
+
+    assigned = skipped = 0
+    while limit is None or assigned + skipped < limit:
+        size = batch_size if limit is None else min(batch_size, limit - assigned - skipped)
+        # Assigned rows drop out of the filter, so only skipped rows shift the window
+        chunk = list(backlog[skipped:skipped + size])
+        if not chunk:
+            break
+        batch = []
+        for service_request in chunk:
+            agent_id = balancer.choose(service_request.category_id, service_request.priority)
+            if agent_id is None:
+                skipped += 1
+                continue
+            service_request.assigned_to_id = agent_id
+            batch.append(service_request)
+        for using, requests in itertools.groupby(
+            sorted(batch, key=lambda r: r._state.db), key=lambda r: r._state.db
+        ):
+            requests = list(requests)
+            try:
+                with transaction.atomic(using=using):
+                    for service_request in requests:
+                        # Through save() for the assignment times, sync
+                        # tombstones, metrics and the emergency wake-up
+                        service_request.save(update_fields=['assigned_to', 'updated_at'])
+            except Exception:
+                for service_request in requests:
+                    balancer.adjust(service_request.assigned_to_id, -1)
+                raise
+        assigned += len(batch)
+    return assigned, skipped
+
+
+def record_reassignment(previous_agent_id, new_agent_id):
+    """
+    Keep loads in step with a manual assign/unassign of an open request
+    """
+    if _balancer is None or previous_agent_id == new_agent_id:
+        return
+    if previous_agent_id:
+        _balancer.adjust(previous_agent_id, -1)
+    if new_agent_id:
+        _balancer.adjust(new_agent_id, 1)
+
+
+@receiver(status_changed)
+def _track_status_change(sender, service_request, previous_status, new_status, **kwargs):
+    agent_id = service_request.assigned_to_id
+    if _balancer is None or not agent_id:
+        return
+    was_open = previous_status in OPEN_STATUSES
+    is_open = new_status in OPEN_STATUSES
+    if was_open and not is_open:
+        _balancer.adjust(agent_id, -1)
+    elif is_open and not was_open:
+        _balancer.adjust(agent_id, 1)
+
+
+@receiver(post_save, sender=UserProfile)
+def _track_agent_roster(sender, instance, update_fields=None, **kwargs):
+    # Only the role and the active flag decide who is in the pool
+    if _balancer is None or (update_fields and not {'role', 'is_active'} & set(update_fields)):
+        return
+    eligible = instance.role == UserProfile.SUPPORT_AGENT and instance.is_active
+    if eligible != (instance.pk in _balancer.loads):
+        reset_balancer()
+
+
+@receiver(m2m_changed, sender=ServiceCategory.agents.through)
+def _track_agent_skills(sender, **kwargs):
+    reset_balancer()
@@ -0,0 +1,77 @@
+# service_requests/duplicates.py
+"""
+Duplicate report detection for new service requests.
+
+A new request is compared only against a small candidate set: recent open
+requests with the same normalized meter ID or address, fetched with one
+indexed, LIMITed query. Text similarity is a Jaccard score over word-bigram
+shingles of title and description, computed in Python on that set.
+"""
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.normalize import normalize_address, normalize_meter_id
+from .models import ServiceRequest
+
+_WORD = re.compile(r'\w+')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def shingles(text, size=2):
+    """
+    Set of word n-grams; falls back to single words for very short text
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return set(words)
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def find_parent(title, description, gas_meter_id=None, service_address=None, now=None, using=None):
+    """
+    Return the id of the incident a new report most likely duplicates, or None;
+    only requests in database ``using`` are considered
+    """
+    meter_key = normalize_meter_id(gas_meter_id)
+    address_key = normalize_address(service_address)
+    if not meter_key and not address_key:
+        return None
+
+    match = Q()
+    if meter_key:
+        match |= Q(meter_key=meter_key)
+    if address_key:
+        match |= Q(address_key=address_key)
+
+    now = now or timezone.now()
+    window = timedelta(hours=_setting('SERVICE_REQUEST_DUPLICATE_WINDOW_HOURS', 24))
+    candidates = ServiceRequest.objects.using(using).filter(
+        match,
+        created_at__gte=now - window,
+        status__in=ServiceRequest.OPEN_STATUSES
+    ).order_by('-created_at').values_list(
+        'id', 'parent_id', 'title', 'description'
+    )[:_setting('SERVICE_REQUEST_DUPLICATE_CANDIDATES', 20)]
+
+    threshold = _setting('SERVICE_REQUEST_DUPLICATE_THRESHOLD', 0.3)
+    report = shingles(f'{title} {description}')
+    best_id, best_score = None, threshold
+    for candidate_id, parent_id, candidate_title, candidate_description in candidates:
+        score = similarity(report, shingles(f'{candidate_title} {candidate_description}'))
+        if score >= best_score:
+            # Link to the root incident rather than another duplicate
+            best_id, best_score = parent_id or candidate_id, score
+    return best_id
@@ -0,0 +1,138 @@
+# service_requests/emergency.py
+"""
+Emergency fast path: urgent requests and emergency-category requests
+(gas leaks, emergency service).
+
+The queue reads only the partial index on ``is_emergency``. Subscribers
+long-poll for changes; waiters in the same process are woken as soon as an
+emergency request is committed, waiters in other processes notice it on
+their next poll tick.
+
+``updated_at`` is stamped before the saving transaction commits, so a
+cursor trails the clock by EMERGENCY_QUEUE_SETTLE_SECONDS: a poll returns
+changes in ``(since, cursor]`` and a row committed just after the poll's
+query still falls after its cursor. Requests in the full queue may come
+back once more as changes after its cursor.
+"""
+import bisect
+import itertools
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import sharding
+from .models import ServiceRequest
+from .workflow import priority_rank
+
+# Upper bounds (seconds) of the time-to-first-assignment histogram
+DISPATCH_LATENCY_BUCKETS = (60, 300, 600, 900, 1800, 3600, 4 * 3600, 24 * 3600)
+
+_changed = threading.Condition()
+
+
+def queue():
+    """
+    Open emergency requests, most urgent first, then oldest first
+    """
+    return _emergency().filter(status__in=ServiceRequest.OPEN_STATUSES)
+
+
+def changes(since, until):
+    """
+    Emergency requests changed in ``(since, until]`` in any status, ordered
+    as the queue: requests that were resolved, closed or cancelled are
+    reported too, so subscribers can drop them
+    """
+    return _emergency().filter(updated_at__gt=since, updated_at__lte=until)
+
+
+def cursor():
+    """
+    The clock less EMERGENCY_QUEUE_SETTLE_SECONDS; every change committed
+    later is stamped after it
+    """
+    return timezone.now() - timedelta(seconds=getattr(settings, 'EMERGENCY_QUEUE_SETTLE_SECONDS', 2))
+
+
+def _emergency():
+    return sharding.scatter(ServiceRequest.objects.filter(is_emergency=True).select_related(
+        'customer', 'category', 'assigned_to'
+    ).order_by(priority_rank(), 'created_at', 'id'))
+
+
+@receiver(post_save, sender=ServiceRequest)
+def _notify_subscribers(sender, instance, **kwargs):
+    if instance.is_emergency:
+        transaction.on_commit(_wake)
+
+
+def _wake():
+    with _changed:
+        _changed.notify_all()
+
+
+def wait_for_changes(since, timeout):
+    """
+    Block until an emergency request changed after ``since`` or the
+    timeout expires. Returns ``(cursor, changed)`` where ``cursor`` is the
+    ``since`` value for the next call and ``changed`` may be empty.
+    """
+    poll = getattr(settings, 'EMERGENCY_QUEUE_POLL_SECONDS', 1.0)
+    deadline = time.monotonic() + timeout
+    while True:
+        until = max(cursor(), since)
+        changed = list(changes(since, until))
+        remaining = deadline - time.monotonic()
+        if changed or remaining <= 0:
+            return until, changed
+        with _changed:
+            _changed.wait(min(poll, remaining))
+
+
+def dispatch_latency(since):
+    """
+    Histogram of created_at -> first assignment for emergency requests
+    created after ``since``, with the share meeting the dispatch SLO
+    """
+    slo = getattr(settings, 'EMERGENCY_DISPATCH_SLO_SECONDS', 900)
+    counts = [0] * (len(DISPATCH_LATENCY_BUCKETS) + 1)
+    total = within_slo = undispatched = 0
+    latency_sum = 0.0
+
+    rows = ServiceRequest.objects.filter(
+        is_emergency=True, created_at__gte=since
+    ).values_list('created_at', 'first_assigned_at')
+    for created_at, first_assigned_at in itertools.chain.from_iterable(
+        part.iterator(chunk_size=2000) for part in sharding.each(rows)
+    ):
+        if first_assigned_at is None:
+            undispatched += 1
+            continue
+        latency = (first_assigned_at - created_at).total_seconds()
+        counts[bisect.bisect_left(DISPATCH_LATENCY_BUCKETS, latency)] += 1
+        total += 1
+        latency_sum += latency
+        within_slo += latency <= slo
+
+    # Cumulative buckets, Prometheus style
+    buckets = []
+    running = 0
+    for bound, count in zip((*DISPATCH_LATENCY_BUCKETS, None), counts):
+        running += count
+        buckets.append({'le': bound, 'count': running})
+
+    return {
+        'since': since,
+        'slo_seconds': slo,
+        'dispatched': total,
+        'undispatched': undispatched,
+        'within_slo_ratio': round(within_slo / total, 4) if total else None,
+        'mean_seconds': round(latency_sum / total, 1) if total else None,
+        'buckets': buckets,
+    }
@@ -0,0 +1,310 @@
+# service_requests/geo.py
+"""
+Geocoding, spatial queries and dispatch batching for field visits.
+
+Service addresses are geocoded offline by the GEOCODER class, by default a
+gazetteer of ZIP code centroids read from the CSV file GEO_GAZETTEER_CSV
+(``postal_code,latitude,longitude`` rows). Any class with a
+``geocode(address)`` method returning ``(latitude, longitude)`` or None can
+take its place. ``ServiceRequest.save()`` locates a request whenever its
+address changes; ``geocode_requests`` fills in existing rows.
+
+Each located request also stores the geohash of its position. A geohash
+cell is a contiguous key range, so a bounding box is covered by a handful
+of range scans on the geohash index before the exact coordinate filter.
+
+``dispatch_plan()`` groups open requests needing a field visit into
+batches per day: the day's requests are walked in geohash order, which
+keeps nearby visits next to each other, and cut into batches of at most
+DISPATCH_BATCH_SIZE visits within DISPATCH_RADIUS_KM of the batch's first
+visit. The work is one indexed read per request database and a sort.
+"""
+import csv
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from accounts.normalize import postal_code
+
+from . import sharding
+from .models import ServiceRequest
+from .workflow import PRIORITY_RANK
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# About 5 m; queries use any prefix of it
+GEOHASH_PRECISION = 9
+# Largest number of geohash cells (range scans) covering one box
+MAX_COVERING_CELLS = 16
+# Requests fetched by id at a time by within()
+NEARBY_FETCH_SIZE = 500
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class GeoError(ValueError):
+    pass
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Geohash of a position
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        span, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    ``(latitude, longitude)`` degrees spanned by a geohash cell
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class PostalCodeGazetteer:
+    """
+    Offline geocoder placing an address at the centroid of its ZIP code
+    """
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'GEO_GAZETTEER_CSV', None)
+        self._centroids = None
+
+    def centroids(self):
+        if self._centroids is None:
+            centroids = {}
+            if self.path:
+                with open(self.path, newline='') as f:
+                    for row in csv.DictReader(f):
+                        centroids[row['postal_code'].strip()] = (float(row['latitude']), float(row['longitude']))
+            self._centroids = centroids
+        return self._centroids
+
+    def geocode(self, address):
+        return self.centroids().get(postal_code(address))
+
+
+_geocoder = (None, None)
+
+
+def geocoder():
+    """
+    The configured GEOCODER, built once per setting value
+    """
+    global _geocoder
+    path = getattr(settings, 'GEOCODER', 'service_requests.geo.PostalCodeGazetteer')
+    key = (path, getattr(settings, 'GEO_GAZETTEER_CSV', None))
+    if _geocoder[0] != key:
+        _geocoder = (key, import_string(path)())
+    return _geocoder[1]
+
+
+def locate(service_request):
+    """
+    Set the request's coordinates and geohash from its service address;
+    cleared when it cannot be geocoded
+    """
+    position = geocoder().geocode(service_request.service_address) if service_request.service_address else None
+    if position is None:
+        service_request.latitude = service_request.longitude = service_request.geohash = None
+    else:
+        service_request.latitude, service_request.longitude = position
+        service_request.geohash = encode(*position)
+
+
+def _covering_cells(south, west, north, east):
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_size, lon_size = cell_size(precision)
+        rows = range(math.floor((south + 90) / lat_size), math.floor((north + 90) / lat_size) + 1)
+        columns = range(math.floor((west + 180) / lon_size), math.floor((east + 180) / lon_size) + 1)
+        if len(rows) * len(columns) <= MAX_COVERING_CELLS:
+            return {
+                encode(
+                    min(-90 + (row + 0.5) * lat_size, 90.0),
+                    min(-180 + (column + 0.5) * lon_size, 180.0),
+                    precision
+                )
+                for row in rows for column in columns
+            }
+    return {''}
+
+
+def in_box(queryset, south, west, north, east):
+    """
+    Located requests of ``queryset`` inside a bounding box; boxes across the
+    180th meridian are not supported
+    """
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        raise GeoError('Need south <= north within -90..90 and west <= east within -180..180')
+    cells = Q()
+    for cell in sorted(_covering_cells(south, west, north, east)):
+        # '~' sorts after every geohash character
+        cells |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+    return queryset.filter(
+        cells, latitude__range=(south, north), longitude__range=(west, east)
+    )
+
+
+def box_around(latitude, longitude, radius_km):
+    """
+    ``(south, west, north, east)`` of the box enclosing a circle
+    """
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or radius_km <= 0:
+        raise GeoError('Need a latitude, a longitude and a positive radius')
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    lon_delta = 180.0 if cos_lat < 1e-6 else min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return (
+        max(latitude - lat_delta, -90.0), max(longitude - lon_delta, -180.0),
+        min(latitude + lat_delta, 90.0), min(longitude + lon_delta, 180.0),
+    )
+
+
+def within(queryset, latitude, longitude, radius_km, limit=None, statuses=None):
+    """
+    Located requests of ``queryset`` within ``radius_km``, nearest first,
+    each with ``distance_km`` set; every request database is searched.
+
+    Positions in the box are read from the geohash index alone, then the
+    requests in range are fetched by id, nearest first, until ``limit`` of
+    them pass the queryset's own filters; given those filters in the same
+    query, SQLite would rather scan by status than by geohash. Requests not
+    in ``statuses``, when given, are dropped in the first pass, which reads
+    the status from the same rows as the position
+    """
+    box = box_around(latitude, longitude, radius_km)
+    statuses = None if statuses is None else set(statuses)
+    candidates = []
+    for part in sharding.each(queryset):
+        located = ServiceRequest.objects.using(part.db).order_by()
+        for pk, lat, lon, status in in_box(located, *box).values_list('id', 'latitude', 'longitude', 'status'):
+            if statuses is not None and status not in statuses:
+                continue
+            distance = distance_km(latitude, longitude, lat, lon)
+            if distance <= radius_km:
+                candidates.append((distance, pk, part))
+    candidates.sort(key=lambda candidate: candidate[:2])
+
+    nearby = []
+    for start in range(0, len(candidates), NEARBY_FETCH_SIZE):
+        chunk = candidates[start:start + NEARBY_FETCH_SIZE]
+        distances = {pk: distance for distance, pk, _ in chunk}
+        by_part = {}
+        for _, pk, part in chunk:
+            by_part.setdefault(part.db, (part, []))[1].append(pk)
+        for part, ids in by_part.values():
+            for service_request in part.filter(id__in=ids):
+                service_request.distance_km = round(distances[service_request.id], 3)
+                nearby.append(service_request)
+        if limit is not None and len(nearby) >= limit:
+            break
+    nearby.sort(key=lambda service_request: (service_request.distance_km, service_request.id))
+    return nearby[:limit]
+
+
+def field_requests():
+    """
+    Open requests whose category needs a field visit
+    """
+    return ServiceRequest.objects.filter(
+        status__in=ServiceRequest.OPEN_STATUSES, category__requires_field_visit=True
+    )
+
+
+def _batch(visits, radius_km):
+    latitude = sum(visit[1] for visit in visits) / len(visits)
+    longitude = sum(visit[2] for visit in visits) / len(visits)
+    ordered = sorted(visits, key=lambda visit: (PRIORITY_RANK.get(visit[4], len(PRIORITY_RANK)), visit[5]))
+    return {
+        'requests': [visit[0] for visit in ordered],
+        'center': {'latitude': round(latitude, 6), 'longitude': round(longitude, 6)},
+        'radius_km': round(max(distance_km(latitude, longitude, visit[1], visit[2]) for visit in visits), 3),
+        'priority': ordered[0][4],
+    }
+
+
+def cluster(visits, batch_size, radius_km):
+    """
+    Cut ``(id, latitude, longitude, geohash, priority, due)`` visits into
+    batches, most urgent batch first
+    """
+    batches, current = [], []
+    for visit in sorted(visits, key=lambda visit: visit[3]):
+        if current and (
+            len(current) >= batch_size
+            or distance_km(current[0][1], current[0][2], visit[1], visit[2]) > radius_km
+        ):
+            batches.append(current)
+            current = []
+        current.append(visit)
+    if current:
+        batches.append(current)
+    batches = [_batch(batch, radius_km) for batch in batches]
+    batches.sort(key=lambda batch: PRIORITY_RANK.get(batch['priority'], len(PRIORITY_RANK)))
+    return batches
+
+
+def dispatch_plan(days=1, batch_size=None, radius_km=None, now=None):
+    """
+    Dispatch batches of located field requests for each of the next
+    ``days`` days. A request belongs to the day its SLA deadline falls on;
+    overdue requests and those without a deadline go to today
+    """
+    batch_size = batch_size or getattr(settings, 'DISPATCH_BATCH_SIZE', 8)
+    radius_km = radius_km or getattr(settings, 'DISPATCH_RADIUS_KM', 5.0)
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    last_day = today + timedelta(days=days - 1)
+
+    by_day, unlocated, later = {}, 0, 0
+    for part in sharding.each(field_requests()):
+        for visit in part.filter(geohash__isnull=False).order_by().values_list(
+            'id', 'latitude', 'longitude', 'geohash', 'priority', 'due_at'
+        ):
+            day = max(timezone.localdate(visit[5]), today) if visit[5] else today
+            if day > last_day:
+                later += 1
+                continue
+            by_day.setdefault(day, []).append(visit)
+        unlocated += part.filter(geohash__isnull=True).count()
+
+    plan = []
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        visits = by_day.get(day, [])
+        # Undated visits sort after dated ones within a batch
+        visits = [visit[:5] + (visit[5] or now,) for visit in visits]
+        plan.append({
+            'date': day,
+            'requests': len(visits),
+            'batches': cluster(visits, batch_size, radius_km),
+        })
+    return {'days': plan, 'unlocated': unlocated, 'later': later}
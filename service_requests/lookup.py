@@ -0,0 +1,141 @@
+# service_requests/lookup.py
+"""
+Caller identification for agents on the phone.
+
+A caller is looked up by customer ID, gas meter ID, phone number or service
+address. Meter IDs, addresses and phone numbers are compared by their
+normalized keys (accounts.normalize), which are indexed on UserProfile and,
+for meters and addresses, on ServiceRequest, so a meter or address only
+ever given on a request still finds its customer.
+
+``summaries()`` adds each match's open requests and a compact history with a
+fixed number of queries per request database holding a match, however
+many requests the customers have.
+"""
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from accounts.models import UserProfile
+from accounts.normalize import normalize_address, normalize_meter_id, normalize_phone
+
+from . import sharding
+from .models import ArchivedServiceRequest, ServiceRequest
+
+# lookup -> (UserProfile field, normalizer); None compares the value as given
+LOOKUPS = {
+    'customer_id': ('customer_id', None),
+    'meter': ('meter_key', normalize_meter_id),
+    'phone': ('phone_key', normalize_phone),
+    'address': ('address_key', normalize_address),
+}
+# Keys also indexed on ServiceRequest
+REQUEST_LOOKUPS = ('meter', 'address')
+
+
+def lookup_keys(value, by=None):
+    """
+    ``{lookup: key}`` for ``value`` under every lookup (or just ``by``),
+    leaving out those it normalizes to nothing
+    """
+    value = value.strip()
+    keys = {}
+    for name, (_, normalize) in LOOKUPS.items():
+        if by is not None and name != by:
+            continue
+        key = normalize(value) if normalize else value
+        if key:
+            keys[name] = key
+    return keys
+
+
+def _match(keys, names):
+    match = Q()
+    for name in names:
+        if name in keys:
+            match |= Q(**{LOOKUPS[name][0]: keys[name]})
+    return match
+
+
+def find_customers(value, by=None, limit=None):
+    """
+    Customers matching ``value``, each with ``matched_on``: the lookups it
+    matched. Profiles are searched first; customers whose requests give the
+    meter or address are only searched when no profile matches
+    """
+    limit = limit or getattr(settings, 'LOOKUP_MAX_MATCHES', 10)
+    keys = lookup_keys(value, by)
+    if not keys:
+        return []
+
+    customers = UserProfile.objects.filter(role=UserProfile.CUSTOMER)
+    matches = list(customers.filter(_match(keys, LOOKUPS)).order_by('id')[:limit])
+    for customer in matches:
+        customer.matched_on = [
+            name for name, key in keys.items() if getattr(customer, LOOKUPS[name][0]) == key
+        ]
+
+    request_match = _match(keys, REQUEST_LOOKUPS)
+    if matches or not request_match:
+        return matches
+    # Uses the meter/address key indexes of each request database
+    matched_on = {}
+    fields = [LOOKUPS[name][0] for name in REQUEST_LOOKUPS]
+    for part in sharding.each(ServiceRequest.objects.filter(request_match)):
+        for customer_id, *values in part.order_by().values_list('customer_id', *fields).distinct()[:limit]:
+            found = matched_on.setdefault(customer_id, set())
+            found.update(name for name, value in zip(REQUEST_LOOKUPS, values) if keys.get(name) == value)
+    matches = list(customers.filter(id__in=matched_on).order_by('id')[:limit])
+    for customer in matches:
+        customer.matched_on = [f'request_{name}' for name in REQUEST_LOOKUPS if name in matched_on[customer.id]]
+    return matches
+
+
+def _history():
+    return {'total': 0, 'open': 0, 'archived': 0, 'by_status': {}, 'last_request_at': None}
+
+
+def _by_status(queryset):
+    return queryset.order_by().values('customer_id', 'status').annotate(
+        count=Count('id'), last=Max('created_at')
+    )
+
+
+def _add(summary, row, archived=False):
+    status, count = row['status'], row['count']
+    summary['by_status'][status] = summary['by_status'].get(status, 0) + count
+    summary['total'] += count
+    if archived:
+        summary['archived'] += count
+    elif status in ServiceRequest.OPEN_STATUSES:
+        summary['open'] += count
+    if summary['last_request_at'] is None or row['last'] > summary['last_request_at']:
+        summary['last_request_at'] = row['last']
+
+
+def summaries(customers):
+    """
+    ``{customer id: (open requests, history)}`` for ``customers``. Open
+    requests are dicts, newest first; history counts requests by status,
+    archived ones included, with the latest creation time
+    """
+    open_requests = {customer.id: [] for customer in customers}
+    history = {customer.id: _history() for customer in customers}
+    by_database = {}
+    for customer in customers:
+        by_database.setdefault(sharding.database_of(customer), []).append(customer.id)
+
+    for using, ids in by_database.items():
+        requests = ServiceRequest.objects.using(using).filter(customer_id__in=ids)
+        for row in requests.filter(status__in=ServiceRequest.OPEN_STATUSES).order_by('-created_at').values(
+            'id', 'request_id', 'customer_id', 'title', 'status', 'priority', 'is_emergency',
+            'category__name', 'assigned_to_id', 'assigned_to__first_name', 'assigned_to__last_name',
+            'created_at', 'due_at'
+        ):
+            open_requests[row['customer_id']].append(row)
+
+        for row in _by_status(requests):
+            _add(history[row['customer_id']], row)
+        for row in _by_status(ArchivedServiceRequest.objects.using(using).filter(customer_id__in=ids)):
+            _add(history[row['customer_id']], row, archived=True)
+
+    return {customer.id: (open_requests[customer.id], history[customer.id]) for customer in customers}
@@ -0,0 +1,35 @@
+# service_requests/management/commands/archive_requests.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from service_requests import archive, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Move completed, closed and cancelled requests with no recent activity, '
+        'and their attachments, comments and history, to the archive (run daily; '
+        'safe to interrupt and re-run)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='Inactive for this many days (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, help='Requests per transaction (default: ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        else:
+            before = archive.cutoff()
+
+        if options['dry_run']:
+            count = sharding.scatter(archive.archivable(before)).count()
+            self.stdout.write(f'{count} request(s) inactive since {before:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        archived = archive.archive(before, options['batch_size'], options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} request(s)'))
@@ -0,0 +1,21 @@
+# service_requests/management/commands/auto_assign.py
+from django.core.management.base import BaseCommand
+
+from service_requests import assignment
+
+
+class Command(BaseCommand):
+    help = 'Auto-assign the unassigned open service request backlog to support agents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many requests')
+
+    def handle(self, *args, **options):
+        assigned, skipped = assignment.assign_backlog(
+            batch_size=options['batch_size'],
+            limit=options['limit']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Assigned {assigned} request(s); {skipped} left unassigned (agents at capacity)'
+        ))
@@ -0,0 +1,71 @@
+# service_requests/management/commands/benchmark_assignment.py
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from service_requests.assignment import AgentLoadBalancer
+from service_requests.models import ServiceRequest
+
+
+class Command(BaseCommand):
+    help = 'Simulate auto-assignment in memory and report throughput and load balance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agents', type=int, default=500)
+        parser.add_argument('--tickets', type=int, default=1_000_000)
+        parser.add_argument('--categories', type=int, default=6)
+        parser.add_argument('--skills-per-agent', type=int, default=2)
+        parser.add_argument('--capacity', type=int, default=10_000)
+        parser.add_argument(
+            '--completion-rate', type=float, default=0.9,
+            help='Probability that each assignment is followed by a completion event'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        categories = list(range(1, options['categories'] + 1))
+        skills = min(options['skills_per_agent'], len(categories))
+        priorities = [p for p, _ in ServiceRequest.PRIORITY_CHOICES]
+        weights = [30, 45, 20, 5]
+
+        balancer = AgentLoadBalancer(
+            ((agent_id, 0, rng.sample(categories, skills))
+             for agent_id in range(1, options['agents'] + 1)),
+            capacity=options['capacity']
+        )
+
+        # Pre-generate the workload so only routing is timed
+        tickets = list(zip(
+            rng.choices(categories, k=options['tickets']),
+            rng.choices(priorities, weights=weights, k=options['tickets']),
+        ))
+        completions = [rng.random() < options['completion_rate'] for _ in tickets]
+        open_tickets = []
+
+        start = time.perf_counter()
+        unassigned = 0
+        for (category_id, priority), completes in zip(tickets, completions):
+            agent_id = balancer.choose(category_id, priority)
+            if agent_id is None:
+                unassigned += 1
+                continue
+            open_tickets.append(agent_id)
+            if completes:
+                # Complete a random open ticket (swap-remove keeps this O(1))
+                index = rng.randrange(len(open_tickets))
+                open_tickets[index], open_tickets[-1] = open_tickets[-1], open_tickets[index]
+                balancer.adjust(open_tickets.pop(), -1)
+        elapsed = time.perf_counter() - start
+
+        loads = list(balancer.loads.values())
+        self.stdout.write(f"Agents:            {options['agents']}")
+        self.stdout.write(f"Tickets:           {options['tickets']}")
+        self.stdout.write(f"Elapsed:           {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:        {options['tickets'] / elapsed:,.0f} tickets/s")
+        self.stdout.write(f"Unassigned:        {unassigned}")
+        self.stdout.write(f"Open load min/max: {min(loads)}/{max(loads)}")
+        self.stdout.write(f"Open load mean:    {statistics.mean(loads):.2f}")
+        self.stdout.write(f"Open load stdev:   {statistics.pstdev(loads):.2f}")
@@ -0,0 +1,105 @@
+# service_requests/management/commands/benchmark_list_serialization.py
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.renderers import JSONRenderer
+
+from dashboard.benchmarks import QueryTimer, percentile
+from gas_utility_portal.compiled_serializers import CompiledSerializer
+from service_requests.models import ServiceRequest
+from service_requests.serializers import ServiceRequestListSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the regular and compiled list serializers on one page of '
+        'service requests (query + serialization + JSON rendering)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per page')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--use-existing-db', action='store_true',
+            help='Benchmark the configured database instead of a fresh generated test database'
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        setup_test_environment()
+        old_config = None
+        try:
+            if not options['use_existing_db']:
+                old_config = setup_databases(verbosity=0, interactive=False)
+                self.stdout.write(f'Generating {rows} requests...')
+                quiet = StringIO()
+                call_command('create_sample_data', stdout=quiet)
+                call_command(
+                    'generate_load_data', customers=max(rows // 10, 10), agents=10,
+                    requests=rows, comments_per_request=0, no_history=True, workers=1, stdout=quiet
+                )
+            if ServiceRequest.objects.count() < rows:
+                raise CommandError(f'Need at least {rows} service requests')
+            results = self._run(rows, options['iterations'], options['warmup'])
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        header = f"{'path':<12} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'sql ms':>9} {'python ms':>10}"
+        self.stdout.write(f'{rows}-row page, {options["iterations"]} iterations')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<12} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['queries']:>8} "
+                f"{r['sql']:>9.1f} {r['p50'] - r['sql']:>10.1f}"
+            )
+        speedup = results['serializer']['p50'] / results['compiled']['p50']
+        self.stdout.write(self.style.SUCCESS(f'Compiled path is {speedup:.1f}x faster; output identical'))
+
+    def _run(self, rows, iterations, warmup):
+        renderer = JSONRenderer()
+        base = ServiceRequest.objects.order_by('-created_at')
+
+        def regular():
+            serializer_class = ServiceRequestListSerializer
+            page = serializer_class.optimize_queryset(base)[:rows]
+            return renderer.render(serializer_class(page, many=True).data)
+
+        def compiled():
+            encoder = CompiledSerializer(ServiceRequestListSerializer())
+            return renderer.render(encoder.encode(encoder.values(base)[:rows]))
+
+        if regular() != compiled():
+            raise CommandError('Compiled output differs from the serializer output')
+
+        results = {}
+        for name, func in (('serializer', regular), ('compiled', compiled)):
+            latencies, sql = [], []
+            for i in range(warmup + iterations):
+                timer = QueryTimer()
+                with connection.execute_wrapper(timer):
+                    start = time.perf_counter()
+                    func()
+                    elapsed = time.perf_counter() - start
+                if i >= warmup:
+                    latencies.append(elapsed * 1000)
+                    sql.append(timer.seconds * 1000)
+            results[name] = {
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'queries': timer.count,
+                'sql': percentile(sql, 50),
+            }
+        return results
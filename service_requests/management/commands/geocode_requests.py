@@ -0,0 +1,47 @@
+# service_requests/management/commands/geocode_requests.py
+from django.core.management.base import BaseCommand
+
+from service_requests import geo, sharding
+from service_requests.models import ServiceRequest
+
+
+class Command(BaseCommand):
+    help = (
+        'Set coordinates and geohash of requests from their service address with '
+        'the configured GEOCODER (after loading a gazetteer or changing geocoder)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also re-geocode requests already located')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Requests read and updated at a time')
+
+    def handle(self, *args, **options):
+        requests = ServiceRequest.objects.filter(service_address__isnull=False).exclude(service_address='')
+        if not options['all']:
+            requests = requests.filter(geohash__isnull=True)
+
+        located = unlocated = 0
+        fields = ['latitude', 'longitude', 'geohash']
+        for part in sharding.each(requests):
+            last_id = 0
+            while True:
+                # Keyset walk by id; located rows may leave the filter between batches
+                batch = list(
+                    part.filter(id__gt=last_id).order_by('id').only('id', 'service_address', *fields)[
+                        :options['batch_size']
+                    ]
+                )
+                if not batch:
+                    break
+                for service_request in batch:
+                    geo.locate(service_request)
+                    if service_request.geohash:
+                        located += 1
+                    else:
+                        unlocated += 1
+                ServiceRequest.objects.using(part.db).bulk_update(batch, fields)
+                last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Located {located} request(s); {unlocated} address(es) could not be geocoded'
+        ))
@@ -0,0 +1,12 @@
+# service_requests/management/commands/prune_sync_tombstones.py
+from django.core.management.base import BaseCommand
+
+from service_requests import sync
+
+
+class Command(BaseCommand):
+    help = 'Delete delta sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS (run daily)'
+
+    def handle(self, *args, **options):
+        deleted = sync.prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstone(s)'))
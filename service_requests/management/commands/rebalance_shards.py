@@ -0,0 +1,55 @@
+# service_requests/management/commands/rebalance_shards.py
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import UserProfile
+from service_requests import sharding
+from service_requests.models import ServiceRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Move customers' service requests to the shard of their service region "
+        '(after changing REQUEST_SHARDS or SERVICE_REGIONS, or customers moving); '
+        'safe to interrupt and re-run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', help='Only this username')
+        parser.add_argument('--to', dest='target', help='Move --customer to this database instead of their home')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the moves')
+
+    def handle(self, *args, **options):
+        if options['target'] and not options['customer']:
+            raise CommandError('--to needs --customer')
+        if options['target'] and options['target'] not in sharding.databases():
+            raise CommandError(f'Not a request database: {options["target"]}')
+
+        if options['customer']:
+            try:
+                customer = UserProfile.objects.get(username=options['customer'])
+            except UserProfile.DoesNotExist:
+                raise CommandError(f'No user {options["customer"]}')
+            moves = [(customer, options['target'] or sharding.home_database(customer))]
+        else:
+            moves = ((customer, sharding.home_database(customer)) for customer in sharding.misplaced_customers())
+
+        moved = failed = 0
+        for customer, target in moves:
+            source = sharding.database_of(customer)
+            if source == target:
+                continue
+            if options['dry_run']:
+                count = ServiceRequest.objects.using(source).filter(customer=customer).count()
+                self.stdout.write(f'{customer.username}: {source} -> {target} ({count} request(s))')
+                continue
+            try:
+                count = sharding.move_customer(customer, target)
+            except sharding.MoveConflict as e:
+                failed += 1
+                self.stderr.write(str(e))
+                continue
+            moved += 1
+            self.stdout.write(f'{customer.username}: {source} -> {target} ({count} request(s))')
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} customer(s), {failed} to retry'))
@@ -0,0 +1,12 @@
+# service_requests/management/commands/reconcile_metrics.py
+from django.core.management.base import BaseCommand
+
+from service_requests import metrics
+
+
+class Command(BaseCommand):
+    help = 'Recount the service request gauges exposed at /metrics (run after bulk imports or periodically)'
+
+    def handle(self, *args, **options):
+        metrics.reconcile()
+        self.stdout.write(self.style.SUCCESS('Service request gauges recounted'))
@@ -0,0 +1,30 @@
+# service_requests/management/commands/restore_requests.py
+from django.core.management.base import BaseCommand, CommandError
+
+from service_requests import archive
+from service_requests.models import ArchivedServiceRequest
+
+
+class Command(BaseCommand):
+    help = 'Move archived service requests back into the live tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Request ids')
+        parser.add_argument('--request-id', action='append', default=[], help='Request UUID (repeatable)')
+        parser.add_argument('--customer', help='Every archived request of this username')
+        parser.add_argument('--batch-size', type=int, help='Requests per transaction (default: ARCHIVE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if not (options['ids'] or options['request_id'] or options['customer']):
+            raise CommandError('Give request ids, --request-id or --customer')
+
+        queryset = ArchivedServiceRequest.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+        if options['request_id']:
+            queryset = queryset.filter(request_id__in=options['request_id'])
+        if options['customer']:
+            queryset = queryset.filter(customer__username=options['customer'])
+
+        restored = archive.restore(queryset, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Restored {restored} request(s)'))
@@ -0,0 +1,25 @@
+# service_requests/management/commands/scan_sla_breaches.py
+from django.core.management.base import BaseCommand
+
+from service_requests import sla
+
+
+class Command(BaseCommand):
+    help = 'Flag open service requests whose SLA deadline has passed (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--escalate', action='store_true',
+            help='Also raise the priority of each breached request one step'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Count breaches without flagging them')
+
+    def handle(self, *args, **options):
+        flagged = sla.scan_breaches(
+            batch_size=options['batch_size'],
+            escalate=options['escalate'],
+            dry_run=options['dry_run']
+        )
+        verb = 'Found' if options['dry_run'] else 'Flagged'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {flagged} breached request(s)'))
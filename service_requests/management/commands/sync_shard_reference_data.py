@@ -0,0 +1,28 @@
+# service_requests/management/commands/sync_shard_reference_data.py
+from django.core.management.base import BaseCommand, CommandError
+
+from service_requests import sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy users and service categories from default to the request shards '
+        '(after adding a shard, or after bulk loads that skipped the copy on save)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', default=[], help='Only this shard (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        shards = options['database'] or sharding.shards()
+        unknown = set(shards) - set(sharding.shards())
+        if unknown:
+            raise CommandError(f'Not a request shard: {", ".join(sorted(unknown))}')
+        if not shards:
+            self.stdout.write('Sharding is not configured; nothing to copy')
+            return
+
+        for using in shards:
+            copied = sharding.copy_reference_data(using, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{using}: copied {copied} row(s)'))
@@ -0,0 +1,191 @@
+# service_requests/metrics.py
+"""
+Domain gauges for the metrics endpoint: open requests by status and
+priority, the unassigned backlog and its oldest entry, and emergency queue
+depth.
+
+Gauges are adjusted by difference as requests are created, saved,
+transitioned or deleted, never counted per scrape. Each change compares
+the request's tracked fields as loaded (``ServiceRequest.TRACKED_FIELDS``)
+with their new values and is applied once the transaction commits.
+``reconcile()`` recounts everything with one grouped query per request
+database; it runs on the first scrape against a new metrics file and from
+the ``reconcile_metrics`` command to correct drift from raw bulk writes.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from gas_utility_portal import metrics
+
+from . import sharding
+from .models import ServiceRequest
+from .workflow import OPEN_STATUSES, status_changed
+
+open_requests = metrics.Gauge(
+    'service_requests_open', 'Open service requests by status and priority',
+    ['status', 'priority']
+)
+unassigned = metrics.Gauge(
+    'service_requests_unassigned', 'Open service requests with no agent assigned'
+)
+oldest_unassigned = metrics.Gauge(
+    'service_requests_unassigned_oldest_created_timestamp_seconds',
+    'Creation time of the oldest unassigned open request, 0 when there is none'
+)
+emergency_queue = metrics.Gauge(
+    'service_requests_emergency_queue_depth', 'Open requests in the emergency queue'
+)
+reconciled = metrics.Gauge(
+    'service_requests_gauges_reconciled_timestamp_seconds',
+    'When the service request gauges were last recounted from the database'
+)
+
+
+def _oldest_age(current):
+    created = current.get(oldest_unassigned.labels().key, 0.0)
+    return [((), max(time.time() - created, 0.0) if created else 0.0)]
+
+
+metrics.ComputedGauge(
+    'service_requests_unassigned_oldest_age_seconds',
+    'Age of the oldest unassigned open request', _oldest_age
+)
+
+
+def _tracked(service_request):
+    return tuple(getattr(service_request, name) for name in ServiceRequest.TRACKED_FIELDS)
+
+
+def _deltas(old, new):
+    """
+    Gauge adjustments for a request moving between two tracked states;
+    either may be None (not yet created / deleted)
+    """
+    changes = []
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        status, priority, assigned_to_id, is_emergency, created_at = state
+        if status not in OPEN_STATUSES:
+            continue
+        changes.append((open_requests.labels(status, priority).key, sign))
+        if not assigned_to_id:
+            changes.append((unassigned.labels().key, sign))
+        if is_emergency:
+            changes.append((emergency_queue.labels().key, sign))
+    return changes
+
+
+def _waiting_since(state):
+    """
+    Creation timestamp if ``state`` is unassigned and open, else None
+    """
+    if state is None or state[2] or state[0] not in OPEN_STATUSES:
+        return None
+    return state[4].timestamp()
+
+
+def _apply(old, new):
+    changes = _deltas(old, new)
+    if changes:
+        metrics.store().inc(changes)
+    left, joined = _waiting_since(old), _waiting_since(new)
+    if joined is not None:
+        oldest_unassigned.labels().set_min(joined)
+    if left is not None and joined is None:
+        if left <= metrics.store().get(oldest_unassigned.labels().key):
+            _recompute_oldest()
+
+
+def _recompute_oldest():
+    # By creation time, not id: ids do not follow creation order once
+    # requests move between shard databases. Sorts the unassigned rows the
+    # assigned_to index finds, i.e. the backlog, not the table
+    queryset = ServiceRequest.objects.filter(
+        assigned_to__isnull=True, status__in=OPEN_STATUSES
+    ).order_by('created_at', 'id').values_list('created_at', flat=True)
+    oldest = [created for created in (part.first() for part in sharding.each(queryset)) if created]
+    oldest_unassigned.set(min(oldest).timestamp() if oldest else 0.0)
+
+
+def track(service_request):
+    """
+    Account for a change to an already-loaded request; safe to call more
+    than once, only the difference since the last call is applied
+    """
+    old = getattr(service_request, '_loaded_tracked', None)
+    if old is None:
+        # Partially loaded or built by hand: nothing to diff against
+        return
+    new = _tracked(service_request)
+    if old == new:
+        return
+    service_request._loaded_tracked = new
+    transaction.on_commit(lambda: _apply(old, new))
+
+
+@receiver(post_save, sender=ServiceRequest)
+def _track_save(sender, instance, created, **kwargs):
+    if created:
+        new = _tracked(instance)
+        instance._loaded_tracked = new
+        transaction.on_commit(lambda: _apply(None, new))
+    else:
+        track(instance)
+
+
+@receiver(post_delete, sender=ServiceRequest)
+def _track_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_loaded_tracked', None)
+    if old is not None:
+        transaction.on_commit(lambda: _apply(old, None))
+
+
+@receiver(status_changed)
+def _track_status_change(sender, service_request, **kwargs):
+    # Already accounted for if the transition was saved with save()
+    track(service_request)
+
+
+def reconcile():
+    """
+    Recount every service request gauge from the database
+    """
+    grouped = ServiceRequest.objects.filter(status__in=OPEN_STATUSES).values(
+        'status', 'priority'
+    ).annotate(
+        total=Count('id'),
+        unassigned=Count('id', filter=Q(assigned_to__isnull=True)),
+        emergency=Count('id', filter=Q(is_emergency=True)),
+        oldest=Min('created_at', filter=Q(assigned_to__isnull=True)),
+    )
+    # One group per status and priority per request database
+    rows = [row for part in sharding.each(grouped) for row in part]
+    values = {
+        open_requests.labels(status, priority).key: 0
+        for status in OPEN_STATUSES for priority, _ in ServiceRequest.PRIORITY_CHOICES
+    }
+    unassigned_total = emergency_total = 0
+    oldest = None
+    for row in rows:
+        key = open_requests.labels(row['status'], row['priority']).key
+        values[key] = values.get(key, 0) + row['total']
+        unassigned_total += row['unassigned']
+        emergency_total += row['emergency']
+        if row['oldest'] and (oldest is None or row['oldest'] < oldest):
+            oldest = row['oldest']
+    values[unassigned.labels().key] = unassigned_total
+    values[emergency_queue.labels().key] = emergency_total
+    values[oldest_unassigned.labels().key] = oldest.timestamp() if oldest else 0.0
+    values[reconciled.labels().key] = time.time()
+    metrics.store().set(values.items())
+
+
+@metrics.REGISTRY.on_collect
+def _initialise():
+    if not metrics.store().get(reconciled.labels().key):
+        reconcile()
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicecategory',
+            name='agents',
+            field=models.ManyToManyField(blank=True, help_text='Support agents skilled in this category, preferred by auto-assignment', related_name='skills', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:10
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Matches service_requests.sla.DEFAULT_RESOLUTION_MINUTES at the time of writing
+DEFAULT_RESOLUTION_MINUTES = {
+    'urgent': 4 * 60,
+    'high': 24 * 60,
+    'medium': 3 * 24 * 60,
+    'low': 7 * 24 * 60,
+}
+
+
+def backfill_due_at(apps, schema_editor):
+    ServiceRequest = apps.get_model('service_requests', 'ServiceRequest')
+    for priority, minutes in DEFAULT_RESOLUTION_MINUTES.items():
+        ServiceRequest.objects.filter(priority=priority, due_at__isnull=True).update(
+            due_at=models.F('created_at') + timedelta(minutes=minutes)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0002_servicecategory_agents'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SLAPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.CharField(blank=True, choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], max_length=10)),
+                ('resolution_minutes', models.PositiveIntegerField()),
+            ],
+            options={
+                'verbose_name': 'SLA Policy',
+                'verbose_name_plural': 'SLA Policies',
+            },
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='due_at',
+            field=models.DateTimeField(blank=True, help_text='SLA resolution deadline', null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='sla_breached',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['status', 'due_at', 'sla_breached'], name='sr_sla_due_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='slapolicy',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sla_policies', to='service_requests.servicecategory'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='slapolicy',
+            unique_together={('category', 'priority')},
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from accounts.normalize import normalize_address, normalize_meter_id
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    ServiceRequest = apps.get_model('service_requests', 'ServiceRequest')
+    batch = []
+    for service_request in ServiceRequest.objects.only('id', 'gas_meter_id', 'service_address').iterator():
+        service_request.meter_key = normalize_meter_id(service_request.gas_meter_id)
+        service_request.address_key = normalize_address(service_request.service_address)
+        batch.append(service_request)
+        if len(batch) >= 1000:
+            ServiceRequest.objects.bulk_update(batch, ['meter_key', 'address_key'])
+            batch = []
+    ServiceRequest.objects.bulk_update(batch, ['meter_key', 'address_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0003_sla'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequest',
+            name='address_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='meter_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='Incident this request was detected as a duplicate of', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='service_requests.servicerequest'),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['meter_key', 'created_at'], name='sr_meter_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['address_key', 'created_at'], name='sr_address_key_idx'),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+    ]
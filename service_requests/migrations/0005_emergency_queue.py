@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def flag_emergencies(apps, schema_editor):
+    ServiceCategory = apps.get_model('service_requests', 'ServiceCategory')
+    ServiceRequest = apps.get_model('service_requests', 'ServiceRequest')
+    ServiceCategory.objects.filter(slug__in=['gas-leak', 'emergency-service']).update(is_emergency=True)
+    ServiceRequest.objects.filter(
+        models.Q(priority='urgent') | models.Q(category__is_emergency=True)
+    ).update(is_emergency=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0004_duplicate_detection'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicecategory',
+            name='is_emergency',
+            field=models.BooleanField(default=False, help_text='Requests in this category go to the emergency queue whatever their priority'),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='first_assigned_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='is_emergency',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(condition=models.Q(('is_emergency', True)), fields=['status', 'created_at'], name='sr_emergency_queue_idx'),
+        ),
+        migrations.RunPython(flag_emergencies, migrations.RunPython.noop),
+    ]
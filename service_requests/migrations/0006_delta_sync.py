@@ -0,0 +1,60 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0005_emergency_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(choices=[('request', 'Request'), ('comment', 'Comment'), ('attachment', 'Attachment')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('service_request_pk', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Sync Tombstone',
+                'verbose_name_plural': 'Sync Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='assigned_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the current agent was assigned', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='requestattachment',
+            index=models.Index(fields=['uploaded_at', 'id'], name='sr_attachment_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestcomment',
+            index=models.Index(fields=['created_at', 'id'], name='sr_comment_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requeststatushistory',
+            index=models.Index(fields=['changed_at', 'id'], name='sr_history_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['assigned_to', 'updated_at', 'id'], name='sr_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='synctombstone',
+            name='agent',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='synctombstone',
+            index=models.Index(fields=['agent', 'deleted_at', 'id'], name='sync_tombstone_agent_idx'),
+        ),
+    ]
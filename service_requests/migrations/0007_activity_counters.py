@@ -0,0 +1,73 @@
+# Generated by Django 5.2.1 on 2026-10-19 02:41
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Greatest
+
+
+def count_activity(apps, schema_editor):
+    ServiceRequest = apps.get_model('service_requests', 'ServiceRequest')
+    RequestComment = apps.get_model('service_requests', 'RequestComment')
+    RequestAttachment = apps.get_model('service_requests', 'RequestAttachment')
+    RequestStatusHistory = apps.get_model('service_requests', 'RequestStatusHistory')
+
+    def per_request(queryset, aggregate):
+        return models.Subquery(
+            queryset.filter(service_request=models.OuterRef('pk')).order_by().values(
+                'service_request'
+            ).annotate(value=aggregate).values('value')
+        )
+
+    def count(queryset):
+        return Coalesce(per_request(queryset, models.Count('id')), 0, output_field=models.IntegerField())
+
+    def latest(queryset, field):
+        return Coalesce(per_request(queryset, models.Max(field)), 'created_at')
+
+    ServiceRequest.objects.update(
+        comment_count=count(RequestComment.objects.all()),
+        public_comment_count=count(RequestComment.objects.filter(is_internal=False)),
+        attachment_count=count(RequestAttachment.objects.all()),
+        last_activity_at=Greatest(
+            'created_at',
+            latest(RequestComment.objects.all(), 'created_at'),
+            latest(RequestAttachment.objects.all(), 'uploaded_at'),
+            latest(RequestStatusHistory.objects.all(), 'changed_at'),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0006_delta_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequest',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Latest of creation, comment, attachment and status change', null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='public_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(fields=['assigned_to', 'last_activity_at', 'id'], name='sr_activity_idx'),
+        ),
+        migrations.RunPython(count_activity, migrations.RunPython.noop),
+    ]
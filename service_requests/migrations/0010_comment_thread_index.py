@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0009_shard_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requestcomment',
+            index=models.Index(fields=['service_request', 'created_at', 'id'], name='sr_comment_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def flag_desk_categories(apps, schema_editor):
+    ServiceCategory = apps.get_model('service_requests', 'ServiceCategory')
+    # Categories are copied to every shard
+    ServiceCategory.objects.using(schema_editor.connection.alias).filter(
+        slug='billing-inquiry'
+    ).update(requires_field_visit=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0010_comment_thread_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicecategory',
+            name='requires_field_visit',
+            field=models.BooleanField(default=True, help_text='Requests in this category are batched for field crews by dispatch planning'),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(condition=models.Q(('geohash__isnull', False)), fields=['geohash'], name='sr_geohash_idx'),
+        ),
+        migrations.RunPython(flag_desk_categories, migrations.RunPython.noop),
+    ]
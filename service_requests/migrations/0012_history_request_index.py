@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 03:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0011_geo_dispatch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requeststatushistory',
+            index=models.Index(fields=['service_request', 'changed_at', 'id'], name='sr_history_request_idx'),
+        ),
+    ]
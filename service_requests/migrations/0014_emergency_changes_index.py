@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 04:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0012_history_request_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(condition=models.Q(('is_emergency', True)), fields=['updated_at'], name='sr_emergency_changes_idx'),
+        ),
+    ]
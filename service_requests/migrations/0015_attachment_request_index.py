@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 04:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0014_emergency_changes_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requestattachment',
+            index=models.Index(fields=['service_request', 'uploaded_at', 'id'], name='sr_attachment_request_idx'),
+        ),
+    ]
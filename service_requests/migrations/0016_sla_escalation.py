@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_requests', '0015_attachment_request_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SLAEscalation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_request_pk', models.BigIntegerField()),
+                ('previous_priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], max_length=10)),
+                ('new_priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], max_length=10)),
+                ('escalated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'SLA Escalation',
+                'verbose_name_plural': 'SLA Escalations',
+                'indexes': [models.Index(fields=['service_request_pk', 'escalated_at'], name='sla_escalation_request_idx')],
+            },
+        ),
+    ]
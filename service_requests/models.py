@@ -1,7 +1,9 @@
 # service_requests/models.py
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from accounts.models import UserProfile
+from accounts.normalize import normalize_address, normalize_meter_id
 import uuid
 
 class ServiceCategory(models.Model):
@@ -12,6 +14,20 @@ class ServiceCategory(models.Model):
     description = models.TextField()
     slug = models.SlugField(unique=True)
     is_active = models.BooleanField(default=True)
+    is_emergency = models.BooleanField(
+        default=False,
+        help_text="Requests in this category go to the emergency queue whatever their priority"
+    )
+    agents = models.ManyToManyField(
+        UserProfile,
+        blank=True,
+        related_name='skills',
+        help_text="Support agents skilled in this category, preferred by auto-assignment"
+    )
+    requires_field_visit = models.BooleanField(
+        default=True,
+        help_text="Requests in this category are batched for field crews by dispatch planning"
+    )
     
     class Meta:
         verbose_name = _('Service Category')
@@ -43,6 +59,26 @@ class ServiceRequest(models.Model):
         (CANCELLED, _('Cancelled')),
     ]
     
+    # Statuses in which a request still needs work
+    OPEN_STATUSES = [NEW, ASSIGNED, IN_PROGRESS, ON_HOLD]
+
+    # Loaded values remembered by from_db so open-request gauges can be
+    # adjusted by difference when the row is saved
+    TRACKED_FIELDS = ('status', 'priority', 'assigned_to_id', 'is_emergency', 'created_at')
+    
+    # Allowed status transitions: current status -> {next status: roles}.
+    # A roles value of None means any staff member may perform the move.
+    # Compiled into frozen lookup tables by service_requests.workflow.
+    TRANSITIONS = {
+        NEW: {ASSIGNED: None, IN_PROGRESS: None, ON_HOLD: None, CANCELLED: None},
+        ASSIGNED: {NEW: None, IN_PROGRESS: None, ON_HOLD: None, CANCELLED: None},
+        IN_PROGRESS: {ASSIGNED: None, ON_HOLD: None, COMPLETED: None, CANCELLED: None},
+        ON_HOLD: {ASSIGNED: None, IN_PROGRESS: None, CANCELLED: None},
+        COMPLETED: {CLOSED: None, IN_PROGRESS: None},
+        CLOSED: {IN_PROGRESS: [UserProfile.MANAGER, UserProfile.ADMIN]},
+        CANCELLED: {NEW: [UserProfile.MANAGER, UserProfile.ADMIN]},
+    }
+    
     # Priority choices
     LOW = 'low'
     MEDIUM = 'medium'
@@ -90,16 +126,177 @@ class ServiceRequest(models.Model):
         related_name='assigned_requests'
     )
     completed_at = models.DateTimeField(null=True, blank=True)
+    first_assigned_at = models.DateTimeField(null=True, blank=True, editable=False)
+    assigned_at = models.DateTimeField(
+        null=True, blank=True, editable=False,
+        help_text="When the current agent was assigned"
+    )
+    is_emergency = models.BooleanField(default=False, editable=False)
     service_address = models.TextField(blank=True, null=True)
     gas_meter_id = models.CharField(max_length=30, blank=True, null=True)
+    due_at = models.DateTimeField(null=True, blank=True, help_text="SLA resolution deadline")
+    sla_breached = models.BooleanField(default=False)
+    
+    # Maintained by service_requests.activity
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    public_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_activity_at = models.DateTimeField(
+        null=True, blank=True, editable=False,
+        help_text="Latest of creation, comment, attachment and status change"
+    )
+    
+    # Normalized copies of gas_meter_id/service_address for duplicate lookup
+    meter_key = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    address_key = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    # Position of service_address, set by service_requests.geo
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        help_text="Incident this request was detected as a duplicate of"
+    )
     
     class Meta:
         verbose_name = _('Service Request')
         verbose_name_plural = _('Service Requests')
         ordering = ['-created_at']
+        indexes = [
+            # Range scans on due_at per open status for the breach scanner
+            # and at-risk list
+            models.Index(fields=['status', 'due_at', 'sla_breached'], name='sr_sla_due_at_idx'),
+            # Recent reports for the same meter or address
+            models.Index(fields=['meter_key', 'created_at'], name='sr_meter_key_idx'),
+            models.Index(fields=['address_key', 'created_at'], name='sr_address_key_idx'),
+            # Emergency queue: only urgent and emergency-category requests
+            models.Index(
+                fields=['status', 'created_at'],
+                name='sr_emergency_queue_idx',
+                condition=models.Q(is_emergency=True),
+            ),
+            # Emergency requests changed since a subscriber's cursor, in any status
+            models.Index(
+                fields=['updated_at'],
+                name='sr_emergency_changes_idx',
+                condition=models.Q(is_emergency=True),
+            ),
+            # Delta sync: an agent's requests changed within a time window
+            models.Index(fields=['assigned_to', 'updated_at', 'id'], name='sr_sync_idx'),
+            # Agent queue, most recent activity first
+            models.Index(fields=['assigned_to', 'last_activity_at', 'id'], name='sr_activity_idx'),
+            # Geohash prefix ranges for radius and bounding-box queries
+            models.Index(
+                fields=['geohash'],
+                name='sr_geohash_idx',
+                condition=models.Q(geohash__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return f"Request {self.request_id} - {self.customer.username}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'priority' in field_names and 'category_id' in field_names:
+            instance._loaded_sla_key = (instance.priority, instance.category_id)
+        if all(name in field_names for name in cls.TRACKED_FIELDS):
+            instance._loaded_tracked = tuple(getattr(instance, name) for name in cls.TRACKED_FIELDS)
+        if 'service_address' in field_names:
+            instance._loaded_address = instance.service_address
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """
+        Keep derived columns in step with their sources: lookup keys, the
+        position of the service address, the assignment times, and the SLA
+        deadline and emergency flag, which depend on priority and category
+        """
+        update_fields = kwargs.get('update_fields')
+        derived = set()
+        
+        if self._state.adding and self.last_activity_at is None:
+            self.last_activity_at = timezone.now()
+        
+        if update_fields is None or {'gas_meter_id', 'service_address'} & set(update_fields):
+            self.meter_key = normalize_meter_id(self.gas_meter_id)
+            self.address_key = normalize_address(self.service_address)
+            derived |= {'meter_key', 'address_key'}
+        
+        # Geocoded only when the address changes
+        if (update_fields is None or 'service_address' in update_fields) and (
+            self._state.adding or getattr(self, '_loaded_address', None) != self.service_address
+        ):
+            from .geo import locate
+            locate(self)
+            derived |= {'latitude', 'longitude', 'geohash'}
+        
+        if self.assigned_to_id and 'first_assigned_at' in self.__dict__ and self.first_assigned_at is None:
+            self.first_assigned_at = timezone.now()
+            derived.add('first_assigned_at')
+        
+        # Assignment changes are only detectable against fully loaded values
+        loaded_tracked = getattr(self, '_loaded_tracked', None)
+        if (self._state.adding or loaded_tracked is not None) and (
+            update_fields is None or {'assigned_to', 'assigned_to_id'} & set(update_fields)
+        ):
+            previous_agent_id = loaded_tracked[2] if loaded_tracked else None
+            if self.assigned_to_id != previous_agent_id:
+                self.assigned_at = timezone.now() if self.assigned_to_id else None
+                derived.add('assigned_at')
+                if previous_agent_id:
+                    # Read by the sync post_save receiver to tombstone the request
+                    self._reassigned_from = previous_agent_id
+        
+        loaded_key = getattr(self, '_loaded_sla_key', None)
+        if self._state.adding or (loaded_key is not None and loaded_key != (self.priority, self.category_id)):
+            from .sla import compute_due_at
+            self.due_at = compute_due_at(self)
+            self.sla_breached = False
+            self.is_emergency = self.priority == self.URGENT or self.category.is_emergency
+            derived |= {'due_at', 'sla_breached', 'is_emergency'}
+            loaded_key = (self.priority, self.category_id)
+        
+        if update_fields is not None and derived:
+            kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+        if loaded_key is not None:
+            self._loaded_sla_key = loaded_key
+        self._loaded_address = self.service_address
+
+class SLAPolicy(models.Model):
+    """
+    Resolution deadline for requests of a category and/or priority.
+    Blank category or priority acts as a wildcard.
+    """
+    category = models.ForeignKey(
+        ServiceCategory,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sla_policies'
+    )
+    priority = models.CharField(
+        max_length=10,
+        choices=ServiceRequest.PRIORITY_CHOICES,
+        blank=True
+    )
+    resolution_minutes = models.PositiveIntegerField()
+    
+    class Meta:
+        verbose_name = _('SLA Policy')
+        verbose_name_plural = _('SLA Policies')
+        unique_together = [('category', 'priority')]
+    
+    def __str__(self):
+        category = self.category.name if self.category else 'Any category'
+        priority = self.get_priority_display() if self.priority else 'any priority'
+        return f"{category} / {priority}: {self.resolution_minutes} min"
 
 class RequestAttachment(models.Model):
     """
@@ -119,6 +316,13 @@ class RequestAttachment(models.Model):
         related_name='uploaded_attachments'
     )
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['uploaded_at', 'id'], name='sr_attachment_sync_idx'),
+            # Delta sync: a request's new attachments
+            models.Index(fields=['service_request', 'uploaded_at', 'id'], name='sr_attachment_request_idx'),
+        ]
+    
     def __str__(self):
         return f"Attachment for {self.service_request.request_id}"
 
@@ -142,6 +346,11 @@ class RequestComment(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='sr_comment_sync_idx'),
+            # A request's thread in creation order, for cursor pages and ?since=
+            models.Index(fields=['service_request', 'created_at', 'id'], name='sr_comment_thread_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.author.username} on {self.service_request.request_id}"
@@ -169,6 +378,112 @@ class RequestStatusHistory(models.Model):
         verbose_name = _('Request Status History')
         verbose_name_plural = _('Request Status Histories')
         ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['changed_at', 'id'], name='sr_history_sync_idx'),
+            # A request's history in order, for time-in-status analytics
+            models.Index(fields=['service_request', 'changed_at', 'id'], name='sr_history_request_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Status change for {self.service_request.request_id}: {self.previous_status} → {self.new_status}"
+
+class SLAEscalation(models.Model):
+    """
+    Priority raise applied to a breached request by the SLA breach scanner
+    """
+    # Plain id: the request may be archived or live on another database
+    service_request_pk = models.BigIntegerField()
+    previous_priority = models.CharField(max_length=10, choices=ServiceRequest.PRIORITY_CHOICES)
+    new_priority = models.CharField(max_length=10, choices=ServiceRequest.PRIORITY_CHOICES)
+    escalated_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = _('SLA Escalation')
+        verbose_name_plural = _('SLA Escalations')
+        indexes = [
+            models.Index(fields=['service_request_pk', 'escalated_at'], name='sla_escalation_request_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Request {self.service_request_pk}: {self.previous_priority} → {self.new_priority}"
+
+class SyncTombstone(models.Model):
+    """
+    Something an agent's offline client must drop: a deleted request,
+    comment or attachment, or a request reassigned away from the agent
+    """
+    REQUEST = 'request'
+    COMMENT = 'comment'
+    ATTACHMENT = 'attachment'
+    
+    OBJECT_TYPE_CHOICES = [
+        (REQUEST, _('Request')),
+        (COMMENT, _('Comment')),
+        (ATTACHMENT, _('Attachment')),
+    ]
+    
+    agent = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name='sync_tombstones'
+    )
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPE_CHOICES)
+    object_id = models.BigIntegerField()
+    # Plain id: the request itself may be gone
+    service_request_pk = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Sync Tombstone')
+        verbose_name_plural = _('Sync Tombstones')
+        indexes = [
+            models.Index(fields=['agent', 'deleted_at', 'id'], name='sync_tombstone_agent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} removed for {self.agent_id}"
+
+class ArchivedServiceRequest(models.Model):
+    """
+    A closed request moved out of the hot tables by
+    service_requests.archive, with its attachments, comments and status
+    history stored as field values in ``data``
+    """
+    # Same id as the request had; ids are never reused
+    id = models.BigIntegerField(primary_key=True)
+    request_id = models.UUIDField(unique=True)
+    customer = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name='archived_requests'
+    )
+    # Protects the category while archived requests may be restored
+    category = models.ForeignKey(
+        ServiceCategory,
+        on_delete=models.PROTECT,
+        related_name='archived_requests'
+    )
+    status = models.CharField(max_length=20, choices=ServiceRequest.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField()
+    
+    class Meta:
+        verbose_name = _('Archived Service Request')
+        verbose_name_plural = _('Archived Service Requests')
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"Archived request {self.request_id}"
+
+class ShardSequence(models.Model):
+    """
+    Last id handed out for a table in this request database; only used
+    when requests are sharded (see service_requests.sharding)
+    """
+    table = models.CharField(max_length=100, primary_key=True)
+    last_id = models.BigIntegerField()
     
     def __str__(self):
-        return f"Status change for {self.service_request.request_id}: {self.previous_status} → {self.new_status}"
\ No newline at end of file
+        return f"{self.table}: {self.last_id}"
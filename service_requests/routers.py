@@ -0,0 +1,75 @@
+# service_requests/routers.py
+"""
+Database router for region-sharded service requests; see sharding.py.
+
+Only requests and the rows stored with them are routed. Everything else,
+including the users and categories copied to every shard, is read and
+written in ``default``. A read of requests that is not about one instance
+and picked no database (``.using()`` or ``sharding.scatter()``) would see
+``default`` alone; it is logged once per call site.
+"""
+import logging
+import sys
+
+from django.db import DEFAULT_DB_ALIAS
+
+from . import sharding
+
+logger = logging.getLogger('service_requests.sharding')
+
+_reported = set()
+
+
+def _report_unrouted_read(model):
+    frame = sys._getframe(2)
+    # The first frame outside Django and this module made the query
+    while frame is not None and frame.f_globals.get('__name__', '').startswith(('django.', __name__)):
+        frame = frame.f_back
+    site = (frame.f_code.co_filename, frame.f_lineno) if frame is not None else None
+    if site in _reported:
+        return
+    _reported.add(site)
+    logger.warning(
+        'Read of %s without a database reads only %s; use .using() or sharding.scatter() (%s:%s)',
+        model._meta.label, DEFAULT_DB_ALIAS, *(site or ('?', '?'))
+    )
+
+
+class RequestShardRouter:
+    def _database(self, model, instance):
+        if not sharding.is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        if instance is None:
+            return None
+        if sharding.is_sharded(type(instance)):
+            if isinstance(instance, model) and instance._state.adding:
+                # May have been guessed from whichever relation was set first
+                return sharding.database_for(instance)
+            return instance._state.db or sharding.database_for(instance)
+        if instance._meta.model_name == 'userprofile':
+            # e.g. user.service_requests; an agent's assigned requests span
+            # every shard and are read with sharding.scatter()
+            return sharding.database_of(instance)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, instance=None, **hints):
+        if not sharding.enabled():
+            return None
+        database = self._database(model, instance)
+        if database is None:
+            _report_unrouted_read(model)
+        return database
+
+    def db_for_write(self, model, instance=None, **hints):
+        if not sharding.enabled():
+            return None
+        return self._database(model, instance)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding.enabled():
+            return None
+        databases = sharding.databases()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            # Users and categories exist in every request database
+            return True
+        return None
@@ -1,9 +1,15 @@
 # service_requests/serializers.py
+from django.conf import settings
+from django.db.models import Case, CharField, F, Prefetch, Value, When
+from django.db.models.functions import Concat
 from rest_framework import serializers
 from .models import ServiceCategory, ServiceRequest, RequestAttachment, RequestComment, RequestStatusHistory
 from accounts.serializers import UserProfileSerializer
+from gas_utility_portal.sparse_fields import SparseFieldsMixin
+from .duplicates import find_parent
+from .sharding import database_of
 
-class ServiceCategorySerializer(serializers.ModelSerializer):
+class ServiceCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for service categories
     """
@@ -11,7 +17,7 @@ class ServiceCategorySerializer(serializers.ModelSerializer):
         model = ServiceCategory
         fields = ['id', 'name', 'description', 'slug', 'is_active']
 
-class RequestAttachmentSerializer(serializers.ModelSerializer):
+class RequestAttachmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for service request attachments
     """
@@ -22,7 +28,7 @@ class RequestAttachmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'file', 'file_name', 'uploaded_at', 'uploaded_by']
         read_only_fields = ['uploaded_at', 'uploaded_by']
 
-class RequestCommentSerializer(serializers.ModelSerializer):
+class RequestCommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for comments on service requests
     """
@@ -33,7 +39,14 @@ class RequestCommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'text', 'created_at', 'author', 'is_internal']
         read_only_fields = ['created_at', 'author']
 
-class RequestStatusHistorySerializer(serializers.ModelSerializer):
+class ThreadCommentSerializer(RequestCommentSerializer):
+    """
+    Comment in a paged thread; ``author`` is a key into the page's
+    side-loaded ``authors`` map
+    """
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+
+class RequestStatusHistorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for tracking status changes
     """
@@ -44,10 +57,30 @@ class RequestStatusHistorySerializer(serializers.ModelSerializer):
         fields = ['id', 'previous_status', 'new_status', 'changed_at', 'changed_by', 'comment']
         read_only_fields = ['changed_at', 'changed_by']
 
-class ServiceRequestListSerializer(serializers.ModelSerializer):
+class ServiceRequestListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Simplified serializer for listing service requests
     """
+    select_related_fields = {
+        'customer_name': 'customer',
+        'category_name': 'category',
+        'assigned_to_name': 'assigned_to',
+    }
+    # SQL equivalents of the method fields for the compiled list path
+    sql_fields = {
+        'customer_name': Concat(
+            'customer__first_name', Value(' '), 'customer__last_name', output_field=CharField()
+        ),
+        'category_name': F('category__name'),
+        'assigned_to_name': Case(
+            When(assigned_to__isnull=True, then=Value(None)),
+            default=Concat(
+                'assigned_to__first_name', Value(' '), 'assigned_to__last_name', output_field=CharField()
+            ),
+            output_field=CharField()
+        ),
+    }
+    
     customer_name = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
     assigned_to_name = serializers.SerializerMethodField()
@@ -57,9 +90,18 @@ class ServiceRequestListSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'request_id', 'title', 'status', 'priority',
             'created_at', 'updated_at', 'customer_name',
-            'category_name', 'assigned_to_name'
+            'category_name', 'assigned_to_name', 'comment_count',
+            'public_comment_count', 'attachment_count', 'last_activity_at'
         ]
     
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if not (request and request.user.is_authenticated and request.user.is_staff_member):
+            # Customers never see internal notes, nor how many there are
+            fields.pop('comment_count', None)
+        return fields
+    
     def get_customer_name(self, obj):
         return f"{obj.customer.first_name} {obj.customer.last_name}"
     
@@ -71,10 +113,37 @@ class ServiceRequestListSerializer(serializers.ModelSerializer):
             return f"{obj.assigned_to.first_name} {obj.assigned_to.last_name}"
         return None
 
-class ServiceRequestDetailSerializer(serializers.ModelSerializer):
+def _detail_comment_limit():
+    return getattr(settings, 'REQUEST_DETAIL_COMMENTS', 20)
+
+def _visible_comments(context):
+    # Customers never see internal notes; get_comments reads the result.
+    # Only the latest comments are fetched, newest first
+    request = context.get('request')
+    comments = RequestComment.objects.select_related('author')
+    if not (request and request.user.is_authenticated and request.user.is_staff_member):
+        comments = comments.filter(is_internal=False)
+    comments = comments.order_by('-created_at', '-id')[:_detail_comment_limit()]
+    return Prefetch('comments', queryset=comments, to_attr='visible_comments')
+
+class ServiceRequestDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Detailed serializer for service request details
     """
+    expandable_fields = ('customer', 'category', 'assigned_to', 'attachments', 'comments', 'status_history')
+    select_related_fields = {
+        'customer': 'customer',
+        'category': 'category',
+        'assigned_to': 'assigned_to',
+    }
+    prefetch_related_fields = {
+        'attachments': Prefetch('attachments', queryset=RequestAttachment.objects.select_related('uploaded_by')),
+        'comments': _visible_comments,
+        'status_history': Prefetch(
+            'status_history', queryset=RequestStatusHistory.objects.select_related('changed_by')
+        ),
+    }
+    
     customer = UserProfileSerializer(read_only=True)
     category = ServiceCategorySerializer(read_only=True)
     assigned_to = UserProfileSerializer(read_only=True)
@@ -94,18 +163,31 @@ class ServiceRequestDetailSerializer(serializers.ModelSerializer):
             'title', 'description', 'status', 'priority',
             'created_at', 'updated_at', 'assigned_to',
             'completed_at', 'service_address', 'gas_meter_id',
+            'due_at', 'sla_breached', 'parent',
             'attachments', 'comments', 'status_history'
         ]
         read_only_fields = [
             'request_id', 'customer', 'created_at', 
-            'updated_at', 'assigned_to', 'completed_at'
+            'updated_at', 'assigned_to', 'completed_at',
+            'due_at', 'sla_breached', 'parent'
         ]
     
     def get_comments(self, obj):
+        """
+        The latest REQUEST_DETAIL_COMMENTS comments, oldest first; the whole
+        thread is paged through the comments action
+        """
         # Filter comments based on user role
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return []
+        limit = _detail_comment_limit()
+        
+        # Already filtered by role when prefetched by the view
+        comments = getattr(obj, 'visible_comments', None)
+        if comments is not None:
+            comments = sorted(comments, key=lambda comment: (comment.created_at, comment.id))[-limit:]
+            return RequestCommentSerializer(comments, many=True).data
         
         # Get all comments for staff, only public comments for customers
         if request.user.is_staff_member:
@@ -113,8 +195,30 @@ class ServiceRequestDetailSerializer(serializers.ModelSerializer):
         else:
             comments = obj.comments.filter(is_internal=False)
         
+        comments = list(comments.select_related('author').order_by('-created_at', '-id')[:limit])[::-1]
         return RequestCommentSerializer(comments, many=True).data
 
+class SyncCommentSerializer(RequestCommentSerializer):
+    """
+    Comment with its request id, for the delta sync feed
+    """
+    class Meta(RequestCommentSerializer.Meta):
+        fields = RequestCommentSerializer.Meta.fields + ['service_request']
+
+class SyncAttachmentSerializer(RequestAttachmentSerializer):
+    """
+    Attachment metadata with its request id, for the delta sync feed
+    """
+    class Meta(RequestAttachmentSerializer.Meta):
+        fields = RequestAttachmentSerializer.Meta.fields + ['service_request']
+
+class SyncStatusHistorySerializer(RequestStatusHistorySerializer):
+    """
+    Status change with its request id, for the delta sync feed
+    """
+    class Meta(RequestStatusHistorySerializer.Meta):
+        fields = RequestStatusHistorySerializer.Meta.fields + ['service_request']
+
 class ServiceRequestCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating new service requests
@@ -128,13 +232,25 @@ class ServiceRequestCreateSerializer(serializers.ModelSerializer):
         model = ServiceRequest
         fields = [
             'category_id', 'title', 'description', 
-            'priority', 'service_address', 'gas_meter_id'
+            'priority', 'service_address', 'gas_meter_id', 'parent'
         ]
+        read_only_fields = ['parent']
     
     def create(self, validated_data):
         # Set the customer to the current user
         request = self.context.get('request')
         validated_data['customer'] = request.user
+        using = database_of(request.user)
+        
+        # Link likely duplicates of a recent report to its incident; only
+        # requests in the customer's shard are linked
+        validated_data['parent_id'] = find_parent(
+            validated_data.get('title', ''),
+            validated_data.get('description', ''),
+            gas_meter_id=validated_data.get('gas_meter_id'),
+            service_address=validated_data.get('service_address'),
+            using=using
+        )
         
-        # Create the service request
-        return super().create(validated_data)
\ No newline at end of file
+        # Create the service request in the customer's shard
+        return ServiceRequest.objects.db_manager(using).create(**validated_data)
\ No newline at end of file
@@ -0,0 +1,656 @@
+# service_requests/sharding.py
+"""
+Region sharding of service requests.
+
+Each customer's requests, with their attachments, comments, status history
+and archive rows, live in one database: the shard of the customer's
+service region (``UserProfile.service_region``, else the ZIP code of their
+service address matched against SERVICE_REGIONS), as mapped by
+REQUEST_SHARDS; customers of unmapped regions stay in ``default``.
+``UserProfile.request_shard`` records where a customer's rows are now, so a
+region can be remapped and its customers moved over with
+``rebalance_shards``.
+
+Users and categories are kept in ``default`` and copied to every shard,
+so joins and foreign keys within a shard keep working. Rows are numbered
+from their database's own id range (ID_RANGE ids per position in
+REQUEST_SHARD_DATABASES), counted in ShardSequence rather than by the
+database's autoincrement, which would continue after the ids of customers
+moved in. Ids therefore stay unique portal-wide, and a moved customer's
+rows keep theirs.
+
+``RequestShardRouter`` sends reads and writes of an instance to its
+database. Queries that are not about one instance pick their database with
+``.using(database_of(customer))``, or use ``scatter()`` to read every
+shard and merge the results in order. With a single database (the default
+configuration) all of this reduces to plain querysets.
+"""
+import copy
+import functools
+import heapq
+import itertools
+import operator
+from collections import Counter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.deletion import ProtectedError
+from django.db.models.expressions import OrderBy
+from django.db.models.query import FlatValuesListIterable, ModelIterable, ValuesIterable, ValuesListIterable
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from accounts.models import UserProfile
+from accounts.normalize import postal_code
+
+from .models import (
+    ArchivedServiceRequest,
+    RequestAttachment,
+    RequestComment,
+    RequestStatusHistory,
+    ServiceCategory,
+    ServiceRequest,
+    ShardSequence,
+)
+
+# Ids per shard database; shard n allocates from n * ID_RANGE
+ID_RANGE = 10 ** 12
+
+# Models stored with their request, parents first
+SHARDED_MODELS = (ServiceRequest, RequestAttachment, RequestComment, RequestStatusHistory, ArchivedServiceRequest)
+CHILD_MODELS = (RequestAttachment, RequestComment, RequestStatusHistory)
+
+# Copied from default to every shard
+REPLICATED_MODELS = (UserProfile, ServiceCategory)
+
+
+def databases():
+    return list(getattr(settings, 'REQUEST_SHARD_DATABASES', [DEFAULT_DB_ALIAS]))
+
+
+def enabled():
+    return len(databases()) > 1
+
+
+def shards():
+    """
+    Request databases other than default
+    """
+    return [alias for alias in databases() if alias != DEFAULT_DB_ALIAS]
+
+
+def is_sharded(model):
+    return model in SHARDED_MODELS
+
+
+def region_for_address(address):
+    """
+    Region whose longest ZIP code prefix matches the last ZIP code in
+    ``address``, or ''
+    """
+    code = postal_code(address)
+    if not code:
+        return ''
+    best, best_length = '', 0
+    for region, prefixes in getattr(settings, 'SERVICE_REGIONS', {}).items():
+        for prefix in prefixes:
+            if code.startswith(prefix) and len(prefix) > best_length:
+                best, best_length = region, len(prefix)
+    return best
+
+
+def region_of(user):
+    return user.service_region or region_for_address(user.service_address or user.address)
+
+
+def home_database(user):
+    """
+    Database the customer's requests belong in according to their region
+    """
+    return getattr(settings, 'REQUEST_SHARDS', {}).get(region_of(user), DEFAULT_DB_ALIAS)
+
+
+def database_of(user):
+    """
+    Database the customer's requests are in now; ``user`` may be an id
+    """
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    if not isinstance(user, UserProfile):
+        user = UserProfile.objects.only('request_shard').get(pk=user)
+    return user.request_shard or DEFAULT_DB_ALIAS
+
+
+def database_of_request(request_id):
+    """
+    Database holding the service request with id ``request_id``, or None
+    """
+    candidates = databases()
+    # Most likely the one whose range the id is in, unless it was moved
+    index = request_id // ID_RANGE
+    if 0 <= index < len(candidates):
+        candidates.insert(0, candidates.pop(index))
+    for alias in candidates:
+        if ServiceRequest.objects.using(alias).filter(pk=request_id).exists():
+            return alias
+    return None
+
+
+def database_for(instance):
+    """
+    Database of a sharded model instance, saved or not
+    """
+    if instance._state.db:
+        return instance._state.db
+    if isinstance(instance, (ServiceRequest, ArchivedServiceRequest)):
+        customer = instance._meta.get_field('customer').get_cached_value(instance, None)
+        if customer is None and instance.customer_id is None:
+            return DEFAULT_DB_ALIAS
+        return database_of(customer if customer is not None else instance.customer_id)
+    service_request = instance._meta.get_field('service_request').get_cached_value(instance, None)
+    if service_request is not None:
+        return database_for(service_request)
+    return database_of_request(instance.service_request_id) or DEFAULT_DB_ALIAS
+
+
+def each(queryset):
+    """
+    ``queryset`` on every request database (its parts if already scattered)
+    """
+    if isinstance(queryset, Scatter):
+        return list(queryset.parts)
+    if not enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in databases()]
+
+
+def scatter(queryset):
+    """
+    ``queryset`` over every request database; unchanged with only one
+    """
+    if isinstance(queryset, Scatter) or not enabled():
+        return queryset
+    return Scatter(each(queryset))
+
+
+def allocate_ids(model, using, count=1):
+    """
+    Reserve ``count`` new ids for ``model`` in database ``using``
+    """
+    table = model._meta.db_table
+    sequences = ShardSequence.objects.using(using)
+    with transaction.atomic(using=using):
+        if not sequences.filter(table=table).update(last_id=F('last_id') + count):
+            base = databases().index(using) * ID_RANGE
+            last = model._base_manager.using(using).filter(
+                pk__gt=base, pk__lte=base + ID_RANGE
+            ).aggregate(last=Max('pk'))['last']
+            sequences.get_or_create(table=table, defaults={'last_id': last or base})
+            sequences.filter(table=table).update(last_id=F('last_id') + count)
+        last = sequences.get(table=table).last_id
+    return range(last - count + 1, last + 1)
+
+
+def assign_ids(model, objs, using):
+    """
+    Number unsaved ``objs`` before a bulk_create into ``using``
+    """
+    objs = [obj for obj in objs if obj.pk is None]
+    if enabled() and objs:
+        for obj, pk in zip(objs, allocate_ids(model, using, len(objs))):
+            obj.pk = pk
+
+
+def count_by(queryset, field):
+    """
+    ``[(value, count), ...]`` of ``queryset`` grouped by ``field``, largest
+    count first, across every request database
+    """
+    counts = Counter()
+    for part in each(queryset):
+        for value, count in part.order_by().values_list(field).annotate(n=Count('pk')):
+            counts[value] += count
+    return counts.most_common()
+
+
+class _SortKey:
+    """
+    Row position in a multi-column ORDER BY, with the database's NULL
+    placement (first when ascending except on PostgreSQL)
+    """
+    __slots__ = ('values', 'descending', 'nulls_first')
+
+    def __init__(self, values, descending, nulls_first):
+        self.values = values
+        self.descending = descending
+        self.nulls_first = nulls_first
+
+    def __lt__(self, other):
+        for a, b, descending in zip(self.values, other.values, self.descending):
+            if a == b:
+                continue
+            if a is None:
+                less = self.nulls_first
+            elif b is None:
+                less = not self.nulls_first
+            else:
+                less = a < b
+            return less != descending
+        return False
+
+
+def _ordering(queryset):
+    query = queryset.query
+    if query.order_by:
+        return list(query.order_by)
+    if query.default_ordering:
+        return list(queryset.model._meta.ordering)
+    return []
+
+
+def _columns(queryset):
+    """
+    Names of the values in each row, in order; None for model instances
+    """
+    iterable = queryset._iterable_class
+    if iterable is ModelIterable:
+        return None
+    query = queryset.query
+    if iterable is not ValuesIterable and queryset._fields:
+        return [*queryset._fields, *(name for name in query.annotation_select if name not in queryset._fields)]
+    return [*query.extra_select, *query.values_select, *query.annotation_select]
+
+
+def _sortable(queryset):
+    """
+    ``(queryset, key, strip)``: ``queryset`` ordered so that every sort
+    value can be read from its rows, with a pk tiebreaker; ``key`` gives a
+    row's sort position and ``strip`` removes the helper columns this added.
+    ``key`` is None when there is no order to merge on.
+    """
+    terms = _ordering(queryset)
+    iterable = queryset._iterable_class
+    if not terms or iterable is FlatValuesListIterable:
+        return queryset, None, None
+    opts = queryset.model._meta
+    pk_names = ('pk', opts.pk.name, opts.pk.attname)
+    if not (isinstance(terms[-1], str) and terms[-1].lstrip('-') in pk_names):
+        terms.append('pk')
+
+    columns = _columns(queryset)
+    order, names, descending, helpers = [], [], [], {}
+    for i, term in enumerate(terms):
+        if isinstance(term, str):
+            desc = term.startswith('-')
+            name = term.lstrip('-')
+            expression = F(name)
+            if name in pk_names:
+                name = opts.pk.attname
+            # Deferred fields would cost a query per row; read a copy instead
+            readable = name == opts.pk.attname if columns is None else name in columns
+        else:
+            desc = isinstance(term, OrderBy) and term.descending
+            expression = term.expression if isinstance(term, OrderBy) else term
+            readable = False
+        if not readable:
+            name = f'_scatter_{i}'
+            helpers[name] = expression
+        order.append(f"{'-' if desc else ''}{name}")
+        names.append(name)
+        descending.append(desc)
+
+    if helpers:
+        queryset = queryset.annotate(**helpers)
+    queryset = queryset.order_by(*order)
+    nulls_first = connections[queryset.db].vendor != 'postgresql'
+    descending = tuple(descending)
+
+    strip = None
+    if columns is None:
+        def value(row, name):
+            return getattr(row, name)
+    elif iterable is ValuesIterable:
+        value = dict.__getitem__
+        if helpers:
+            def strip(row):
+                for name in helpers:
+                    del row[name]
+                return row
+    else:
+        positions = dict(zip(_columns(queryset), itertools.count()))
+
+        def value(row, name):
+            return row[positions[name]]
+        if helpers and iterable is ValuesListIterable:
+            width = len(columns)
+
+            def strip(row):
+                return row[:width]
+
+    def key(row):
+        return _SortKey([value(row, name) for name in names], descending, nulls_first)
+    return queryset, key, strip
+
+
+class Scatter:
+    """
+    Read-only union of one queryset per request database.
+
+    Chaining methods (filter, order_by, values, ...) apply to every part.
+    ``count()``, ``exists()``, ``get()`` and ``aggregate()`` combine the
+    parts; iterating and slicing merge the parts in the queryset's order,
+    with pk as the tiebreaker so pages are stable. ``[a:b]`` reads the first
+    b rows of each part. Flat value lists and unordered querysets are
+    concatenated.
+    """
+    CHAINED = frozenset([
+        'all', 'alias', 'annotate', 'defer', 'distinct', 'exclude', 'filter', 'none', 'only',
+        'order_by', 'prefetch_related', 'select_related', 'values', 'values_list',
+    ])
+
+    ordered = True
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self.model = self.parts[0].model
+
+    def __getattr__(self, name):
+        if name not in self.CHAINED:
+            raise AttributeError(name)
+
+        def chained(*args, **kwargs):
+            return Scatter(getattr(part, name)(*args, **kwargs) for part in self.parts)
+        return chained
+
+    def _rows(self, limit=None):
+        prepared = [_sortable(part) for part in self.parts]
+        querysets = [queryset if limit is None else queryset[:limit] for queryset, _, _ in prepared]
+        _, key, strip = prepared[0]
+        if key is None:
+            return itertools.chain.from_iterable(querysets)
+        rows = heapq.merge(*querysets, key=key)
+        return rows if strip is None else map(strip, rows)
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __len__(self):
+        return self.count()
+
+    def __bool__(self):
+        return self.exists()
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step is not None or (k.start or 0) < 0 or (k.stop is not None and k.stop < 0):
+                raise ValueError('Only forward slices without a step are supported')
+            return list(itertools.islice(self._rows(k.stop), k.start or 0, k.stop))
+        rows = self[k:k + 1]
+        if not rows:
+            raise IndexError(k)
+        return rows[0]
+
+    def count(self):
+        return sum(part.count() for part in self.parts)
+
+    def exists(self):
+        return any(part.exists() for part in self.parts)
+
+    def first(self):
+        rows = self[:1]
+        return rows[0] if rows else None
+
+    def get(self, *args, **kwargs):
+        found = None
+        for part in self.parts:
+            try:
+                obj = part.get(*args, **kwargs)
+            except self.model.DoesNotExist:
+                continue
+            if found is not None:
+                raise self.model.MultipleObjectsReturned(
+                    f'get() returned more than one {self.model._meta.object_name}'
+                )
+            found = obj
+        if found is None:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        return found
+
+    def aggregate(self, **aggregates):
+        """
+        Count, Sum, Min, Max and Avg combined across the parts
+        """
+        query = {}
+        for name, aggregate in aggregates.items():
+            if isinstance(aggregate, Avg):
+                expression = aggregate.get_source_expressions()[0]
+                query[f'{name}__sum'] = Sum(expression, filter=aggregate.filter)
+                query[f'{name}__count'] = Count(expression, filter=aggregate.filter)
+            elif isinstance(aggregate, (Count, Sum, Min, Max)):
+                query[name] = aggregate
+            else:
+                raise TypeError(f'Cannot combine {type(aggregate).__name__} across shards')
+        results = [part.aggregate(**query) for part in self.parts]
+
+        def combine(key, function):
+            values = [result[key] for result in results if result[key] is not None]
+            return function(values) if values else None
+
+        def total(values):
+            # Not sum(): it starts from 0, which cannot be added to a timedelta
+            return functools.reduce(operator.add, values)
+
+        combined = {}
+        for name, aggregate in aggregates.items():
+            if isinstance(aggregate, Avg):
+                value, count = combine(f'{name}__sum', total), combine(f'{name}__count', sum)
+                combined[name] = value / count if count else None
+            elif isinstance(aggregate, Count):
+                combined[name] = combine(name, sum) or 0
+            elif isinstance(aggregate, Sum):
+                combined[name] = combine(name, total)
+            else:
+                combined[name] = combine(name, min if isinstance(aggregate, Min) else max)
+        return combined
+
+
+def insert_raw(model, objs, using):
+    """
+    bulk_create that stores every value as given: a raw insert, like
+    loaddata's, skips auto_now/auto_now_add, save() and signal receivers
+    """
+    fields = model._meta.concrete_fields
+    batch_size = max(connections[using].ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager.using(using)._insert(objs[start:start + batch_size], fields=fields, raw=True)
+
+
+def _customer_rows(customer, using):
+    requests = ServiceRequest.objects.using(using).filter(customer=customer)
+    rows = {ServiceRequest: list(requests)}
+    for model in CHILD_MODELS:
+        rows[model] = list(model.objects.using(using).filter(service_request__customer=customer))
+    rows[ArchivedServiceRequest] = list(ArchivedServiceRequest.objects.using(using).filter(customer=customer))
+    return rows
+
+
+def _fingerprint(customer, using):
+    """
+    Changes whenever a row of the customer's is added or removed or one of
+    their requests is saved
+    """
+    requests = ServiceRequest.objects.using(using).filter(customer=customer)
+    parts = [requests.aggregate(n=Count('pk'), last=Max('updated_at'))]
+    for model in (*CHILD_MODELS, ArchivedServiceRequest):
+        queryset = model.objects.using(using)
+        if model is ArchivedServiceRequest:
+            queryset = queryset.filter(customer=customer)
+        else:
+            queryset = queryset.filter(service_request__customer=customer)
+        parts.append(queryset.aggregate(n=Count('pk'), last=Max('pk')))
+    return parts
+
+
+def _delete_customer_rows(customer, using):
+    # Raw deletes: the rows live on elsewhere, so no receiver may react
+    for model in CHILD_MODELS:
+        model.objects.using(using).filter(service_request__customer=customer)._raw_delete(using)
+    ServiceRequest.objects.using(using).filter(customer=customer)._raw_delete(using)
+    ArchivedServiceRequest.objects.using(using).filter(customer=customer)._raw_delete(using)
+
+
+class MoveConflict(Exception):
+    """
+    The customer's rows changed while they were being copied
+    """
+
+
+def move_customer(customer, target):
+    """
+    Move the customer's requests and everything under them to the
+    ``target`` database; returns the number of requests moved.
+
+    Rows are copied to the target first, then the directory is switched and
+    the source rows deleted in one step that aborts with MoveConflict if the
+    source changed meanwhile; the copy is then discarded by the next try.
+    Duplicate links to requests that stay behind are cleared.
+    """
+    source = database_of(customer)
+    if source == target:
+        return 0
+
+    with transaction.atomic(using=target):
+        # Left over from an earlier attempt that did not finish
+        _delete_customer_rows(customer, target)
+        fingerprint = _fingerprint(customer, source)
+        rows = _customer_rows(customer, source)
+        moving = {r.id for r in rows[ServiceRequest]}
+        parents = {r.parent_id for r in rows[ServiceRequest] if r.parent_id and r.parent_id not in moving}
+        kept = set(ServiceRequest.objects.using(target).filter(id__in=parents).values_list('id', flat=True))
+        for service_request in rows[ServiceRequest]:
+            if service_request.parent_id in parents and service_request.parent_id not in kept:
+                service_request.parent_id = None
+        for model, objs in rows.items():
+            insert_raw(model, objs, target)
+
+    with transaction.atomic(using=source), transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if _fingerprint(customer, source) != fingerprint:
+            raise MoveConflict(f'{customer.username} changed while moving; try again')
+        ServiceRequest.objects.using(source).filter(
+            parent_id__in=moving
+        ).exclude(customer=customer).update(parent=None)
+        _delete_customer_rows(customer, source)
+        customer.request_shard = '' if target == DEFAULT_DB_ALIAS else target
+        customer.save(update_fields=['request_shard'])
+    return len(moving)
+
+
+def misplaced_customers(batch_size=1000):
+    """
+    Customers whose requests are not in their region's database
+    """
+    last_id = 0
+    while True:
+        batch = list(
+            UserProfile.objects.filter(role=UserProfile.CUSTOMER, id__gt=last_id).order_by('id')[:batch_size]
+        )
+        if not batch:
+            return
+        last_id = batch[-1].id
+        for customer in batch:
+            if database_of(customer) != home_database(customer):
+                yield customer
+
+
+def copy_reference_data(using, batch_size=1000):
+    """
+    Copy every user and category from default to ``using``, inserting or
+    overwriting; returns the number of rows copied
+    """
+    copied = 0
+    for model in REPLICATED_MODELS:
+        fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        replicas = model._base_manager.using(using)
+        last_pk = 0
+        while True:
+            batch = list(
+                model._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            existing = set(replicas.filter(pk__in=[obj.pk for obj in batch]).values_list('pk', flat=True))
+            with transaction.atomic(using=using):
+                insert_raw(model, [obj for obj in batch if obj.pk not in existing], using)
+                replicas.bulk_update([obj for obj in batch if obj.pk in existing], fields)
+            copied += len(batch)
+    return copied
+
+
+def _replicate_to(instance, using):
+    replica = copy.copy(instance)
+    replica.save_base(raw=True, using=using)
+
+
+def _replicate(instance):
+    for alias in shards():
+        _replicate_to(instance, alias)
+
+
+def _unreplicate(model, pk):
+    for alias in shards():
+        # Cascades to the customer's requests in that shard, as in default
+        model._base_manager.using(alias).filter(pk=pk).delete()
+
+
+@receiver(pre_save, sender=ServiceRequest)
+@receiver(pre_save, sender=RequestAttachment)
+@receiver(pre_save, sender=RequestComment)
+@receiver(pre_save, sender=RequestStatusHistory)
+def _number(sender, instance, raw=False, using=None, **kwargs):
+    if not raw and instance.pk is None and enabled():
+        instance.pk = allocate_ids(sender, using)[0]
+
+
+@receiver(pre_save, sender=UserProfile)
+def _place_customer(sender, instance, raw=False, using=None, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS or not enabled():
+        return
+    if instance._state.adding and not instance.request_shard:
+        home = home_database(instance)
+        instance.request_shard = '' if home == DEFAULT_DB_ALIAS else home
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_save, sender=ServiceCategory)
+def _replicate_save(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS or not enabled():
+        return
+    # Logins only touch last_login
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: _replicate(instance), using=using)
+
+
+@receiver(pre_delete, sender=ServiceCategory)
+def _protect_category(sender, instance, using=None, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not enabled():
+        return
+    for alias in shards():
+        for model in (ServiceRequest, ArchivedServiceRequest):
+            referenced = model.objects.using(alias).filter(category=instance)
+            if referenced.exists():
+                raise ProtectedError(
+                    f'Cannot delete category {instance}: requests in {alias} refer to it',
+                    set(referenced[:10])
+                )
+
+
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_delete, sender=ServiceCategory)
+def _replicate_delete(sender, instance, using=None, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not enabled():
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: _unreplicate(sender, pk), using=using)
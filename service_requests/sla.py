@@ -0,0 +1,183 @@
+# service_requests/sla.py
+"""
+SLA deadlines for service requests.
+
+Policies are a small table, so they are kept in the SLA_POLICY_CACHE
+cache and cleared whenever a policy is saved or deleted. With a cache
+shared by every worker (Redis, Memcached) that reaches them all at once;
+with the per-process local-memory cache other workers pick the change up
+within SLA_POLICY_CACHE_SECONDS. The breach scanner only
+range-scans ``due_at`` within each open status through the composite SLA
+index, never the whole table.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from gas_utility_portal import metrics
+
+from . import sharding
+from .models import ServiceRequest, SLAEscalation, SLAPolicy
+
+# Resolution targets used when no SLAPolicy matches
+DEFAULT_RESOLUTION_MINUTES = {
+    ServiceRequest.URGENT: 4 * 60,
+    ServiceRequest.HIGH: 24 * 60,
+    ServiceRequest.MEDIUM: 3 * 24 * 60,
+    ServiceRequest.LOW: 7 * 24 * 60,
+}
+
+# One-step priority raise applied to breached requests when escalating
+ESCALATION = {
+    ServiceRequest.LOW: ServiceRequest.MEDIUM,
+    ServiceRequest.MEDIUM: ServiceRequest.HIGH,
+    ServiceRequest.HIGH: ServiceRequest.URGENT,
+}
+
+# Sent once per batch with the ids of requests that were newly flagged
+sla_breached = Signal()
+
+POLICIES_KEY = 'sla:policies'
+
+
+def _cache():
+    return caches[getattr(settings, 'SLA_POLICY_CACHE', 'default')]
+
+
+def _load_policies():
+    cache = _cache()
+    policies = cache.get(POLICIES_KEY)
+    metrics.record_cache('sla_policies', policies is not None)
+    if policies is None:
+        policies = {
+            (category_id, priority): minutes
+            for category_id, priority, minutes in SLAPolicy.objects.values_list(
+                'category_id', 'priority', 'resolution_minutes'
+            )
+        }
+        cache.set(POLICIES_KEY, policies, getattr(settings, 'SLA_POLICY_CACHE_SECONDS', 60))
+    return policies
+
+
+@receiver(post_save, sender=SLAPolicy)
+@receiver(post_delete, sender=SLAPolicy)
+def _invalidate_policies(sender, using=None, **kwargs):
+    cache = _cache()
+    cache.delete(POLICIES_KEY)
+    # Again once committed: a worker may have cached the old rows meanwhile
+    transaction.on_commit(lambda: cache.delete(POLICIES_KEY), using=using)
+
+
+def resolution_minutes(category_id, priority):
+    """
+    Most specific policy wins: category+priority, category, priority, default
+    """
+    policies = _load_policies()
+    for key in ((category_id, priority), (category_id, ''), (None, priority), (None, '')):
+        if key in policies:
+            return policies[key]
+    defaults = getattr(settings, 'SERVICE_REQUEST_SLA_MINUTES', DEFAULT_RESOLUTION_MINUTES)
+    return defaults.get(priority)
+
+
+def compute_due_at(service_request):
+    """
+    Resolution deadline for a request, measured from its creation
+    """
+    minutes = resolution_minutes(service_request.category_id, service_request.priority)
+    if minutes is None:
+        return None
+    start = service_request.created_at or timezone.now()
+    return start + timedelta(minutes=minutes)
+
+
+def open_unbreached():
+    """
+    Open requests with a deadline that have not breached yet; served by
+    the (status, due_at, sla_breached) index
+    """
+    return ServiceRequest.objects.filter(
+        sla_breached=False,
+        status__in=ServiceRequest.OPEN_STATUSES,
+        due_at__isnull=False
+    )
+
+
+def at_risk(within, now=None):
+    """
+    Open requests due within ``within`` that have not yet breached,
+    soonest deadline first
+    """
+    now = now or timezone.now()
+    return sharding.scatter(open_unbreached().filter(
+        due_at__gte=now, due_at__lt=now + within
+    ).order_by('due_at'))
+
+
+def _escalate(using, ids, now):
+    """
+    Raise each request's priority one step, saving it so post_save
+    receivers (emergency subscribers, gauges, sync) see the change, and
+    record an SLAEscalation for it
+    """
+    escalations = []
+    requests = ServiceRequest.objects.using(using).filter(
+        id__in=ids, priority__in=ESCALATION
+    ).select_related('category')
+    with transaction.atomic(using=using):
+        for service_request in requests:
+            previous = service_request.priority
+            service_request.priority = ESCALATION[previous]
+            service_request.is_emergency = (
+                service_request.priority == ServiceRequest.URGENT or service_request.category.is_emergency
+            )
+            service_request.sla_breached = True
+            # Keep the deadline: recomputing it for the new priority would
+            # clear the breach and have the next scan escalate again
+            service_request._loaded_sla_key = (service_request.priority, service_request.category_id)
+            service_request.save(using=using, update_fields=['priority', 'is_emergency', 'sla_breached', 'updated_at'])
+            escalations.append(SLAEscalation(
+                service_request_pk=service_request.pk,
+                previous_priority=previous,
+                new_priority=service_request.priority,
+                escalated_at=now
+            ))
+    SLAEscalation.objects.bulk_create(escalations)
+
+
+def scan_breaches(now=None, batch_size=1000, escalate=False, dry_run=False):
+    """
+    Flag open requests whose deadline has passed, in batches.
+
+    With ``escalate`` each breached request's priority is raised one step
+    through save() and recorded as an SLAEscalation; the deadline is left
+    as it was so the request stays breached. Returns the number of
+    requests flagged.
+    """
+    now = now or timezone.now()
+    flagged = 0
+    for using in sharding.databases():
+        overdue = open_unbreached().using(using).filter(due_at__lt=now).order_by('due_at')
+        scanned = 0
+        while True:
+            # Flagged rows leave the index, so the next batch starts from the front
+            offset = scanned if dry_run else 0
+            ids = list(overdue.values_list('id', flat=True)[offset:offset + batch_size])
+            if not ids:
+                break
+            if not dry_run:
+                if escalate:
+                    _escalate(using, ids, now)
+                # Escalated rows were flagged as they were saved
+                ServiceRequest.objects.using(using).filter(id__in=ids, sla_breached=False).update(
+                    sla_breached=True, updated_at=now
+                )
+                sla_breached.send(sender=ServiceRequest, request_ids=ids, escalated=escalate)
+            scanned += len(ids)
+        flagged += scanned
+    return flagged
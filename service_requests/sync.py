@@ -0,0 +1,267 @@
+# service_requests/sync.py
+"""
+Delta sync for offline-capable field agent clients.
+
+A sync pass covers a time window ``(low, high]`` and returns, for the
+agent's ``assigned_requests``, every request whose ``updated_at`` falls in
+it, every comment, attachment and status-history row created in it, and
+every tombstone recorded for the agent in it. ``high`` trails the clock by
+SYNC_SETTLE_SECONDS so rows stamped inside the window by transactions that
+had not yet committed are not skipped.
+
+Each stream is read as a ``(timestamp, id)`` keyset range on an index, so
+a sync costs O(changes) rather than O(requests). The child streams only
+look at the agent's requests whose ``last_activity_at`` falls after the
+window start, each through its ``(request, timestamp)`` index, rather than
+at everyone's children in the window. Streams are paged; the
+opaque cursor carries the window and each stream's position, and the pass
+ends when a response comes back with ``has_more`` false. Items may refer
+to a request delivered later in the same pass.
+
+Requests that entered the agent's scope during the window also bring their
+older comments, attachments and history. Deleted requests, comments and
+attachments, and requests reassigned away from the agent, come back as
+tombstones. Tombstones are kept for SYNC_TOMBSTONE_RETENTION_DAYS; a cursor
+older than that raises CursorExpired and the client must sync from scratch.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import sharding
+from .models import RequestAttachment, RequestComment, RequestStatusHistory, ServiceRequest, SyncTombstone
+from .serializers import (
+    ServiceRequestDetailSerializer,
+    SyncAttachmentSerializer,
+    SyncCommentSerializer,
+    SyncStatusHistorySerializer,
+)
+
+CURSOR_SALT = 'service_requests.sync'
+
+# Requests are sent flat: children come through their own streams
+REQUEST_FIELDS = ','.join(
+    name for name in ServiceRequestDetailSerializer.Meta.fields
+    if name not in ('attachments', 'comments', 'status_history')
+)
+REQUEST_EXPAND = 'customer,category'
+
+# name -> (model, timestamp field, serializer, related objects to join)
+CHILD_STREAMS = {
+    'comments': (RequestComment, 'created_at', SyncCommentSerializer, ['author']),
+    'attachments': (RequestAttachment, 'uploaded_at', SyncAttachmentSerializer, ['uploaded_by']),
+    'status_history': (RequestStatusHistory, 'changed_at', SyncStatusHistorySerializer, ['changed_by']),
+}
+
+
+class SyncError(Exception):
+    pass
+
+
+class InvalidCursor(SyncError):
+    pass
+
+
+class CursorExpired(SyncError):
+    """
+    Tombstones from the cursor's window have been pruned
+    """
+
+
+def _timestamp(value):
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def _isoformat(value):
+    return None if value is None else value.isoformat()
+
+
+def encode_cursor(low, high=None, positions=None):
+    return signing.dumps({
+        'w': [_isoformat(low), _isoformat(high)],
+        'p': {name: [_isoformat(t), pk] for name, (t, pk) in (positions or {}).items()},
+    }, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """
+    Return ``(low, high, positions)``; high is None between passes
+    """
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+        low, high = (_timestamp(value) for value in data['w'])
+        positions = {name: (_timestamp(t), pk) for name, (t, pk) in data['p'].items()}
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidCursor('cursor must be one returned by this endpoint')
+    return low, high, positions
+
+
+def _window(queryset, field, low, high, position):
+    """
+    Rows of ``queryset`` stamped in ``(low, high]`` after ``position``, in
+    keyset order
+    """
+    queryset = queryset.filter(**{f'{field}__lte': high})
+    if position is not None:
+        stamp, pk = position
+        queryset = queryset.filter(**{f'{field}__gte': stamp}).exclude(**{field: stamp, 'id__lte': pk})
+    elif low is not None:
+        queryset = queryset.filter(**{f'{field}__gt': low})
+    return queryset.order_by(field, 'id')
+
+
+def _page(queryset, field, limit):
+    rows = list(queryset[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    position = (getattr(rows[-1], field), rows[-1].id) if rows else None
+    return rows, position, more
+
+
+def changes(agent, cursor=None, limit=None, context=None):
+    """
+    One page of changes for ``agent`` after ``cursor`` (None for a full sync)
+    """
+    limit = limit or getattr(settings, 'SYNC_PAGE_SIZE', 500)
+    now = timezone.now()
+    if cursor:
+        low, high, positions = decode_cursor(cursor)
+    else:
+        low, high, positions = None, None, {}
+    if low is not None:
+        retention = timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+        if low < now - retention:
+            raise CursorExpired('cursor has expired; sync again without a cursor')
+    if high is None:
+        high = now - timedelta(seconds=getattr(settings, 'SYNC_SETTLE_SECONDS', 2))
+        if low is not None and high < low:
+            high = low
+
+    next_positions = dict(positions)
+    has_more = False
+    data = {}
+
+    # Requests
+    # Assigned requests may be in any shard
+    queryset = sharding.scatter(ServiceRequestDetailSerializer.optimize_queryset(
+        ServiceRequest.objects.filter(assigned_to=agent), fields=REQUEST_FIELDS, expand=REQUEST_EXPAND
+    ))
+    requests, position, more = _page(
+        _window(queryset, 'updated_at', low, high, positions.get('requests')), 'updated_at', limit
+    )
+    has_more |= more
+    if position:
+        next_positions['requests'] = position
+    data['requests'] = ServiceRequestDetailSerializer(
+        requests, many=True, fields=REQUEST_FIELDS, expand=REQUEST_EXPAND, context=context or {}
+    ).data
+
+    # Requests new to the agent bring children the streams already passed
+    entered = [
+        r.id for r in requests
+        if low is not None and r.assigned_at is not None and low < r.assigned_at <= high
+    ]
+
+    # A child stamped in the window touched its request's last_activity_at
+    # no earlier, so the streams only probe the agent's recently active
+    # requests, each through its (request, timestamp) index
+    active = ServiceRequest.objects.filter(assigned_to=agent)
+    if low is not None:
+        active = active.filter(last_activity_at__gt=low)
+    for name, (model, field, serializer_class, related) in CHILD_STREAMS.items():
+        queryset = sharding.scatter(
+            model.objects.filter(service_request__in=active.values('id')).select_related(*related)
+        )
+        rows, position, more = _page(
+            _window(queryset, field, low, high, positions.get(name)), field, limit
+        )
+        has_more |= more
+        if position:
+            next_positions[name] = position
+        if entered:
+            seen = {row.id for row in rows}
+            rows += [
+                row for row in sharding.scatter(model.objects.filter(
+                    service_request_id__in=entered, **{f'{field}__lte': high}
+                ).select_related(*related).order_by(field, 'id'))
+                if row.id not in seen
+            ]
+        data[name] = serializer_class(rows, many=True, context=context or {}).data
+
+    # Tombstones; nothing to delete on a full sync
+    deleted = []
+    if low is not None:
+        tombstones, position, more = _page(
+            _window(agent.sync_tombstones.all(), 'deleted_at', low, high, positions.get('deleted')),
+            'deleted_at', limit
+        )
+        has_more |= more
+        if position:
+            next_positions['deleted'] = position
+        # A request reassigned away and back again is still the agent's
+        removed = [t.object_id for t in tombstones if t.object_type == SyncTombstone.REQUEST]
+        returned = set(sharding.scatter(
+            ServiceRequest.objects.filter(assigned_to=agent, id__in=removed).values_list('id', flat=True)
+        )) if removed else set()
+        deleted = [
+            {'type': t.object_type, 'id': t.object_id, 'service_request': t.service_request_pk}
+            for t in tombstones
+            if not (t.object_type == SyncTombstone.REQUEST and t.object_id in returned)
+        ]
+    data['deleted'] = deleted
+
+    if has_more:
+        cursor = encode_cursor(low, high, next_positions)
+    else:
+        cursor = encode_cursor(high)
+    return {'cursor': cursor, 'has_more': has_more, **data}
+
+
+def prune_tombstones(now=None):
+    """
+    Delete tombstones older than the retention period; returns the count
+    """
+    now = now or timezone.now()
+    retention = timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=now - retention).delete()
+    return deleted
+
+
+def _tombstone(agent_id, object_type, object_id, service_request_pk):
+    SyncTombstone.objects.create(
+        agent_id=agent_id,
+        object_type=object_type,
+        object_id=object_id,
+        service_request_pk=service_request_pk
+    )
+
+
+@receiver(post_save, sender=ServiceRequest)
+def _track_reassignment(sender, instance, **kwargs):
+    previous_agent_id = instance.__dict__.pop('_reassigned_from', None)
+    if previous_agent_id:
+        _tombstone(previous_agent_id, SyncTombstone.REQUEST, instance.pk, instance.pk)
+
+
+@receiver(post_delete, sender=ServiceRequest)
+def _track_request_delete(sender, instance, **kwargs):
+    if instance.assigned_to_id:
+        _tombstone(instance.assigned_to_id, SyncTombstone.REQUEST, instance.pk, instance.pk)
+
+
+@receiver(post_delete, sender=RequestComment)
+@receiver(post_delete, sender=RequestAttachment)
+def _track_child_delete(sender, instance, origin=None, using=None, **kwargs):
+    # Children deleted along with their request are covered by its tombstone
+    if getattr(origin, 'model', type(origin)) is ServiceRequest:
+        return
+    agent_id = ServiceRequest.objects.using(using).filter(
+        pk=instance.service_request_id
+    ).values_list('assigned_to_id', flat=True).first()
+    if agent_id:
+        object_type = SyncTombstone.COMMENT if sender is RequestComment else SyncTombstone.ATTACHMENT
+        _tombstone(agent_id, object_type, instance.pk, instance.service_request_id)
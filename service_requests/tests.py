@@ -1,3 +1,995 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Avg, DurationField, ExpressionWrapper, F, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from accounts.models import UserProfile
+from gas_utility_portal import metrics as gauges
+from gas_utility_portal.compiled_serializers import CompiledSerializer, compile_serializer
+from . import archive, assignment, duplicates, emergency, geo, sharding, sla, sync, workflow
+from . import activity
+from . import metrics as domain_metrics
+from .models import (
+    ArchivedServiceRequest,
+    RequestAttachment,
+    RequestComment,
+    RequestStatusHistory,
+    ServiceCategory,
+    ServiceRequest,
+    SLAEscalation,
+    SLAPolicy,
+    SyncTombstone,
+)
+from .serializers import ServiceRequestDetailSerializer, ServiceRequestListSerializer
+
+
+class CompiledListSerializationTests(TestCase):
+    """
+    The compiled list path must render exactly what the serializer renders
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = UserProfile.objects.create_user(
+            'manager', password='pass', role=UserProfile.MANAGER, first_name='Mia', last_name='Stone'
+        )
+        customers = [
+            UserProfile.objects.create_user('c1', password='pass', first_name='Zoë', last_name='Ünal'),
+            UserProfile.objects.create_user('c2', password='pass', first_name='Ann', last_name=''),
+            UserProfile.objects.create_user('c3', password='pass', first_name='', last_name='"Quoted" \\ name'),
+        ]
+        agent = UserProfile.objects.create_user(
+            'agent', password='pass', role=UserProfile.SUPPORT_AGENT, first_name='Al', last_name='Ng'
+        )
+        categories = [
+            ServiceCategory.objects.create(name='Gas Leak', slug='gas-leak'),
+            ServiceCategory.objects.create(name='Billing – ünïcode', slug='billing'),
+        ]
+        statuses = [code for code, _ in ServiceRequest.STATUS_CHOICES]
+        priorities = [code for code, _ in ServiceRequest.PRIORITY_CHOICES]
+        for i in range(24):
+            ServiceRequest.objects.create(
+                customer=customers[i % len(customers)],
+                category=categories[i % len(categories)],
+                title=f'Request {i} <leak>',
+                description='Smell of gas',
+                status=statuses[i % len(statuses)],
+                priority=priorities[i % len(priorities)],
+                assigned_to=agent if i % 3 else None,
+            )
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def serializer_bytes(self, queryset, **kwargs):
+        return self.render(ServiceRequestListSerializer(queryset, many=True, **kwargs).data)
+
+    def compiled_bytes(self, queryset, **kwargs):
+        compiled = CompiledSerializer(ServiceRequestListSerializer(**kwargs))
+        return self.render(compiled.encode(compiled.values(queryset)))
+
+    def test_rows_match_serializer(self):
+        queryset = ServiceRequest.objects.order_by('-created_at')
+        self.assertEqual(self.compiled_bytes(queryset), self.serializer_bytes(queryset))
+
+    def test_sparse_fields_match_serializer(self):
+        queryset = ServiceRequest.objects.order_by('id')
+        for fields in ('id,title', 'assigned_to_name,status', 'created_at,customer_name,category_name'):
+            with self.subTest(fields=fields):
+                self.assertEqual(
+                    self.compiled_bytes(queryset, fields=fields),
+                    self.serializer_bytes(queryset, fields=fields)
+                )
+
+    def test_nested_serializer_is_not_compiled(self):
+        self.assertIsNone(compile_serializer(ServiceRequestDetailSerializer()))
+
+    def test_list_endpoint_is_identical(self):
+        self.client.force_login(self.manager)
+        for query in ('', '?page=2', '?search=leak&ordering=priority', '?fields=id,customer_name'):
+            with self.subTest(query=query):
+                url = f'/api/service-requests/requests/{query}'
+                with override_settings(API_COMPILED_LIST_SERIALIZATION=False):
+                    expected = self.client.get(url)
+                actual = self.client.get(url)
+                self.assertEqual(actual.status_code, 200)
+                self.assertEqual(actual.content, expected.content)
+
+
+class CommentThreadTests(TestCase):
+    """
+    Threads follow creation order even where ids do not, as after a move
+    between shard databases
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.service_request = ServiceRequest.objects.create(
+            customer=cls.customer, category=ServiceCategory.objects.create(name='Meter', slug='meter'),
+            title='Meter reading', description='Too high'
+        )
+        start = timezone.now() - timedelta(hours=1)
+        # Newer comments get lower ids
+        cls.comments = []
+        for n, pk in enumerate((900, 800, 700, 600, 500)):
+            RequestComment.objects.create(
+                id=pk, service_request=cls.service_request, author=cls.customer, text=f'Comment {n}'
+            )
+            RequestComment.objects.filter(pk=pk).update(created_at=start + timedelta(minutes=n))
+            cls.comments.append(pk)
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+        self.url = f'/api/service-requests/requests/{self.service_request.id}/comments/'
+
+    def test_pages_follow_creation_order(self):
+        seen = []
+        url = self.url + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [comment['id'] for comment in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, self.comments)
+
+    def test_since_comment_id_returns_later_comments(self):
+        response = self.client.get(self.url, {'since': self.comments[1]})
+        self.assertEqual([comment['id'] for comment in response.data['results']], self.comments[2:])
+
+    def test_since_rejects_unknown_ids_and_impossible_dates(self):
+        for since in ('12345', '2024-13-45T00:00:00', '9' * 30):
+            with self.subTest(since=since):
+                self.assertEqual(self.client.get(self.url, {'since': since}).status_code, 400)
+
+
+class WorkflowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agent = UserProfile.objects.create_user('agent', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.manager = UserProfile.objects.create_user('manager', password='pass', role=UserProfile.MANAGER)
+        cls.superuser = UserProfile.objects.create_superuser('root', password='pass')
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def create(self, status=ServiceRequest.NEW):
+        return ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            status=status
+        )
+
+    def history(self, service_request):
+        return list(RequestStatusHistory.objects.filter(service_request=service_request).values_list(
+            'previous_status', 'new_status', 'changed_by', 'comment'
+        ))
+
+    def test_allowed_transitions(self):
+        self.assertEqual(
+            workflow.allowed_targets(ServiceRequest.COMPLETED),
+            {ServiceRequest.CLOSED, ServiceRequest.IN_PROGRESS}
+        )
+        self.assertEqual(workflow.allowed_targets(ServiceRequest.CLOSED, UserProfile.SUPPORT_AGENT), set())
+        workflow.check_transition(ServiceRequest.NEW, ServiceRequest.ASSIGNED, self.agent)
+        workflow.check_transition(ServiceRequest.CLOSED, ServiceRequest.IN_PROGRESS, self.manager)
+
+    def test_forbidden_transitions(self):
+        for current, new in (
+            (ServiceRequest.NEW, ServiceRequest.COMPLETED),
+            (ServiceRequest.CLOSED, ServiceRequest.CANCELLED),
+            (ServiceRequest.NEW, 'reopened'),
+        ):
+            with self.subTest(current=current, new=new):
+                with self.assertRaises(workflow.InvalidTransition):
+                    workflow.check_transition(current, new, self.manager)
+
+    def test_role_restrictions(self):
+        with self.assertRaises(workflow.TransitionNotPermitted):
+            workflow.check_transition(ServiceRequest.CLOSED, ServiceRequest.IN_PROGRESS, self.agent)
+        with self.assertRaises(workflow.TransitionNotPermitted):
+            workflow.check_transition(ServiceRequest.NEW, ServiceRequest.ASSIGNED, self.customer)
+        # Superusers act as admins whatever their role
+        workflow.check_transition(ServiceRequest.CANCELLED, ServiceRequest.NEW, self.superuser)
+
+    def test_transition_records_history(self):
+        service_request = self.create(ServiceRequest.IN_PROGRESS)
+        sent = []
+        workflow.status_changed.connect(
+            lambda **kwargs: sent.append(kwargs['new_status']), weak=False, dispatch_uid='workflow-test'
+        )
+        self.addCleanup(workflow.status_changed.disconnect, dispatch_uid='workflow-test')
+        with self.captureOnCommitCallbacks(execute=True):
+            workflow.transition(service_request, ServiceRequest.COMPLETED, self.agent, 'Meter replaced')
+        self.assertEqual(sent, [ServiceRequest.COMPLETED])
+        service_request.refresh_from_db()
+        self.assertEqual(service_request.status, ServiceRequest.COMPLETED)
+        self.assertIsNotNone(service_request.completed_at)
+        self.assertEqual(
+            self.history(service_request),
+            [(ServiceRequest.IN_PROGRESS, ServiceRequest.COMPLETED, self.agent.id, 'Meter replaced')]
+        )
+
+    def test_change_status_api(self):
+        service_request = self.create(ServiceRequest.CLOSED)
+        url = f'/api/service-requests/requests/{service_request.id}/change_status/'
+        for user, new_status, code in (
+            (self.customer, ServiceRequest.IN_PROGRESS, 403),
+            (self.agent, ServiceRequest.IN_PROGRESS, 403),
+            (self.manager, ServiceRequest.CANCELLED, 400),
+            (self.manager, ServiceRequest.IN_PROGRESS, 200),
+        ):
+            with self.subTest(user=user.username, status=new_status):
+                self.client.force_login(user)
+                self.assertEqual(self.client.post(url, {'status': new_status}).status_code, code)
+        self.assertEqual(len(self.history(service_request)), 1)
+
+    def test_bulk_transition_skips_disallowed_sources(self):
+        movable = [self.create(ServiceRequest.NEW), self.create(ServiceRequest.ON_HOLD)]
+        stuck = [self.create(ServiceRequest.CLOSED), self.create(ServiceRequest.CANCELLED)]
+        with self.captureOnCommitCallbacks(execute=True):
+            changed, skipped = workflow.bulk_transition(
+                ServiceRequest.objects.all(), ServiceRequest.CANCELLED, self.agent, 'Duplicate'
+            )
+        self.assertEqual((changed, skipped), (2, 2))
+        for service_request, previous in zip(movable, (ServiceRequest.NEW, ServiceRequest.ON_HOLD)):
+            service_request.refresh_from_db()
+            self.assertEqual(service_request.status, ServiceRequest.CANCELLED)
+            self.assertEqual(
+                self.history(service_request),
+                [(previous, ServiceRequest.CANCELLED, self.agent.id, 'Duplicate')]
+            )
+        for service_request in stuck:
+            self.assertEqual(self.history(service_request), [])
+
+    def test_bulk_transition_respects_roles(self):
+        self.create(ServiceRequest.CLOSED)
+        queryset = ServiceRequest.objects.all()
+        self.assertEqual(workflow.bulk_transition(queryset, ServiceRequest.IN_PROGRESS, self.agent), (0, 1))
+        self.assertEqual(workflow.bulk_transition(queryset, ServiceRequest.IN_PROGRESS, self.manager), (1, 0))
+        with self.assertRaises(workflow.InvalidTransition):
+            workflow.bulk_transition(queryset, 'reopened', self.manager)
+
+    def test_admin_action(self):
+        completed, new = self.create(ServiceRequest.COMPLETED), self.create(ServiceRequest.NEW)
+        self.client.force_login(self.superuser)
+        response = self.client.post('/admin/service_requests/servicerequest/', {
+            'action': 'mark_closed', '_selected_action': [completed.id, new.id],
+        }, follow=True)
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['1 request(s) moved to Closed.', '1 request(s) skipped: transition not allowed from their current status.']
+        )
+        self.assertEqual(
+            self.history(completed),
+            [(ServiceRequest.COMPLETED, ServiceRequest.CLOSED, self.superuser.id,
+              'Status changed to closed via admin bulk action')]
+        )
+
+    def test_admin_form_rejects_disallowed_transition(self):
+        service_request = self.create(ServiceRequest.NEW)
+        request = RequestFactory().get('/')
+        request.user = self.agent
+        form_class = site._registry[ServiceRequest].get_form(request, service_request)
+        data = {
+            'customer': self.customer.id, 'category': self.category.id, 'title': 'Meter reading',
+            'description': 'Too high', 'priority': service_request.priority,
+        }
+        form = form_class(data={**data, 'status': ServiceRequest.COMPLETED}, instance=service_request)
+        self.assertIn('status', form.errors)
+        form = form_class(data={**data, 'status': ServiceRequest.ASSIGNED}, instance=service_request)
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class AgentLoadBalancerTests(SimpleTestCase):
+    def test_least_loaded_agent_up_to_capacity(self):
+        balancer = assignment.AgentLoadBalancer([(1, 0, ()), (2, 1, ())], capacity=2)
+        self.assertEqual([balancer.choose(None, ServiceRequest.LOW) for _ in range(4)], [1, 2, 1, None])
+        self.assertEqual(balancer.loads, {1: 2, 2: 2})
+
+    def test_high_priorities_overflow(self):
+        balancer = assignment.AgentLoadBalancer([(1, 3, ())], capacity=3)
+        self.assertIsNone(balancer.choose(None, ServiceRequest.MEDIUM))
+        self.assertEqual(balancer.choose(None, ServiceRequest.URGENT), 1)
+        self.assertEqual(balancer.loads[1], 4)
+
+    def test_skilled_agents_first_then_anyone(self):
+        balancer = assignment.AgentLoadBalancer([(1, 4, [10]), (2, 0, ())], capacity=5)
+        self.assertEqual(balancer.choose(10, ServiceRequest.LOW), 1)
+        # Skilled agent at capacity
+        self.assertEqual(balancer.choose(10, ServiceRequest.LOW), 2)
+        self.assertEqual(balancer.choose(99, ServiceRequest.LOW), 2)
+
+    def test_adjust(self):
+        balancer = assignment.AgentLoadBalancer([(1, 1, ()), (2, 0, ())], capacity=5)
+        balancer.adjust(2, 3)
+        balancer.adjust(1, -5)
+        self.assertEqual(balancer.loads, {1: 0, 2: 3})
+        self.assertEqual(balancer.choose(None, ServiceRequest.LOW), 1)
+
+
+@override_settings(SERVICE_REQUEST_AGENT_CAPACITY=1)
+class AssignBacklogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agents = [
+            UserProfile.objects.create_user(f'agent{n}', password='pass', role=UserProfile.SUPPORT_AGENT)
+            for n in range(2)
+        ]
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def setUp(self):
+        assignment.reset_balancer()
+        self.addCleanup(assignment.reset_balancer)
+
+    def create(self, priority):
+        return ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            priority=priority
+        )
+
+    def test_most_urgent_first_within_capacity(self):
+        low, urgent, medium = [
+            self.create(priority) for priority in (ServiceRequest.LOW, ServiceRequest.URGENT, ServiceRequest.MEDIUM)
+        ]
+        with mock.patch('service_requests.emergency._wake') as wake:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(assignment.assign_backlog(), (2, 1))
+        wake.assert_called_once()
+        for service_request in (low, urgent, medium):
+            service_request.refresh_from_db()
+        self.assertIsNone(low.assigned_to_id)
+        self.assertEqual({urgent.assigned_to_id, medium.assigned_to_id}, {agent.id for agent in self.agents})
+        for service_request in (urgent, medium):
+            self.assertIsNotNone(service_request.assigned_at)
+            self.assertIsNotNone(service_request.first_assigned_at)
+
+    def test_roster_changes_rebuild_the_loads(self):
+        balancer = assignment.get_balancer()
+        self.customer.first_name = 'Changed'
+        self.customer.save()
+        self.agents[0].set_password('another-pass-456')
+        self.agents[0].save(update_fields=['password'])
+        self.assertIs(assignment.get_balancer(), balancer)
+        self.agents[0].is_active = False
+        self.agents[0].save()
+        self.assertEqual(set(assignment.get_balancer().loads), {self.agents[1].id})
+
+    @override_settings(SERVICE_REQUEST_BALANCER_TTL_SECONDS=0)
+    def test_loads_are_rebuilt_when_old(self):
+        balancer = assignment.get_balancer()
+        self.create(ServiceRequest.LOW)
+        ServiceRequest.objects.update(assigned_to=self.agents[0])
+        self.assertIsNot(assignment.get_balancer(), balancer)
+        self.assertEqual(assignment.get_balancer().loads[self.agents[0].id], 1)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agent = UserProfile.objects.create_user('agent', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.other = UserProfile.objects.create_user('other', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def setUp(self):
+        self.client.force_login(self.agent)
+
+    def create(self, agent):
+        return ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            assigned_to=agent
+        )
+
+    def comment(self, service_request, text='Any news?'):
+        return RequestComment.objects.create(service_request=service_request, author=self.customer, text=text)
+
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/api/service-requests/requests/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, rows):
+        return [row['id'] for row in rows]
+
+    def test_full_sync_then_changes_only(self):
+        mine, theirs = self.create(self.agent), self.create(self.other)
+        first = self.comment(mine)
+        self.comment(theirs)
+        full = self.sync()
+        self.assertEqual(self.ids(full['requests']), [mine.id])
+        self.assertEqual(self.ids(full['comments']), [first.id])
+        self.assertFalse(full['has_more'])
+
+        second = self.comment(mine)
+        self.comment(theirs)
+        delta = self.sync(full['cursor'])
+        self.assertEqual(self.ids(delta['comments']), [second.id])
+        self.assertEqual(delta['requests'], [])
+        self.assertEqual(self.sync(delta['cursor'])['comments'], [])
+
+    def test_paging(self):
+        service_request = self.create(self.agent)
+        cursor = self.sync()['cursor']
+        comments = [self.comment(service_request, f'Comment {n}') for n in range(3)]
+        page = self.sync(cursor, limit=2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(self.ids(page['comments']), [comment.id for comment in comments[:2]])
+        # Made during the pass: left for the next one
+        late = self.comment(service_request)
+        page = self.sync(page['cursor'], limit=2)
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self.ids(page['comments']), [comments[2].id])
+        self.assertEqual(self.ids(self.sync(page['cursor'])['comments']), [late.id])
+
+    def test_tombstones(self):
+        kept, moved = self.create(self.agent), self.create(self.agent)
+        comment = self.comment(kept)
+        comment_id = comment.id
+        cursor = self.sync()['cursor']
+        comment.delete()
+        moved.assigned_to = self.other
+        moved.save()
+        deleted = self.sync(cursor)['deleted']
+        self.assertCountEqual(deleted, [
+            {'type': 'comment', 'id': comment_id, 'service_request': kept.id},
+            {'type': 'request', 'id': moved.id, 'service_request': moved.id},
+        ])
+
+    def test_reassigned_away_and_back(self):
+        service_request = self.create(self.other)
+        comment = self.comment(service_request)
+        cursor = self.sync()['cursor']
+        for agent in (self.agent, self.other, self.agent):
+            service_request.assigned_to = agent
+            service_request.save()
+        delta = self.sync(cursor)
+        self.assertEqual(delta['deleted'], [])
+        self.assertEqual(self.ids(delta['requests']), [service_request.id])
+        # Entered the agent's scope: older comments come along
+        self.assertEqual(self.ids(delta['comments']), [comment.id])
+
+    def test_activity_time_never_moves_back(self):
+        service_request = self.create(self.agent)
+        self.comment(service_request)
+        service_request.refresh_from_db()
+        latest = service_request.last_activity_at
+        # A comment stamped earlier but committed later
+        activity._adjust('default', service_request.id, 1, comments=1, when=latest - timedelta(minutes=5))
+        service_request.refresh_from_db()
+        self.assertEqual(service_request.last_activity_at, latest)
+
+    def test_bad_cursors(self):
+        self.assertEqual(
+            self.client.get('/api/service-requests/requests/changes/', {'cursor': 'junk'}).status_code, 400
+        )
+        expired = sync.encode_cursor(timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS + 1))
+        self.assertEqual(
+            self.client.get('/api/service-requests/requests/changes/', {'cursor': expired}).status_code, 410
+        )
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agent = UserProfile.objects.create_user('agent', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def finished(self, status=ServiceRequest.CLOSED, **fields):
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            status=status, assigned_to=self.agent, **fields
+        )
+        RequestComment.objects.create(service_request=service_request, author=self.customer, text='Any news?')
+        RequestComment.objects.create(
+            service_request=service_request, author=self.agent, text='Checked', is_internal=True
+        )
+        RequestAttachment.objects.create(
+            service_request=service_request, file='request_attachments/meter.jpg', file_name='meter.jpg',
+            uploaded_by=self.customer
+        )
+        RequestStatusHistory.objects.create(
+            service_request=service_request, previous_status=ServiceRequest.NEW, new_status=status,
+            changed_by=self.agent
+        )
+        return service_request
+
+    def age(self):
+        ServiceRequest.objects.update(last_activity_at=timezone.now() - timedelta(days=400))
+
+    def test_round_trip(self):
+        service_request = self.finished()
+        self.age()
+        service_request.refresh_from_db()
+        before = archive._dump(service_request)
+        comments = set(RequestComment.objects.values_list('id', flat=True))
+
+        self.assertEqual(archive.archive(), 1)
+        self.assertFalse(ServiceRequest.objects.exists())
+        self.assertFalse(RequestComment.objects.exists())
+        self.assertFalse(RequestAttachment.objects.exists())
+        self.assertTrue(SyncTombstone.objects.filter(
+            agent=self.agent, object_type=SyncTombstone.REQUEST, object_id=service_request.id
+        ).exists())
+
+        archived = ArchivedServiceRequest.objects.get()
+        built = archive.materialize(archived, self.customer)
+        self.assertEqual(built.title, 'Meter reading')
+        self.assertEqual(len(built.comments.all()), 2)
+        self.assertEqual([comment.text for comment in built.visible_comments], ['Any news?'])
+        self.client.force_login(self.customer)
+        response = self.client.get(f'/api/service-requests/requests/{service_request.id}/')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(archive.restore(ArchivedServiceRequest.objects.all()), 1)
+        self.assertFalse(ArchivedServiceRequest.objects.exists())
+        restored = ServiceRequest.objects.get()
+        # Recomputed from the restored children
+        after = archive._dump(restored)
+        for values in (before, after):
+            values.pop('last_activity_at')
+        self.assertEqual(after, before)
+        self.assertEqual(set(RequestComment.objects.values_list('id', flat=True)), comments)
+        self.assertEqual(RequestAttachment.objects.count(), 1)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def queries():
+            self.age()
+            with CaptureQueriesContext(connection) as captured:
+                archive.archive()
+            return len(captured)
+
+        self.finished()
+        one = queries()
+        for _ in range(5):
+            self.finished()
+        self.assertEqual(queries(), one)
+        self.assertEqual(ArchivedServiceRequest.objects.count(), 6)
+
+    def test_parent_waits_for_its_duplicates_and_comes_back_with_them(self):
+        parent = self.finished()
+        duplicate = self.finished(status=ServiceRequest.NEW, parent=parent)
+        self.age()
+        self.assertEqual(archive.archive(), 0)
+
+        ServiceRequest.objects.filter(pk=duplicate.pk).update(status=ServiceRequest.CANCELLED)
+        self.assertEqual(archive.archive(), 2)
+
+        self.assertEqual(archive.restore(ArchivedServiceRequest.objects.filter(pk=duplicate.pk)), 2)
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.parent_id, parent.id)
+        self.assertFalse(ArchivedServiceRequest.objects.exists())
+
+
+class ActivityCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        category = ServiceCategory.objects.create(name='Meter', slug='meter')
+        cls.service_request = ServiceRequest.objects.create(
+            customer=cls.customer, category=category, title='Meter reading', description='Too high'
+        )
+
+    def counts(self):
+        self.service_request.refresh_from_db()
+        return self.service_request.comment_count, self.service_request.public_comment_count
+
+    def comment(self, **fields):
+        return RequestComment.objects.create(
+            service_request=self.service_request, author=self.customer, text='Any news?', **fields
+        )
+
+    def test_comments_are_counted(self):
+        self.comment()
+        internal = self.comment(is_internal=True)
+        self.assertEqual(self.counts(), (2, 1))
+        internal.delete()
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_deleting_uncounted_comments_stops_at_zero(self):
+        RequestComment.objects.bulk_create([
+            RequestComment(service_request=self.service_request, author=self.customer, text='Loaded')
+        ])
+        self.assertEqual(self.counts(), (0, 0))
+        RequestComment.objects.get().delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_recount_repairs_drift(self):
+        RequestComment.objects.bulk_create([
+            RequestComment(service_request=self.service_request, author=self.customer, text='Loaded')
+        ])
+        activity.recount(ServiceRequest.objects.filter(pk=self.service_request.pk))
+        self.assertEqual(self.counts(), (1, 1))
+
+
+class EmergencyQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = UserProfile.objects.create_user('manager', password='pass', role=UserProfile.MANAGER)
+        category = ServiceCategory.objects.create(name='Gas Leak', slug='gas-leak', is_emergency=True)
+        cls.service_request = ServiceRequest.objects.create(
+            customer=cls.manager, category=category, title='Smell of gas', description='Kitchen'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+        self.url = '/api/service-requests/requests/emergency_queue/'
+
+    @override_settings(EMERGENCY_QUEUE_SETTLE_SECONDS=0)
+    def test_changes_include_requests_that_left_the_queue(self):
+        cursor = self.client.get(self.url).data['cursor']
+        ServiceRequest.objects.filter(pk=self.service_request.pk).update(
+            status=ServiceRequest.CANCELLED, updated_at=timezone.now()
+        )
+        response = self.client.get(self.url, {'since': cursor.isoformat()})
+        self.assertEqual(
+            [(entry['id'], entry['status']) for entry in response.data['results']],
+            [(self.service_request.id, ServiceRequest.CANCELLED)]
+        )
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+    def test_change_committed_after_the_cursor_is_reported(self):
+        now = timezone.now()
+        with mock.patch('service_requests.emergency.timezone') as clock:
+            clock.now.return_value = now
+            cursor, _ = emergency.wait_for_changes(now - timedelta(hours=1), 0)
+            # Stamped before that poll's query, committed after it
+            ServiceRequest.objects.filter(pk=self.service_request.pk).update(
+                priority=ServiceRequest.URGENT, updated_at=now - timedelta(seconds=1)
+            )
+            clock.now.return_value = now + timedelta(seconds=10)
+            _, changed = emergency.wait_for_changes(cursor, 0)
+        self.assertEqual([service_request.id for service_request in changed], [self.service_request.id])
+
+    def test_wait_is_capped(self):
+        cursor = self.client.get(self.url).data['cursor']
+        with mock.patch('service_requests.emergency.wait_for_changes', return_value=(cursor, [])) as wait:
+            self.client.get(self.url, {'since': cursor.isoformat(), 'wait': 600})
+        self.assertEqual(wait.call_args.args[1], settings.EMERGENCY_QUEUE_MAX_WAIT_SECONDS)
+
+    def test_impossible_cursor_is_refused(self):
+        self.assertEqual(self.client.get(self.url, {'since': '2024-13-45T00:00:00'}).status_code, 400)
+
+
+class SLATests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def setUp(self):
+        cache.delete(sla.POLICIES_KEY)
+
+    def create(self, priority, overdue=True, **fields):
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high',
+            priority=priority, **fields
+        )
+        if overdue:
+            ServiceRequest.objects.filter(pk=service_request.pk).update(due_at=timezone.now() - timedelta(hours=1))
+        service_request.refresh_from_db()
+        return service_request
+
+    def test_only_overdue_open_requests_are_flagged(self):
+        overdue = [self.create(ServiceRequest.LOW) for _ in range(3)]
+        upcoming = self.create(ServiceRequest.LOW, overdue=False)
+        closed = self.create(ServiceRequest.LOW, status=ServiceRequest.CLOSED)
+        self.assertEqual(sla.scan_breaches(batch_size=2, dry_run=True), 3)
+        self.assertFalse(ServiceRequest.objects.filter(sla_breached=True).exists())
+        with mock.patch.object(sla.sla_breached, 'send') as sent:
+            self.assertEqual(sla.scan_breaches(batch_size=2), 3)
+        self.assertEqual(sent.call_count, 2)
+        self.assertEqual(
+            set(ServiceRequest.objects.filter(sla_breached=True).values_list('id', flat=True)),
+            {service_request.id for service_request in overdue}
+        )
+        self.assertNotIn(upcoming.id, sent.call_args.kwargs['request_ids'])
+        self.assertNotIn(closed.id, sent.call_args.kwargs['request_ids'])
+        self.assertEqual(sla.scan_breaches(), 0)
+
+    def test_escalation_is_saved_and_recorded(self):
+        high = self.create(ServiceRequest.HIGH)
+        urgent = self.create(ServiceRequest.URGENT)
+        with mock.patch('service_requests.emergency._wake') as wake:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(sla.scan_breaches(escalate=True), 2)
+        wake.assert_called()
+        escalated = ServiceRequest.objects.get(pk=high.pk)
+        self.assertEqual(escalated.priority, ServiceRequest.URGENT)
+        self.assertTrue(escalated.is_emergency)
+        self.assertTrue(escalated.sla_breached)
+        self.assertEqual(escalated.due_at, high.due_at)
+        self.assertEqual(ServiceRequest.objects.get(pk=urgent.pk).priority, ServiceRequest.URGENT)
+        self.assertEqual(
+            list(SLAEscalation.objects.values_list('service_request_pk', 'previous_priority', 'new_priority')),
+            [(high.pk, ServiceRequest.HIGH, ServiceRequest.URGENT)]
+        )
+        # Still breached: the next scan neither flags nor escalates it again
+        self.assertEqual(sla.scan_breaches(escalate=True), 0)
+        self.assertEqual(SLAEscalation.objects.count(), 1)
+
+    def test_escalation_updates_the_gauges(self):
+        self.create(ServiceRequest.LOW)
+        with mock.patch.object(domain_metrics, '_apply') as apply:
+            with self.captureOnCommitCallbacks(execute=True):
+                sla.scan_breaches(escalate=True)
+        old, new = apply.call_args.args
+        self.assertEqual((old[1], new[1]), (ServiceRequest.LOW, ServiceRequest.MEDIUM))
+
+    def test_policies_are_cached_until_changed(self):
+        self.assertEqual(sla.resolution_minutes(self.category.id, ServiceRequest.LOW), 7 * 24 * 60)
+        with self.assertNumQueries(0):
+            sla.resolution_minutes(self.category.id, ServiceRequest.HIGH)
+        SLAPolicy.objects.create(priority=ServiceRequest.LOW, resolution_minutes=60)
+        self.assertEqual(sla.resolution_minutes(self.category.id, ServiceRequest.LOW), 60)
+        policy = SLAPolicy.objects.create(category=self.category, resolution_minutes=30)
+        self.assertEqual(sla.resolution_minutes(self.category.id, ServiceRequest.LOW), 30)
+        policy.delete()
+        self.assertEqual(sla.resolution_minutes(self.category.id, ServiceRequest.LOW), 60)
+
+
+class DomainMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.agent = UserProfile.objects.create_user('agent', password='pass', role=UserProfile.SUPPORT_AGENT)
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = gauges.SharedStore(os.path.join(directory.name, 'test.metrics'))
+        patcher = mock.patch.object(gauges, '_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, age, **fields):
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title='Meter reading', description='Too high', **fields
+        )
+        ServiceRequest.objects.filter(pk=service_request.pk).update(created_at=timezone.now() - age)
+        return ServiceRequest.objects.get(pk=service_request.pk)
+
+    def value(self, gauge):
+        return gauges.store().get(gauge.labels().key)
+
+    def test_reconcile_recounts_from_the_database(self):
+        oldest = self.create(timedelta(days=2))
+        self.create(timedelta(days=1), priority=ServiceRequest.URGENT)
+        self.create(timedelta(days=3), assigned_to=self.agent)
+        self.create(timedelta(days=4), status=ServiceRequest.CLOSED)
+        gauges.store().set([(domain_metrics.unassigned.labels().key, 99)])
+        domain_metrics.reconcile()
+        open_new = domain_metrics.open_requests.labels(ServiceRequest.NEW, ServiceRequest.MEDIUM).key
+        self.assertEqual(gauges.store().get(open_new), 2)
+        self.assertEqual(self.value(domain_metrics.unassigned), 2)
+        self.assertEqual(self.value(domain_metrics.emergency_queue), 1)
+        self.assertEqual(self.value(domain_metrics.oldest_unassigned), oldest.created_at.timestamp())
+
+    def test_oldest_unassigned_is_found_by_creation_time(self):
+        # Ids out of creation order, as after moving requests between shards
+        self.create(timedelta(0))
+        oldest = self.create(timedelta(days=2))
+        next_oldest = self.create(timedelta(days=1))
+        domain_metrics.reconcile()
+        self.assertEqual(self.value(domain_metrics.oldest_unassigned), oldest.created_at.timestamp())
+        oldest.assigned_to = self.agent
+        with self.captureOnCommitCallbacks(execute=True):
+            oldest.save()
+        self.assertEqual(self.value(domain_metrics.oldest_unassigned), next_oldest.created_at.timestamp())
+
+
+class DuplicateDetectionTests(TestCase):
+    TITLE = 'Gas smell near meter'
+    DESCRIPTION = 'Strong smell of gas next to the meter box by the back door'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = UserProfile.objects.create_user('customer', password='pass')
+        cls.category = ServiceCategory.objects.create(name='Gas Leak', slug='gas-leak')
+
+    def create(self, age=timedelta(0), status=ServiceRequest.NEW, **fields):
+        service_request = ServiceRequest.objects.create(
+            customer=self.customer, category=self.category, title=self.TITLE, description=self.DESCRIPTION,
+            status=status, **fields
+        )
+        ServiceRequest.objects.filter(pk=service_request.pk).update(created_at=timezone.now() - age)
+        return service_request
+
+    def find(self, description=DESCRIPTION, **keys):
+        return duplicates.find_parent(self.TITLE, description, **keys)
+
+    def test_similar_report_for_the_same_meter_is_linked(self):
+        incident = self.create(gas_meter_id='GM-0012')
+        self.assertEqual(self.find(gas_meter_id='gm 0012'), incident.id)
+        reworded = 'Smell of gas next to the meter box by the back door'
+        self.assertEqual(self.find(description=reworded, gas_meter_id='GM0012'), incident.id)
+        self.assertIsNone(self.find(gas_meter_id='GM-0013'))
+        self.assertIsNone(self.find())
+
+    def test_threshold(self):
+        incident = self.create(service_address='12 Main Street')
+        # Only the title's 3 bigrams are shared, of 25: a score of 0.12
+        unrelated = 'Bill arrived twice this month for the same period'
+        self.assertIsNone(self.find(description=unrelated, service_address='12 main st'))
+        with override_settings(SERVICE_REQUEST_DUPLICATE_THRESHOLD=0.12):
+            self.assertEqual(self.find(description=unrelated, service_address='12 main st'), incident.id)
+        self.assertEqual(duplicates.similarity(duplicates.shingles('a b c'), duplicates.shingles('a b c')), 1.0)
+        self.assertEqual(duplicates.similarity(set(), duplicates.shingles('a b')), 0.0)
+
+    def test_only_recent_open_requests_are_candidates(self):
+        self.create(age=timedelta(hours=25), gas_meter_id='GM-0012')
+        self.create(status=ServiceRequest.CLOSED, gas_meter_id='GM-0012')
+        self.assertIsNone(self.find(gas_meter_id='GM-0012'))
+        with override_settings(SERVICE_REQUEST_DUPLICATE_WINDOW_HOURS=48):
+            self.assertIsNotNone(self.find(gas_meter_id='GM-0012'))
+
+    def test_duplicates_link_to_the_root_incident(self):
+        incident = self.create(age=timedelta(hours=2), gas_meter_id='GM-0012')
+        self.create(gas_meter_id='GM-0012', parent=incident)
+        self.client.force_login(self.customer)
+        response = self.client.post('/api/service-requests/requests/', {
+            'category_id': self.category.id, 'title': self.TITLE, 'description': self.DESCRIPTION,
+            'gas_meter_id': 'gm-0012',
+        })
+        self.assertEqual(response.status_code, 201)
+        created = ServiceRequest.objects.order_by('-id').first()
+        self.assertEqual(created.parent_id, incident.id)
+
+
+class NearbyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = UserProfile.objects.create_user('manager', password='pass', role=UserProfile.MANAGER)
+        category = ServiceCategory.objects.create(name='Meter', slug='meter')
+        cls.open, cls.closed = [
+            ServiceRequest.objects.create(
+                customer=cls.manager, category=category, title=title, description='Meter', status=status
+            )
+            for title, status in (('Open', ServiceRequest.NEW), ('Closed', ServiceRequest.CLOSED))
+        ]
+        ServiceRequest.objects.update(latitude=40.0, longitude=-75.0, geohash=geo.encode(40.0, -75.0))
+
+    def test_requests_in_other_statuses_are_dropped_before_the_fetch(self):
+        nearby = geo.within(ServiceRequest.objects.all(), 40.0, -75.0, 1, statuses=ServiceRequest.OPEN_STATUSES)
+        self.assertEqual([service_request.id for service_request in nearby], [self.open.id])
+
+    def test_nearby_lists_open_requests(self):
+        self.client.force_login(self.manager)
+        response = self.client.get('/api/service-requests/requests/nearby/', {'lat': 40.0, 'lon': -75.0})
+        self.assertEqual([entry['id'] for entry in response.data], [self.open.id])
+
+
+SHARD = 'test_shard'
+
+
+@override_settings(REQUEST_SHARD_DATABASES=['default', SHARD])
+class ShardingTests(TestCase):
+    databases = {'default', SHARD}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = ServiceCategory.objects.create(name='Meter', slug='meter')
+        cls.customer = UserProfile.objects.create_user('customer')
+        cls.neighbour = UserProfile.objects.create_user('neighbour')
+        # Replication runs on commit, which a test case never reaches
+        sharding.copy_reference_data(SHARD)
+        cls.start = timezone.now() - timedelta(days=1)
+
+    def create(self, using, customer=None, minutes=0, **kwargs):
+        service_request = ServiceRequest.objects.using(using).create(
+            customer=customer or self.customer, category=self.category, description='Too high', **kwargs
+        )
+        ServiceRequest.objects.using(using).filter(pk=service_request.pk).update(
+            created_at=self.start + timedelta(minutes=minutes)
+        )
+        return service_request
+
+    def test_scatter_merges_parts_in_order(self):
+        for using, minutes in (('default', 0), (SHARD, 1), ('default', 2), (SHARD, 3), (SHARD, 4)):
+            self.create(using, minutes=minutes, title=f'Request {minutes}')
+        requests = sharding.scatter(ServiceRequest.objects.order_by('created_at'))
+        self.assertEqual([r.title for r in requests], [f'Request {n}' for n in range(5)])
+        self.assertEqual(
+            list(requests.order_by('-created_at').values_list('title')[:2]), [('Request 4',), ('Request 3',)]
+        )
+        self.assertEqual(
+            [row['title'] for row in requests.values('title')[1:4]], ['Request 1', 'Request 2', 'Request 3']
+        )
+        self.assertEqual(requests.count(), 5)
+        self.assertEqual(requests[4].title, 'Request 4')
+        with self.assertRaises(IndexError):
+            requests[5]
+
+    def test_scatter_breaks_ties_on_pk(self):
+        for using in ('default', SHARD, 'default', SHARD):
+            self.create(using, title='Same time')
+        pks = [r.pk for r in sharding.scatter(ServiceRequest.objects.order_by('created_at'))]
+        self.assertEqual(pks, sorted(pks))
+
+    def test_scatter_combines_duration_aggregates(self):
+        for using, hours in (('default', 1), (SHARD, 3)):
+            service_request = self.create(using, title='Done')
+            ServiceRequest.objects.using(using).filter(pk=service_request.pk).update(
+                completed_at=self.start + timedelta(hours=hours)
+            )
+        duration = ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField())
+        result = sharding.scatter(ServiceRequest.objects.all()).aggregate(average=Avg(duration), total=Sum(duration))
+        self.assertEqual(result, {'average': timedelta(hours=2), 'total': timedelta(hours=4)})
+
+    def test_ids_come_from_each_databases_range(self):
+        self.assertEqual(
+            list(sharding.allocate_ids(RequestComment, SHARD, 2)), [sharding.ID_RANGE + 1, sharding.ID_RANGE + 2]
+        )
+        self.assertEqual(list(sharding.allocate_ids(RequestComment, SHARD)), [sharding.ID_RANGE + 3])
+        self.assertEqual(self.create(SHARD, title='Numbered').pk, sharding.ID_RANGE + 1)
+
+    def test_ids_continue_after_existing_rows(self):
+        service_request = self.create('default', title='Numbered')
+        RequestComment.objects.create(id=41, service_request=service_request, author=self.customer, text='Old')
+        self.assertEqual(list(sharding.allocate_ids(RequestComment, 'default')), [42])
+
+    def test_move_customer(self):
+        mine = self.create('default', title='Mine')
+        theirs = self.create('default', customer=self.neighbour, title='Theirs', parent=mine)
+        duplicate = self.create('default', title='Duplicate', parent=theirs)
+        RequestComment.objects.create(service_request=mine, author=self.customer, text='Still there?')
+
+        self.assertEqual(sharding.move_customer(self.customer, SHARD), 2)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.request_shard, SHARD)
+        self.assertFalse(ServiceRequest.objects.using('default').filter(customer=self.customer).exists())
+        moved = ServiceRequest.objects.using(SHARD).filter(customer=self.customer)
+        self.assertEqual({r.pk for r in moved}, {mine.pk, duplicate.pk})
+        self.assertEqual(RequestComment.objects.using(SHARD).get().service_request_id, mine.pk)
+        # Links across databases are cleared both ways
+        self.assertIsNone(moved.get(pk=duplicate.pk).parent_id)
+        self.assertIsNone(ServiceRequest.objects.using('default').get(pk=theirs.pk).parent_id)
+
+    def test_move_conflict_leaves_the_customer_in_place(self):
+        self.create('default', title='Mine')
+        with mock.patch.object(sharding, '_fingerprint', side_effect=['before', 'after']):
+            with self.assertRaises(sharding.MoveConflict):
+                sharding.move_customer(self.customer, SHARD)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.request_shard, '')
+        self.assertEqual(ServiceRequest.objects.using('default').filter(customer=self.customer).count(), 1)
+        # The next try discards the copy left behind
+        self.assertEqual(sharding.move_customer(self.customer, SHARD), 1)
+        self.assertEqual(ServiceRequest.objects.using(SHARD).filter(customer=self.customer).count(), 1)
+
+
+class AdminSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = UserProfile.objects.create_superuser('admin', 'admin@example.com', None)
+        category = ServiceCategory.objects.create(name='Meter', slug='meter')
+        cls.service_request = ServiceRequest.objects.create(
+            customer=cls.admin, category=category, title='Leaking meter', description='Hissing'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def search(self, **params):
+        response = self.client.get('/admin/service_requests/servicerequest/', params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_indexed_search_by_default(self):
+        self.assertEqual(self.search(q=self.service_request.request_id), [self.service_request])
+        self.assertEqual(self.search(q='leaking'), [])
+
+    def test_full_text_search_on_request(self):
+        self.assertEqual(self.search(q='leaking', search_mode='full'), [self.service_request])
@@ -1,12 +1,18 @@
 # service_requests/views.py
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import generics, viewsets, permissions, status, filters
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
-from django.utils import timezone
 from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.http import Http404
 
 from .models import (
+    ArchivedServiceRequest,
     ServiceCategory,
     ServiceRequest,
     RequestAttachment,
@@ -20,8 +26,15 @@ from .serializers import (
     ServiceRequestCreateSerializer,
     RequestAttachmentSerializer,
     RequestCommentSerializer,
-    RequestStatusHistorySerializer
+    RequestStatusHistorySerializer,
+    ThreadCommentSerializer
 )
+from accounts.models import UserProfile
+from accounts.serializers import UserProfileSerializer
+from gas_utility_portal.compiled_serializers import CompiledListMixin
+from gas_utility_portal.profiling import CProfileViewMixin
+from gas_utility_portal.sparse_fields import SparseFieldsViewMixin
+from . import archive, assignment, emergency, geo, sharding, sync, workflow
 
 class IsCustomerOrStaff(permissions.BasePermission):
     """
@@ -39,7 +52,44 @@ class IsCustomerOrStaff(permissions.BasePermission):
         # Customers can only see their own requests
         return obj.customer == request.user
 
-class ServiceCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CommentCursorPagination(CursorPagination):
+    """
+    Comment thread pages, oldest first. Ids do not follow creation order
+    once requests move between shard databases (each allocates its own id
+    range), so pages are ordered by creation time, then id
+    """
+    ordering = ('created_at', 'id')
+    page_size_query_param = 'page_size'
+    
+    def __init__(self):
+        self.page_size = getattr(settings, 'COMMENT_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'COMMENT_MAX_PAGE_SIZE', 200)
+
+def parse_since(value, comments):
+    """
+    Filter for comments after ``value``, the id of one of ``comments`` or
+    an ISO 8601 timestamp; None if it is neither
+    """
+    if value.isascii() and value.isdigit():
+        if len(value) > 18:
+            return None
+        anchor = comments.filter(id=int(value)).values('created_at', 'id').first()
+        if anchor is None:
+            return None
+        # Creation order, as the pages: ids alone are not ordered across shards
+        return Q(created_at__gt=anchor['created_at']) | Q(created_at=anchor['created_at'], id__gt=anchor['id'])
+    # An unescaped '+' in the query string arrives as a space
+    try:
+        moment = parse_datetime(value.replace(' ', '+'))
+    except ValueError:  # Well formed but not a real date or time
+        return None
+    if moment is None:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return Q(created_at__gt=moment)
+
+class ServiceCategoryViewSet(CProfileViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing service categories
     """
@@ -49,24 +99,50 @@ class ServiceCategoryViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'description']
 
-class ServiceRequestViewSet(viewsets.ModelViewSet):
+class ServiceRequestViewSet(CProfileViewMixin, CompiledListMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
-    API endpoint for service requests
+    API endpoint for service requests; reads accept ?fields= and ?expand=
     """
     permission_classes = [IsCustomerOrStaff]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description', 'request_id', 'service_address']
-    ordering_fields = ['created_at', 'updated_at', 'status', 'priority']
+    ordering_fields = ['created_at', 'updated_at', 'last_activity_at', 'status', 'priority']
     ordering = ['-created_at']
     
     def get_queryset(self):
         user = self.request.user
         if user.is_staff_member:
             # Staff can see all requests
-            return ServiceRequest.objects.all()
+            queryset = ServiceRequest.objects.all()
         else:
-            # Customers can only see their own requests
-            return ServiceRequest.objects.filter(customer=user)
+            # Customers can only see their own requests, all in one shard
+            queryset = ServiceRequest.objects.using(sharding.database_of(user)).filter(customer=user)
+        return self.optimize_queryset(queryset)
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.user.is_staff_member:
+            # Every shard, merged in the requested order
+            return sharding.scatter(queryset)
+        return queryset
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+        # Archived requests stay readable (read-only) through retrieve
+        user = self.request.user
+        queryset = ArchivedServiceRequest.objects.select_related('customer', 'category')
+        if user.is_staff_member:
+            queryset = sharding.scatter(queryset)
+        else:
+            queryset = queryset.using(sharding.database_of(user)).filter(customer=user)
+        archived = generics.get_object_or_404(queryset, pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        obj = archive.materialize(archived, user)
+        self.check_object_permissions(self.request, obj)
+        return obj
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -76,11 +152,218 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         return ServiceRequestDetailSerializer
     
     def perform_create(self, serializer):
-        serializer.save(customer=self.request.user)
+        service_request = serializer.save(customer=self.request.user)
+        if assignment.auto_assign_enabled():
+            assignment.auto_assign(service_request)
+    
+    @action(detail=False, methods=['get'])
+    def emergency_queue(self, request):
+        """
+        Open urgent and emergency-category requests, most urgent then oldest
+        first (staff only).
+        
+        With ?since=<cursor> only requests changed after the cursor are
+        returned, waiting up to ?wait= seconds for one to appear; those
+        resolved, closed or cancelled since are included with their status,
+        for the client to drop.
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff can view the emergency queue'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        since = request.query_params.get('since')
+        if since is None:
+            cursor = emergency.cursor()
+            entries = emergency.queue()
+        else:
+            try:
+                since = parse_datetime(since.replace(' ', '+'))
+            except ValueError:
+                since = None
+            if since is None:
+                return Response(
+                    {'error': 'since must be a cursor returned by this endpoint'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            try:
+                wait = float(request.query_params.get('wait', 0))
+            except ValueError:
+                wait = 0
+            wait = max(0, min(wait, getattr(settings, 'EMERGENCY_QUEUE_MAX_WAIT_SECONDS', 5)))
+            cursor, entries = emergency.wait_for_changes(since, wait)
+        
+        serializer = ServiceRequestListSerializer(entries, many=True, context=self.get_serializer_context())
+        return Response({'cursor': cursor, 'results': serializer.data})
+    
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        """
+        Open requests assigned to the current agent, most recent activity
+        first (staff only)
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff have a request queue'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        # Reads sr_activity_idx backwards; no sort step
+        queryset = sharding.scatter(ServiceRequestListSerializer.optimize_queryset(
+            ServiceRequest.objects.filter(assigned_to=request.user, status__in=ServiceRequest.OPEN_STATUSES)
+        ).order_by('-last_activity_at', '-id'))
+        page = self.paginate_queryset(queryset)
+        serializer = ServiceRequestListSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def emergency_latency(self, request):
+        """
+        Time-to-first-assignment histogram for emergency requests created in
+        the last ?days= days (default 7) (staff only)
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff can view dispatch latency'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            days = float(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'error': 'days must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        max_days = getattr(settings, 'EMERGENCY_LATENCY_MAX_DAYS', 366)
+        # Also refuses nan, which fails every comparison
+        if not 0 < days <= max_days:
+            return Response(
+                {'error': f'days must be above 0 and at most {max_days}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(emergency.dispatch_latency(timezone.now() - timedelta(days=days)))
+    
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Open requests within ?radius_km= (default 1) of ?lat=&lon=, nearest
+        first, each with its distance_km; ?limit= caps the results (staff
+        only)
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff can search requests by location'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lon'])
+            radius_km = float(request.query_params.get('radius_km', 1))
+            limit = int(request.query_params.get('limit', 100))
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'lat and lon are required; lat, lon and radius_km must be numbers and limit an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, getattr(settings, 'GEO_NEARBY_MAX_RESULTS', 500)))
+        max_radius_km = getattr(settings, 'GEO_NEARBY_MAX_RADIUS_KM', 25)
+        if radius_km > max_radius_km:
+            return Response(
+                {'error': f'radius_km may be at most {max_radius_km}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = ServiceRequestListSerializer.optimize_queryset(
+            ServiceRequest.objects.filter(status__in=ServiceRequest.OPEN_STATUSES)
+        ).order_by()
+        try:
+            nearby = geo.within(
+                queryset, latitude, longitude, radius_km, limit=limit, statuses=ServiceRequest.OPEN_STATUSES
+            )
+        except geo.GeoError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = ServiceRequestListSerializer(nearby, many=True, context=self.get_serializer_context())
+        return Response([
+            {**data, 'distance_km': service_request.distance_km}
+            for data, service_request in zip(serializer.data, nearby)
+        ])
+    
+    @action(detail=False, methods=['get'])
+    def dispatch_batches(self, request):
+        """
+        Open requests needing a field visit, grouped into dispatch batches
+        for each of the next ?days= days (default 1); ?batch_size= and
+        ?radius_km= override the configured batch limits (staff only)
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff can plan dispatch'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            days = int(request.query_params.get('days', 1))
+            batch_size = int(request.query_params.get('batch_size', 0)) or None
+            radius_km = float(request.query_params.get('radius_km', 0)) or None
+        except ValueError:
+            return Response(
+                {'error': 'days and batch_size must be integers and radius_km a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= days <= 14 or (batch_size or 1) < 1 or (radius_km or 1) <= 0:
+            return Response(
+                {'error': 'days must be 1 to 14; batch_size and radius_km must be positive'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(geo.dispatch_plan(days, batch_size, radius_km))
+    
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Delta sync for field agents: the current user's assigned requests
+        and their comments, attachment metadata and status history changed
+        since ?cursor=, plus tombstones for what was deleted or reassigned
+        away (staff only).
+        
+        Omit the cursor for a full sync. Keep calling with the returned
+        cursor while has_more is true; ?limit= caps each stream per page.
+        """
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'Only staff can sync assigned requests'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            limit = int(request.query_params.get('limit', getattr(settings, 'SYNC_PAGE_SIZE', 500)))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, getattr(settings, 'SYNC_MAX_PAGE_SIZE', 2000)))
+        
+        try:
+            data = sync.changes(
+                request.user, request.query_params.get('cursor'), limit,
+                context=self.get_serializer_context()
+            )
+        except sync.CursorExpired as e:
+            return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+        except sync.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
     
     @action(detail=True, methods=['get'])
     def comments(self, request, pk=None):
-        """Get comments for a specific request"""
+        """
+        Get comments for a specific request, oldest first, in cursor pages
+        of ?page_size=; ?since= a comment id or timestamp returns only
+        later comments, for polling. Authors are listed once per page in
+        ``authors``, keyed by the comments' ``author`` ids
+        """
         service_request = self.get_object()
         user = request.user
         
@@ -90,8 +373,25 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         else:
             comments = service_request.comments.filter(is_internal=False)
         
-        serializer = RequestCommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        since = request.query_params.get('since')
+        if since:
+            newer = parse_since(since, comments)
+            if newer is None:
+                return Response(
+                    {'error': 'since must be the id of a comment on this request or an ISO 8601 timestamp'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            comments = comments.filter(newer)
+        
+        paginator = CommentCursorPagination()
+        # No view: its OrderingFilter would override the thread order
+        page = paginator.paginate_queryset(comments, request)
+        authors = UserProfile.objects.filter(id__in={comment.author_id for comment in page})
+        response = paginator.get_paginated_response(ThreadCommentSerializer(page, many=True).data)
+        response.data['authors'] = {
+            author['id']: author for author in UserProfileSerializer(authors, many=True).data
+        }
+        return response
     
     @action(detail=True, methods=['get'])
     def attachments(self, request, pk=None):
@@ -110,8 +410,7 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         if is_internal and not request.user.is_staff_member:
             is_internal = False
         
-        comment = RequestComment.objects.create(
-            service_request=service_request,
+        comment = service_request.comments.create(
             author=request.user,
             text=request.data.get('text', ''),
             is_internal=is_internal
@@ -131,8 +430,7 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        attachment = RequestAttachment.objects.create(
-            service_request=service_request,
+        attachment = service_request.attachments.create(
             file=file,
             file_name=file.name,
             uploaded_by=request.user
@@ -154,34 +452,12 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         new_status = request.data.get('status')
         comment = request.data.get('comment', '')
         
-        # Validate status
-        valid_statuses = [choice[0] for choice in ServiceRequest.STATUS_CHOICES]
-        if new_status not in valid_statuses:
-            return Response(
-                {'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Track status change
-        previous_status = service_request.status
-        
-        # Update status
-        service_request.status = new_status
-        
-        # If status is completed, set completed_at
-        if new_status == ServiceRequest.COMPLETED and previous_status != ServiceRequest.COMPLETED:
-            service_request.completed_at = timezone.now()
-        
-        service_request.save()
-        
-        # Create status history entry
-        status_history = RequestStatusHistory.objects.create(
-            service_request=service_request,
-            previous_status=previous_status,
-            new_status=new_status,
-            changed_by=request.user,
-            comment=comment
-        )
+        try:
+            workflow.transition(service_request, new_status, request.user, comment)
+        except workflow.TransitionNotPermitted as e:
+            return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except workflow.TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         # Return updated request
         serializer = self.get_serializer(service_request)
@@ -201,10 +477,15 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         
         from accounts.models import UserProfile
         
+        previous_agent_id = service_request.assigned_to_id
+        is_open = service_request.status in workflow.OPEN_STATUSES
+        
         # If staff_id is None, unassign
         if staff_id is None:
             service_request.assigned_to = None
             service_request.save()
+            if is_open:
+                assignment.record_reassignment(previous_agent_id, None)
             return Response({'success': 'Request unassigned'})
         
         # Find the staff member
@@ -222,6 +503,8 @@ class ServiceRequestViewSet(viewsets.ModelViewSet):
         # Assign the request
         service_request.assigned_to = staff_member
         service_request.save()
+        if is_open:
+            assignment.record_reassignment(previous_agent_id, staff_member.id)
         
         serializer = self.get_serializer(service_request)
         return Response(serializer.data)
\ No newline at end of file
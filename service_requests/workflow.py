@@ -0,0 +1,252 @@
+# service_requests/workflow.py
+"""
+Status workflow for service requests.
+
+The declarative ``ServiceRequest.TRANSITIONS`` map is compiled once at import
+into frozen lookup tables, so validating a transition is a dictionary lookup
+and never touches the database. The API, the admin and bulk operations all
+go through ``transition``/``bulk_transition`` so history, side-effect hooks
+and notifications stay consistent.
+"""
+from types import MappingProxyType
+
+from django.db import router, transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from . import sharding
+from .models import ServiceRequest, RequestStatusHistory
+
+STAFF_ROLES = frozenset([UserProfile.SUPPORT_AGENT, UserProfile.MANAGER, UserProfile.ADMIN])
+
+# Display labels, built once instead of dict(STATUS_CHOICES) per call
+STATUS_LABELS = MappingProxyType(dict(ServiceRequest.STATUS_CHOICES))
+PRIORITY_LABELS = MappingProxyType(dict(ServiceRequest.PRIORITY_CHOICES))
+VALID_STATUSES = frozenset(STATUS_LABELS)
+
+# Lower rank is more urgent; used to order queues and backlogs
+PRIORITY_RANK = MappingProxyType({
+    ServiceRequest.URGENT: 0,
+    ServiceRequest.HIGH: 1,
+    ServiceRequest.MEDIUM: 2,
+    ServiceRequest.LOW: 3,
+})
+
+# Statuses in which a request still needs work
+OPEN_STATUSES = frozenset(ServiceRequest.OPEN_STATUSES)
+
+
+def priority_rank():
+    """
+    Query expression ranking ``priority`` by PRIORITY_RANK
+    """
+    return Case(
+        *[When(priority=priority, then=Value(rank)) for priority, rank in PRIORITY_RANK.items()],
+        default=Value(len(PRIORITY_RANK)),
+        output_field=IntegerField()
+    )
+
+
+def _compile(transitions):
+    allowed = {}
+    guards = {}
+    for source, targets in transitions.items():
+        allowed[source] = frozenset(targets)
+        for target, roles in targets.items():
+            guards[(source, target)] = STAFF_ROLES if roles is None else frozenset(roles)
+    for status in VALID_STATUSES:
+        allowed.setdefault(status, frozenset())
+    return MappingProxyType(allowed), MappingProxyType(guards)
+
+
+# status -> frozenset of reachable statuses, (source, target) -> allowed roles
+ALLOWED_TRANSITIONS, TRANSITION_ROLES = _compile(ServiceRequest.TRANSITIONS)
+
+# Sent after the surrounding transaction commits, once per changed request
+status_changed = Signal()
+
+_enter_hooks = {}
+
+
+class TransitionError(Exception):
+    """
+    Base class for rejected status transitions
+    """
+
+
+class InvalidTransition(TransitionError):
+    """
+    The target status is unknown or not reachable from the current status
+    """
+
+
+class TransitionNotPermitted(TransitionError):
+    """
+    The transition exists but the user's role may not perform it
+    """
+
+
+def on_enter(status, fields=()):
+    """
+    Register a side-effect hook run when a request enters ``status``.
+
+    Hooks are called as ``hook(service_request, previous_status, user)``
+    before the request is saved and may only modify the model fields they
+    list in ``fields`` so bulk transitions know what to write back.
+    """
+    def decorator(func):
+        _enter_hooks.setdefault(status, []).append((func, tuple(fields)))
+        return func
+    return decorator
+
+
+@on_enter(ServiceRequest.COMPLETED, fields=['completed_at'])
+def _set_completed_at(service_request, previous_status, user):
+    service_request.completed_at = timezone.now()
+
+
+def _record_activity(service_request, previous_status, user):
+    service_request.last_activity_at = timezone.now()
+
+
+# Every status change counts as activity (see service_requests.activity)
+for _status in STATUS_LABELS:
+    on_enter(_status, fields=['last_activity_at'])(_record_activity)
+
+
+def role_of(user):
+    """
+    Workflow role for ``user``; superusers act as admins whatever their role
+    """
+    return UserProfile.ADMIN if user.is_superuser else user.role
+
+
+def allowed_targets(current_status, role=None):
+    """
+    Return the statuses reachable from ``current_status``, optionally
+    restricted to those the given role may perform
+    """
+    targets = ALLOWED_TRANSITIONS.get(current_status, frozenset())
+    if role is None:
+        return targets
+    return frozenset(t for t in targets if role in TRANSITION_ROLES[(current_status, t)])
+
+
+def check_transition(current_status, new_status, user):
+    """
+    Raise a TransitionError if ``user`` may not move a request from
+    ``current_status`` to ``new_status``
+    """
+    if new_status not in VALID_STATUSES:
+        raise InvalidTransition(
+            f'Invalid status. Must be one of: {", ".join(STATUS_LABELS)}'
+        )
+    if new_status not in ALLOWED_TRANSITIONS[current_status]:
+        allowed = ', '.join(sorted(ALLOWED_TRANSITIONS[current_status])) or 'none'
+        raise InvalidTransition(
+            f'Cannot change status from {current_status} to {new_status}. '
+            f'Allowed: {allowed}'
+        )
+    if role_of(user) not in TRANSITION_ROLES[(current_status, new_status)]:
+        raise TransitionNotPermitted(
+            f'Your role may not change status from {current_status} to {new_status}'
+        )
+
+
+def _run_hooks(service_request, previous_status, user):
+    fields = set()
+    for hook, hook_fields in _enter_hooks.get(service_request.status, ()):
+        hook(service_request, previous_status, user)
+        fields.update(hook_fields)
+    return fields
+
+
+def _notify(changes, user):
+    for service_request, previous_status in changes:
+        status_changed.send(
+            sender=ServiceRequest,
+            service_request=service_request,
+            previous_status=previous_status,
+            new_status=service_request.status,
+            changed_by=user,
+        )
+
+
+def apply_transition(service_request, previous_status, user, comment=''):
+    """
+    Run hooks, record history and schedule notifications for a request
+    whose ``status`` attribute has already been set to the new value.
+
+    Returns the set of extra fields the hooks modified; the caller is
+    responsible for saving the request.
+    """
+    fields = _run_hooks(service_request, previous_status, user)
+    service_request.status_history.create(
+        previous_status=previous_status,
+        new_status=service_request.status,
+        changed_by=user,
+        comment=comment
+    )
+    transaction.on_commit(lambda: _notify([(service_request, previous_status)], user))
+    return fields
+
+
+def transition(service_request, new_status, user, comment=''):
+    """
+    Validate and perform a single status transition
+    """
+    previous_status = service_request.status
+    check_transition(previous_status, new_status, user)
+
+    with transaction.atomic(using=router.db_for_write(ServiceRequest, instance=service_request)):
+        service_request.status = new_status
+        fields = apply_transition(service_request, previous_status, user, comment)
+        service_request.save(update_fields=['status', 'updated_at', *fields])
+    return service_request
+
+
+def bulk_transition(queryset, new_status, user, comment=''):
+    """
+    Move every request in ``queryset`` that may legally reach ``new_status``.
+
+    Requests whose current status does not allow the move are skipped.
+    Returns a tuple ``(changed, skipped)`` of counts.
+    """
+    if new_status not in VALID_STATUSES:
+        raise InvalidTransition(
+            f'Invalid status. Must be one of: {", ".join(STATUS_LABELS)}'
+        )
+    role = role_of(user)
+    sources = [
+        source for source, targets in ALLOWED_TRANSITIONS.items()
+        if new_status in targets and role in TRANSITION_ROLES[(source, new_status)]
+    ]
+    total = queryset.count()
+    using = queryset.db
+
+    with transaction.atomic(using=using):
+        requests = list(queryset.filter(status__in=sources).select_for_update())
+        now = timezone.now()
+        fields = {'status', 'updated_at'}
+        changes = []
+        history = []
+        for service_request in requests:
+            previous_status = service_request.status
+            service_request.status = new_status
+            service_request.updated_at = now
+            fields |= _run_hooks(service_request, previous_status, user)
+            changes.append((service_request, previous_status))
+            history.append(RequestStatusHistory(
+                service_request=service_request,
+                previous_status=previous_status,
+                new_status=new_status,
+                changed_by=user,
+                comment=comment
+            ))
+        ServiceRequest.objects.db_manager(using).bulk_update(requests, sorted(fields), batch_size=500)
+        sharding.assign_ids(RequestStatusHistory, history, using)
+        RequestStatusHistory.objects.db_manager(using).bulk_create(history, batch_size=500)
+        transaction.on_commit(lambda: _notify(changes, user))
+    return len(requests), total - len(requests)